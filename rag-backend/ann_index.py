@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Índice aproximado (IVF con cuantización de producto) para el índice local.
+
+Los vectores se reparten en nlist listas según su centroide más cercano
+(k-means) y el residuo respecto al centroide se comprime con PQ en m bytes.
+Una búsqueda solo recorre las nprobe listas más cercanas y calcula las
+distancias con tablas precalculadas (ADC), así que el coste crece con
+nprobe y no con el tamaño del corpus. nprobe es el control de
+recall/latencia.
+
+Uso:
+    python ann_index.py build ./local_index --nlist 1024 --m 64
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ANN_DIR = "ann"
+ANN_FILE = "ann.json"
+ASSIGN_BATCH = 8192
+
+
+def nearest_centroids(data, centroids, batch_size: int = ASSIGN_BATCH):
+    """Índice del centroide más cercano (L2) de cada fila de data"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), batch_size):
+        block = np.asarray(data[start:start + batch_size], dtype=np.float32)
+        distances = centroid_norms - 2 * block @ centroids.T
+        assignments[start:start + batch_size] = np.argmin(distances, axis=1)
+    return assignments
+
+
+def kmeans(data, k: int, iterations: int = 10, seed: int = 0):
+    """k-means (Lloyd) vectorizado; los clusters vacíos se reinician con puntos al azar"""
+    data = np.asarray(data, dtype=np.float32)
+    if len(data) < k:
+        raise ValueError(f"Need at least {k} training vectors, got {len(data)}")
+
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = nearest_centroids(data, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        order = np.argsort(assignments, kind="stable")
+        starts = np.searchsorted(assignments[order], np.arange(k))
+        non_empty = counts > 0
+
+        sums = np.add.reduceat(data[order], starts[non_empty], axis=0)
+        centroids[non_empty] = sums / counts[non_empty, np.newaxis]
+
+        empty = np.flatnonzero(~non_empty)
+        if empty.size:
+            centroids[empty] = data[rng.choice(len(data), empty.size, replace=False)]
+
+    return centroids
+
+
+class IVFPQIndex:
+    """
+    Índice IVF-PQ sobre vectores normalizados, implementado con NumPy.
+
+    Admite inserciones incrementales (add) después de entrenar y se guarda en
+    disco como arrays .npy que se abren con mmap al cargar.
+    """
+
+    def __init__(self, dimensions: int, nlist: int = 1024, m: int = 64, nbits: int = 8):
+        if dimensions % m:
+            raise ValueError(f"dimensions ({dimensions}) must be divisible by m ({m})")
+        if nbits != 8:
+            raise ValueError("Only 8-bit PQ codes are supported")
+
+        self.dimensions = dimensions
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self.dsub = dimensions // m
+        self.centroids = None
+        self.codebooks = None
+        self._cached_centroid_norms = None
+        self._cached_codebook_norms = None
+        self.count = 0
+
+        # Listas guardadas (contiguas, posiblemente en mmap) + añadidos pendientes
+        self._codes = np.zeros((0, m), dtype=np.uint8)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        self._pending_codes = [[] for _ in range(nlist)]
+        self._pending_ids = [[] for _ in range(nlist)]
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors, iterations: int = 10, seed: int = 0):
+        """Entrena los centroides IVF y los codebooks PQ con una muestra"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.centroids = kmeans(vectors, self.nlist, iterations, seed)
+        self._cached_centroid_norms = None
+        self._cached_codebook_norms = None
+
+        residuals = vectors - self.centroids[nearest_centroids(vectors, self.centroids)]
+        self.codebooks = np.stack([
+            kmeans(residuals[:, j * self.dsub:(j + 1) * self.dsub], 2 ** self.nbits, iterations, seed + j)
+            for j in range(self.m)
+        ])
+
+    def _encode(self, residuals):
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = residuals[:, j * self.dsub:(j + 1) * self.dsub]
+            codes[:, j] = nearest_centroids(sub, self.codebooks[j])
+        return codes
+
+    def add(self, vectors, ids):
+        """Añade vectores (normalizados) con sus identificadores de fila"""
+        if not self.is_trained:
+            raise RuntimeError("The index must be trained before adding vectors")
+
+        ids = np.asarray(ids, dtype=np.int64)
+        for start in range(0, len(ids), ASSIGN_BATCH):
+            block = np.asarray(vectors[start:start + ASSIGN_BATCH], dtype=np.float32)
+            block_ids = ids[start:start + ASSIGN_BATCH]
+            lists = nearest_centroids(block, self.centroids)
+            codes = self._encode(block - self.centroids[lists])
+            for list_id in np.unique(lists):
+                mask = lists == list_id
+                self._pending_codes[list_id].append(codes[mask])
+                self._pending_ids[list_id].append(block_ids[mask])
+        self.count += len(ids)
+
+    def _list(self, list_id: int):
+        start, end = self._list_offsets[list_id], self._list_offsets[list_id + 1]
+        codes, ids = self._codes[start:end], self._ids[start:end]
+        if self._pending_ids[list_id]:
+            codes = np.concatenate([codes] + self._pending_codes[list_id])
+            ids = np.concatenate([ids] + self._pending_ids[list_id])
+        return codes, ids
+
+    def search(self, query_vector, top_k: int = 10, nprobe: int = 16, allowed=None):
+        """
+        Devuelve (ids, scores aproximados de coseno) de los top_k candidatos.
+
+        allowed es una máscara booleana opcional por id: los ids que no
+        están permitidos se descartan antes de calcular distancias.
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        nprobe = min(nprobe, self.nlist)
+        coarse = self._centroid_norms - 2 * self.centroids @ query
+        probes = np.argpartition(coarse, nprobe - 1)[:nprobe]
+
+        all_codes, all_ids, all_probes = [], [], []
+        for position, list_id in enumerate(probes):
+            codes, ids = self._list(list_id)
+            if allowed is not None and len(ids):
+                keep = allowed[ids]
+                codes, ids = codes[keep], ids[keep]
+            if len(ids):
+                all_codes.append(codes)
+                all_ids.append(ids)
+                all_probes.append(np.full(len(ids), position, dtype=np.int64))
+
+        if not all_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        codes = np.concatenate(all_codes)
+        ids = np.concatenate(all_ids)
+        row_probes = np.concatenate(all_probes)
+
+        # Tablas ADC de todas las listas a la vez: distancia del residuo de la
+        # consulta (por subespacio) a cada centroide PQ, de forma (nprobe, m, 256)
+        residuals = (query - self.centroids[probes]).reshape(nprobe, self.m, self.dsub)
+        dots = np.matmul(residuals.transpose(1, 0, 2), self.codebooks.transpose(0, 2, 1)).transpose(1, 0, 2)
+        tables = (residuals ** 2).sum(axis=2)[:, :, np.newaxis] - 2 * dots + self._codebook_norms
+
+        ksub = 2 ** self.nbits
+        lookup = (row_probes[:, np.newaxis] * self.m + np.arange(self.m)) * ksub + codes
+        distances = tables.ravel()[lookup].sum(axis=1)
+
+        k = min(top_k, len(ids))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        # Para vectores unitarios: coseno = 1 - distancia² / 2
+        return ids[best], 1.0 - distances[best] / 2.0
+
+    @property
+    def _centroid_norms(self):
+        if self._cached_centroid_norms is None:
+            self._cached_centroid_norms = (self.centroids ** 2).sum(axis=1)
+        return self._cached_centroid_norms
+
+    @property
+    def _codebook_norms(self):
+        if self._cached_codebook_norms is None:
+            self._cached_codebook_norms = (self.codebooks ** 2).sum(axis=2)
+        return self._cached_codebook_norms
+
+    def save(self, path: str):
+        """Guarda el índice en un directorio (las listas se compactan)"""
+        os.makedirs(path, exist_ok=True)
+        codes, ids, offsets = [], [], [0]
+        for list_id in range(self.nlist):
+            list_codes, list_ids = self._list(list_id)
+            codes.append(list_codes)
+            ids.append(list_ids)
+            offsets.append(offsets[-1] + len(list_ids))
+
+        self._codes = np.concatenate(codes) if codes else np.zeros((0, self.m), dtype=np.uint8)
+        self._ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+        self._list_offsets = np.asarray(offsets, dtype=np.int64)
+        self._pending_codes = [[] for _ in range(self.nlist)]
+        self._pending_ids = [[] for _ in range(self.nlist)]
+
+        # Cada fichero se escribe aparte y se reemplaza: los servidores que tienen
+        # abiertos con mmap los anteriores siguen leyéndolos sin errores
+        arrays = {
+            "centroids.npy": self.centroids,
+            "codebooks.npy": self.codebooks,
+            "codes.npy": self._codes,
+            "ids.npy": self._ids,
+            "list_offsets.npy": self._list_offsets,
+        }
+        for name, array in arrays.items():
+            with open(os.path.join(path, name + ".tmp"), "wb") as f:
+                np.save(f, array)
+        # Los datos se reemplazan antes que la cabecera, como en quantized_index.py
+        for name in arrays:
+            os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+        with open(os.path.join(path, ANN_FILE + ".tmp"), "w") as f:
+            json.dump({
+                "type": "ivfpq",
+                "dimensions": self.dimensions,
+                "nlist": self.nlist,
+                "m": self.m,
+                "nbits": self.nbits,
+                "count": self.count,
+            }, f)
+        os.replace(os.path.join(path, ANN_FILE + ".tmp"), os.path.join(path, ANN_FILE))
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Carga un índice guardado abriendo todos los arrays con mmap.
+
+        Así los workers que sirven el mismo índice comparten las páginas de la
+        caché del sistema operativo en vez de tener cada uno su copia.
+        """
+        with open(os.path.join(path, ANN_FILE)) as f:
+            header = json.load(f)
+
+        index = cls(header["dimensions"], header["nlist"], header["m"], header["nbits"])
+        index.count = header["count"]
+        index.centroids = np.load(os.path.join(path, "centroids.npy"), mmap_mode="r")
+        index.codebooks = np.load(os.path.join(path, "codebooks.npy"), mmap_mode="r")
+        index._codes = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+        index._ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        index._list_offsets = np.load(os.path.join(path, "list_offsets.npy"), mmap_mode="r")
+        return index
+
+
+def build_for_local_index(index_path: str, nlist: int = 1024, m: int = 64, train_size: int = 100000,
+                          iterations: int = 10, seed: int = 0):
+    """Entrena y construye el índice IVF-PQ de un índice local existente"""
+    from local_index import LocalVectorIndex
+
+    local = LocalVectorIndex(index_path, use_quantized=False)
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(local.count, min(train_size, local.count), replace=False))
+
+    ann = IVFPQIndex(local.dimensions, nlist=nlist, m=m)
+    ann.train(local.vectors[sample_rows], iterations=iterations, seed=seed)
+    ann.add(local.vectors, np.arange(local.count))
+    ann.save(os.path.join(index_path, ANN_DIR))
+    local.close()
+    return ann
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye el índice aproximado IVF-PQ de un índice local")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("path", help="Directorio del índice local")
+    build_parser.add_argument("--nlist", type=int, default=1024, help="Número de listas (centroides IVF)")
+    build_parser.add_argument("--m", type=int, default=64, help="Subcuantizadores PQ (bytes por vector)")
+    build_parser.add_argument("--train-size", type=int, default=100000)
+    build_parser.add_argument("--iterations", type=int, default=10)
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+    ann = build_for_local_index(args.path, args.nlist, args.m, args.train_size, args.iterations)
+    print(f"✅ Índice IVF-PQ con {ann.count} vectores creado en {time.perf_counter() - start:.1f} s")
+    sys.exit(0)
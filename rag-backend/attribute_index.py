@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Índice de atributos (metadatos) del índice local, para filtrar búsquedas.
+
+Cada campo de metadatos de los chunks (crop, region, language, source...)
+es una columna con un código uint32 por fila y un diccionario de valores:
+
+    attributes/attributes.json   {"count": filas, "fields": {campo: [valor, ...]}}
+    attributes/<campo>.u32       código de cada fila (0 = sin valor, i = valor i-1)
+
+Un filtro se resuelve comparando las columnas de sus campos (4 bytes por
+fila y campo, frente a los 6 KB del vector) y da una máscara de filas que
+se aplica antes de la búsqueda vectorial, IVF-PQ o BM25: las consultas
+filtradas recorren menos filas en vez de filtrar después de la búsqueda. Las
+columnas se abren con mmap, como los vectores. Solo se indexan los valores
+escalares; las listas se ignoran.
+
+LocalIndexWriter mantiene el índice al añadir chunks. Para un índice creado
+antes de que existiera:
+
+    python attribute_index.py build ./local_index
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from filters import FIELD_PATTERN, RESERVED_FIELDS, is_scalar, normalize_filters
+
+ATTR_DIR = "attributes"
+ATTR_FILE = "attributes.json"
+
+
+def value_key(value) -> str:
+    """Representación de un valor en el diccionario (distingue "1", 1 y true)"""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def chunk_attributes(chunk):
+    """Campos de metadatos indexables de un chunk"""
+    return {
+        field: value for field, value in chunk.items()
+        if field not in RESERVED_FIELDS and FIELD_PATTERN.match(field) and is_scalar(value)
+    }
+
+
+class AttributeWriter:
+    """
+    Añade las columnas de atributos de cada lote de chunks.
+
+    Un campo que aparece por primera vez se rellena con 0 en las filas
+    anteriores. Con append=True continúa el índice existente; si el índice
+    local tenía filas pero no atributos, se construyen antes leyendo
+    chunks.jsonl.
+    """
+
+    def __init__(self, index_path: str, count: int = 0, append: bool = False):
+        self.path = os.path.join(index_path, ATTR_DIR)
+        self.count = 0
+        self._values = {}
+        self._codes = {}
+        self._files = {}
+
+        header_path = os.path.join(self.path, ATTR_FILE)
+        if append and os.path.exists(header_path):
+            with open(header_path, encoding="utf-8") as f:
+                header = json.load(f)
+            # Una escritura que no llegó a cerrar el índice local puede haber dejado filas de más
+            self.count = min(header["count"], count)
+            for field, values in header["fields"].items():
+                self._values[field] = values
+                self._codes[field] = {value: code for code, value in enumerate(values, start=1)}
+                column_path = os.path.join(self.path, f"{field}.u32")
+                if os.path.exists(column_path) and os.path.getsize(column_path) > self.count * 4:
+                    with open(column_path, "r+b") as f:
+                        f.truncate(self.count * 4)
+                self._files[field] = open(column_path, "ab")
+        else:
+            if os.path.isdir(self.path):
+                for name in os.listdir(self.path):
+                    os.remove(os.path.join(self.path, name))
+            os.makedirs(self.path, exist_ok=True)
+
+        if append and self.count < count:
+            # Filas del índice local escritas sin atributos
+            self.add(read_chunks(index_path, self.count, count))
+
+    def add(self, chunks):
+        chunks = list(chunks)
+        attributes = [chunk_attributes(chunk) for chunk in chunks]
+        for field in {field for row in attributes for field in row} - self._files.keys():
+            self._values[field] = []
+            self._codes[field] = {}
+            self._files[field] = open(os.path.join(self.path, f"{field}.u32"), "wb")
+            self._files[field].write(np.zeros(self.count, dtype=np.uint32).tobytes())
+
+        for field, handle in self._files.items():
+            codes = self._codes[field]
+            column = np.zeros(len(chunks), dtype=np.uint32)
+            for row, values in enumerate(attributes):
+                if field in values:
+                    key = value_key(values[field])
+                    if key not in codes:
+                        self._values[field].append(key)
+                        codes[key] = len(self._values[field])
+                    column[row] = codes[key]
+            handle.write(column.tobytes())
+        self.count += len(chunks)
+
+    def close(self):
+        for handle in self._files.values():
+            handle.close()
+        # La cabecera se reemplaza de una vez: los lectores ven la anterior o la nueva
+        header_path = os.path.join(self.path, ATTR_FILE)
+        with open(header_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"count": self.count, "fields": self._values}, f, ensure_ascii=False)
+        os.replace(header_path + ".tmp", header_path)
+
+
+def read_chunks(index_path: str, start: int, end: int):
+    """Chunks de las filas [start, end) de chunks.jsonl"""
+    from local_index import CHUNKS_FILE
+
+    with open(os.path.join(index_path, CHUNKS_FILE), "rb") as f:
+        for row, line in enumerate(f):
+            if row >= end:
+                break
+            if row >= start:
+                yield json.loads(line)
+
+
+class AttributeIndex:
+    """Columnas de atributos de un índice local, abiertas con mmap"""
+
+    def __init__(self, count: int, columns, codes):
+        self.count = count
+        self.columns = columns
+        self.codes = codes
+
+    @classmethod
+    def load(cls, index_path: str, count: int):
+        """Carga el índice de atributos; None si el índice local no tiene"""
+        path = os.path.join(index_path, ATTR_DIR)
+        header_path = os.path.join(path, ATTR_FILE)
+        if not os.path.exists(header_path):
+            return None
+        with open(header_path, encoding="utf-8") as f:
+            header = json.load(f)
+
+        rows = min(header["count"], count)
+        columns, codes = {}, {}
+        for field, values in header["fields"].items():
+            columns[field] = (
+                np.memmap(os.path.join(path, f"{field}.u32"), dtype=np.uint32, mode="r", shape=(rows,))
+                if rows else np.zeros(0, dtype=np.uint32)
+            )
+            codes[field] = {value: code for code, value in enumerate(values, start=1)}
+        return cls(count, columns, codes)
+
+    @property
+    def fields(self):
+        return sorted(self.columns)
+
+    def mask(self, filters):
+        """
+        Máscara booleana de las filas que cumplen el filtro (de longitud
+        count). Las filas sin atributos (añadidas después de construirlos)
+        no lo cumplen.
+        """
+        mask = np.zeros(self.count, dtype=bool)
+        filters = normalize_filters(filters)
+        if not filters:
+            mask[:] = True
+            return mask
+
+        matched = None
+        for field, values in filters.items():
+            column = self.columns.get(field)
+            wanted = [self.codes[field][key] for key in map(value_key, values) if key in self.codes.get(field, {})]
+            if column is None or not wanted:
+                return mask
+            field_mask = column == wanted[0] if len(wanted) == 1 else np.isin(column, wanted)
+            matched = field_mask if matched is None else matched & field_mask
+        mask[:len(matched)] = matched
+        return mask
+
+
+def build_for_local_index(index_path: str):
+    """Construye el índice de atributos de un índice local existente"""
+    from local_index import read_header
+
+    count = read_header(index_path)["count"]
+    writer = AttributeWriter(index_path)
+    batch = []
+    for chunk in read_chunks(index_path, 0, count):
+        batch.append(chunk)
+        if len(batch) >= 10000:
+            writer.add(batch)
+            batch = []
+    if batch:
+        writer.add(batch)
+    writer.close()
+    return AttributeIndex.load(index_path, count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye el índice de atributos (metadatos) de un índice local")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("path", help="Directorio del índice local")
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+    index = build_for_local_index(args.path)
+    print(f"✅ Índice de atributos con {index.count} filas y los campos "
+          f"{', '.join(index.fields) or '(ninguno)'} creado en {time.perf_counter() - start:.1f} s")
+    sys.exit(0)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark del índice IVF-PQ frente a la búsqueda exacta del índice local.
+
+Genera vectores sintéticos agrupados, construye el índice local y su índice
+aproximado en un directorio temporal y mide recall@k y consultas por segundo
+para varios valores de nprobe.
+
+Uso:
+    python benchmarks/bench_ann.py --count 200000 --dimensions 1536 --nprobe 1,4,16,64
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import build_for_local_index  # noqa: E402
+from local_index import LocalIndexWriter, LocalVectorIndex, normalize_rows  # noqa: E402
+
+
+def synthetic_vectors(count: int, dimensions: int, clusters: int, latent: int = 64, seed: int = 0):
+    """
+    Vectores normalizados con estructura parecida a la de los embeddings:
+    grupos en un espacio latente de pocas dimensiones proyectado a dimensions.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, latent)).astype(np.float32)
+    projection = rng.standard_normal((latent, dimensions)).astype(np.float32)
+    for start in range(0, count, 50000):
+        size = min(50000, count - start)
+        labels = rng.integers(0, clusters, size)
+        points = centers[labels] + 0.5 * rng.standard_normal((size, latent)).astype(np.float32)
+        noise = 0.3 / np.sqrt(dimensions) * rng.standard_normal((size, dimensions)).astype(np.float32)
+        yield normalize_rows(normalize_rows(points @ projection) + noise)
+
+
+def measure(search, queries, top_k):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        rows, _ = search(query, top_k)
+        results.append(set(int(row) for row in rows))
+    return results, len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall y QPS del índice IVF-PQ frente a la búsqueda exacta")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--m", type=int, default=64)
+    parser.add_argument("--refine", type=int, default=10)
+    parser.add_argument("--nprobe", default="1,4,16,64")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        with LocalIndexWriter(path, args.dimensions) as writer:
+            for block in synthetic_vectors(args.count, args.dimensions, args.clusters):
+                writer.add([{"chunk_id": str(writer.count + i)} for i in range(len(block))], block)
+
+        start = time.perf_counter()
+        build_for_local_index(path, nlist=args.nlist, m=args.m, train_size=min(args.count, 50000))
+        build_time = time.perf_counter() - start
+
+        index = LocalVectorIndex(path, refine=args.refine)
+        rng = np.random.default_rng(1)
+        rows = rng.choice(args.count, args.queries, replace=False)
+        queries = normalize_rows(
+            index.vectors[np.sort(rows)]
+            + 0.3 / np.sqrt(args.dimensions) * rng.standard_normal((args.queries, args.dimensions)).astype(np.float32)
+        )
+
+        exact, exact_qps = measure(index.search_exact, queries, args.top_k)
+
+        print(f"Vectores: {args.count} x {args.dimensions}  nlist={args.nlist}  m={args.m}  refine={args.refine}")
+        print(f"Construcción IVF-PQ: {build_time:.1f} s")
+        print(f"{'método':>14} {'recall@' + str(args.top_k):>10} {'QPS':>10}")
+        print(f"{'exacto':>14} {1.0:>10.3f} {exact_qps:>10.1f}")
+        for nprobe in [int(value) for value in args.nprobe.split(",")]:
+            approx, qps = measure(lambda q, k: index.search(q, k, nprobe=nprobe), queries, args.top_k)
+            recall = np.mean([len(a & e) / len(e) for a, e in zip(approx, exact)])
+            print(f"{'nprobe=' + str(nprobe):>14} {recall:>10.3f} {qps:>10.1f}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Compara el tiempo de procesar un lote de preguntas con un bucle de /query
+frente a una sola llamada a /query/batch, contra servicios Azure simulados.
+
+Uso:
+    python benchmarks/bench_batch.py --questions 500 --max-concurrency 32
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_azure import find_free_port, mock_environment, start_mock_process, start_server_in_thread  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de /query/batch frente a /query en bucle")
+    parser.add_argument("--questions", type=int, default=500)
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    mock_port = find_free_port()
+    start_mock_process(mock_port, args.embedding_latency, args.search_latency, args.chat_latency)
+    os.environ.update(mock_environment(f"http://127.0.0.1:{mock_port}"))
+    # Sin cachés, para medir solo el efecto del lote
+    os.environ["RAG_EMBEDDING_CACHE_SIZE"] = "0"
+    os.environ["RAG_SEMANTIC_CACHE_SIZE"] = "0"
+    os.environ["RAG_RETRIEVAL_CACHE_SIZE"] = "0"
+
+    import main as backend
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in ("main", "httpx", "azure"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    app_port = find_free_port()
+    start_server_in_thread(backend.app, app_port, ready_path="/health/ready")
+
+    questions = [
+        {"userQuestion": f"Pregunta de prueba número {i} sobre fertilización", "model": "gpt-4o-mini"}
+        for i in range(args.questions)
+    ]
+
+    with httpx.Client(base_url=f"http://127.0.0.1:{app_port}", timeout=600) as client:
+        start = time.perf_counter()
+        for question in questions:
+            client.post("/query", json=question).raise_for_status()
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        failed = 0
+        for offset in range(0, len(questions), 1000):
+            response = client.post("/query/batch", json={
+                "queries": questions[offset:offset + 1000],
+                "max_concurrency": args.max_concurrency,
+            })
+            response.raise_for_status()
+            failed += response.json()["failed"]
+        batched = time.perf_counter() - start
+
+    print(f"Preguntas:          {args.questions}")
+    print(f"/query en bucle:    {sequential:.1f} s")
+    print(f"/query/batch:       {batched:.1f} s ({failed} fallos)")
+    print(f"Aceleración:        {sequential / batched:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
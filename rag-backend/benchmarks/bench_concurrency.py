@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga de /query contra servidores simulados de Azure.
+
+Levanta los servicios simulados y main:app en local, lanza peticiones con
+concurrencia creciente y muestra el throughput y la latencia en cada nivel.
+Con el pipeline asíncrono el throughput debe crecer casi linealmente con la
+concurrencia, ya que la latencia está dominada por las llamadas a Azure.
+
+Uso:
+    python benchmarks/bench_concurrency.py --levels 1,4,16,64 --requests 128
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_azure import find_free_port, mock_environment, start_mock_process, start_server_in_thread  # noqa: E402
+from report import summarize  # noqa: E402
+
+
+async def run_level(base_url: str, concurrency: int, total_requests: int):
+    """Lanza total_requests consultas con el nivel de concurrencia indicado"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        async def one_request(i):
+            nonlocal errors
+            payload = {"userQuestion": f"¿Qué es la fertilización con nitrógeno? #{i}", "model": "gpt-4o-mini"}
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/query", json=payload)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request(i) for i in range(total_requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "throughput_rps": total_requests / elapsed,
+        # Los mismos percentiles que load_test.py y evaluate.py
+        "latency_ms": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de concurrencia de /query")
+    parser.add_argument("--levels", default="1,2,4,8,16,32,64")
+    parser.add_argument("--requests", type=int, default=128, help="Peticiones por nivel")
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    mock_port = find_free_port()
+    start_mock_process(mock_port, args.embedding_latency, args.search_latency, args.chat_latency)
+    os.environ.update(mock_environment(f"http://127.0.0.1:{mock_port}"))
+    # Sin cachés: todos los niveles repiten las mismas preguntas y medirían aciertos de caché
+    os.environ["RAG_EMBEDDING_CACHE_SIZE"] = "0"
+    os.environ["RAG_SEMANTIC_CACHE_SIZE"] = "0"
+    os.environ["RAG_RETRIEVAL_CACHE_SIZE"] = "0"
+
+    # Importar main después de configurar el entorno simulado
+    import main as backend
+
+    # El log por petición de main, httpx y azure distorsiona las mediciones
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in ("main", "httpx", "azure"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    app_port = find_free_port()
+    start_server_in_thread(backend.app, app_port, ready_path="/health/ready")
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    print(f"{'conc':>5} {'req':>5} {'err':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for level in [int(value) for value in args.levels.split(",")]:
+        result = asyncio.run(run_level(base_url, level, args.requests))
+        print(
+            f"{result['concurrency']:>5} {result['requests']:>5} {result['errors']:>4} "
+            f"{result['throughput_rps']:>8.1f} {result['latency_ms']['p50']:>8.1f} {result['latency_ms']['p95']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
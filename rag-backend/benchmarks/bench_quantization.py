@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los vectores cuantizados (float16 e int8) del índice local.
+
+Genera vectores sintéticos agrupados (como bench_ann.py), construye el
+índice local y sus copias cuantizadas en un directorio temporal y, para
+cada tipo y factor de reordenación (rescore), mide:
+
+- recall@k frente a la búsqueda exacta en float32
+- consultas por segundo
+- bytes por vector de la matriz que recorre la búsqueda y tamaño total
+- memoria que ocupan en la caché de páginas los ficheros del índice tras
+  las búsquedas, partiendo de la caché vacía (posix_fadvise + mincore, solo
+  en Linux): de vectors.f32 solo deberían entrar los candidatos reordenados
+
+Como referencia se muestra también lo que ocupa cada embedding como lista de
+floats de Python (lo que devuelve el SDK de OpenAI).
+
+Uso:
+    python benchmarks/bench_quantization.py --count 200000 --dimensions 1536 --rescore 2,10
+"""
+
+import argparse
+import ctypes
+import gc
+import glob
+import mmap
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_ann import measure, synthetic_vectors  # noqa: E402
+from local_index import LocalIndexWriter, LocalVectorIndex, normalize_rows  # noqa: E402
+from quantized_index import build_for_local_index  # noqa: E402
+
+
+def vector_files(path):
+    return [os.path.join(path, "vectors.f32")] + glob.glob(os.path.join(path, "quantized", "*.*"))
+
+
+def evict(files):
+    """Saca los ficheros de la caché de páginas; False si el sistema no lo permite"""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for file_path in files:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def cached_bytes(files):
+    """Bytes de los ficheros que están en la caché de páginas (mincore); None si no se puede medir"""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        total = 0
+        for file_path in files:
+            size = os.path.getsize(file_path)
+            if not size:
+                continue
+            data = np.memmap(file_path, dtype=np.uint8, mode="r")
+            pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+            residency = (ctypes.c_ubyte * pages)()
+            if libc.mincore(ctypes.c_void_p(data.ctypes.data), ctypes.c_size_t(size), residency) != 0:
+                return None
+            total += int(np.count_nonzero(np.frombuffer(residency, dtype=np.uint8) & 1)) * mmap.PAGESIZE
+            del data
+        return total
+    except (OSError, AttributeError):
+        return None
+
+
+def run(path, queries, top_k, exact=False, **options):
+    """Busca con un índice recién abierto y la caché vacía; devuelve resultados, QPS, bytes de la matriz y en caché"""
+    gc.collect()
+    files = vector_files(path)
+    cold = evict(files)
+    index = LocalVectorIndex(path, use_ann=False, **options)
+    search = index.search_exact if exact else index.search
+    results, qps = measure(search, queries, top_k)
+    matrix_bytes = index.quantized.nbytes if index.quantized is not None else index.vectors.nbytes
+    index.close()
+    del index, search
+    gc.collect()
+    return results, qps, matrix_bytes, cached_bytes(files) if cold else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall, QPS y memoria de los vectores float16/int8 frente a float32")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rescore", default="1,4,10", help="Factores de candidatos reordenados en float32")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        with LocalIndexWriter(path, args.dimensions) as writer:
+            for block in synthetic_vectors(args.count, args.dimensions, args.clusters):
+                writer.add([{"chunk_id": str(writer.count + i)} for i in range(len(block))], block)
+
+        index = LocalVectorIndex(path, use_ann=False, use_quantized=False)
+        rng = np.random.default_rng(1)
+        rows = rng.choice(args.count, args.queries, replace=False)
+        queries = normalize_rows(
+            index.vectors[np.sort(rows)]
+            + 0.3 / np.sqrt(args.dimensions) * rng.standard_normal((args.queries, args.dimensions)).astype(np.float32)
+        )
+        index.close()
+        del index
+
+        python_list_bytes = sys.getsizeof([0.0] * args.dimensions) + args.dimensions * sys.getsizeof(0.0)
+        print(f"Vectores: {args.count} x {args.dimensions}  top_k={args.top_k}")
+        print(f"Lista de floats de Python: {python_list_bytes / 1024:.1f} KB por vector\n")
+        print(f"{'método':>16} {'recall@' + str(args.top_k):>10} {'QPS':>9} {'B/vector':>9} "
+              f"{'matriz MB':>10} {'en caché MB':>12} {'reducción':>10}")
+
+        def report(name, recall, qps, matrix_bytes, cached):
+            cached_mb = f"{cached / 2 ** 20:>12.1f}" if cached is not None else f"{'-':>12}"
+            print(f"{name:>16} {recall:>10.3f} {qps:>9.1f} {matrix_bytes / args.count:>9.0f} "
+                  f"{matrix_bytes / 2 ** 20:>10.1f} {cached_mb} {float32_bytes / matrix_bytes:>9.1f}x")
+
+        exact, qps, float32_bytes, cached = run(path, queries, args.top_k, exact=True, use_quantized=False)
+        report("float32 exacto", 1.0, qps, float32_bytes, cached)
+
+        for dtype in ("float16", "int8"):
+            build_for_local_index(path, dtype)
+            for rescore in [int(value) for value in args.rescore.split(",")]:
+                results, qps, matrix_bytes, cached = run(path, queries, args.top_k, rescore=rescore)
+                recall = np.mean([len(r & e) / len(e) for r, e in zip(results, exact)])
+                report(f"{dtype} r={rescore}", recall, qps, matrix_bytes, cached)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Mide el coste de arranque del backend contra servicios Azure simulados.
+
+Para cada repetición lanza `uvicorn main:app` en un proceso nuevo y mide:
+
+- import_main_ms: lo que tarda `import main` en un intérprete limpio
+- live_ms: desde que se lanza el proceso hasta que /health/live responde
+- ready_ms: hasta que /health/ready responde 200 (servicio RAG construido)
+- service_import_ms y service_init_ms: import de rag_service y construcción
+  del servicio, según /health/ready
+
+Con --importtime se muestran además los módulos que más tardan en
+importarse (python -X importtime). Los resultados se pueden guardar en JSON
+y comparar con los de otro commit, como en load_test.py.
+
+Uso:
+    python benchmarks/bench_startup.py --repeat 5 --output startup.json
+    python benchmarks/bench_startup.py --compare startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from mock_azure import find_free_port, mock_environment, start_mock_process  # noqa: E402
+from report import run_meta  # noqa: E402
+
+METRICS = ("import_main_ms", "live_ms", "ready_ms", "service_import_ms", "service_init_ms")
+
+
+def measure_import(env):
+    """Milisegundos de `import main` en un intérprete nuevo"""
+    code = "import time; start = time.perf_counter(); import main; print((time.perf_counter() - start) * 1000)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env, limit: int):
+    """Módulos con más tiempo acumulado de import según python -X importtime"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True
+    ).stderr
+    modules = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        modules.append((int(parts[1]) / 1000, parts[2].rstrip()))
+    return sorted(modules, reverse=True)[:limit]
+
+
+def measure_boot(env, timeout: float):
+    """Lanza el servidor y mide cuándo responde /health/live y /health/ready"""
+    port = find_free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {}
+    try:
+        with httpx.Client(timeout=5) as client:
+            for path, name in (("/health/live", "live_ms"), ("/health/ready", "ready_ms")):
+                while True:
+                    try:
+                        response = client.get(base_url + path)
+                        if response.status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    if time.perf_counter() - start > timeout:
+                        raise RuntimeError(f"{path} did not respond in {timeout:.0f} s")
+                    if process.poll() is not None:
+                        raise RuntimeError(f"Server exited with code {process.returncode}")
+                    time.sleep(0.01)
+                result[name] = (time.perf_counter() - start) * 1000
+            startup = response.json()["startup"]
+            result["service_import_ms"] = startup["import_ms"]
+            result["service_init_ms"] = startup["init_ms"]
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def compare(baseline, current, threshold: float):
+    """Imprime la diferencia de las medianas; devuelve las regresiones encontradas"""
+    commit = baseline.get("meta", {}).get("git", {}).get("commit", "")[:10] or "?"
+    print(f"\nComparación con {commit} (umbral {threshold:.0%}):")
+    regressions = []
+    for name in METRICS:
+        old, new = baseline["median"].get(name), current["median"].get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        flagged = change > threshold
+        if flagged:
+            regressions.append((name, old, new))
+        print(f"{name:<20} {old:>9.1f} {new:>9.1f} {change:>+8.1%}{'  ⚠️ regresión' if flagged else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de import y de arranque del backend")
+    parser.add_argument("--repeat", type=int, default=5, help="Arranques medidos")
+    parser.add_argument("--timeout", type=float, default=60, help="Segundos máximos hasta /health/ready")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="Muestra los N módulos más lentos de importar")
+    parser.add_argument("--output", help="Fichero JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="Resultados JSON de referencia (por ejemplo, de otro commit)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Cambio relativo que cuenta como regresión")
+    args = parser.parse_args()
+
+    mock_port = find_free_port()
+    start_mock_process(mock_port)
+    env = dict(os.environ, **mock_environment(f"http://127.0.0.1:{mock_port}"))
+    # Sin precalentamiento ni ficheros de caché: solo se mide el arranque
+    env.update({"RAG_WARMUP_TOP_N": "0", "RAG_INIT_RETRY_DELAY": "0.1"})
+
+    runs = []
+    print(f"{'run':>4} " + " ".join(f"{name:>18}" for name in METRICS))
+    for i in range(args.repeat):
+        run = {"import_main_ms": measure_import(env), **measure_boot(env, args.timeout)}
+        runs.append(run)
+        print(f"{i + 1:>4} " + " ".join(f"{run.get(name) or 0:>18.1f}" for name in METRICS))
+
+    median = {name: round(float(np.median([run[name] for run in runs if run.get(name) is not None])), 1)
+              for name in METRICS}
+    print(f"{'p50':>4} " + " ".join(f"{median[name]:>18.1f}" for name in METRICS))
+
+    report = {
+        "meta": run_meta(),
+        "config": vars(args),
+        "runs": runs,
+        "median": median,
+    }
+
+    if args.importtime:
+        report["slowest_imports_ms"] = slowest_imports(env, args.importtime)
+        print("\nImports más lentos (ms acumulados):")
+        for ms, module in report["slowest_imports_ms"]:
+            print(f"{ms:>9.1f}  {module}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regresiones por encima del {args.threshold:.0%}")
+            sys.exit(1)
+        print("\n✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
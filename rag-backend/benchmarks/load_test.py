@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga reproducible de /query contra servicios Azure simulados.
+
+Levanta mock_azure.py (con latencia y tasa de errores configurables por
+servicio) y main:app en local, lanza peticiones con concurrencia creciente
+y para cada nivel mide el throughput, los percentiles de latencia, los
+errores y el desglose por etapas (los timings de cada respuesta). El
+resultado se guarda en JSON junto con el commit y la configuración, y se
+puede comparar con el de otro commit para detectar regresiones.
+
+Uso:
+    python benchmarks/load_test.py --levels 1,8,32 --requests 200 --output results.json
+    python benchmarks/load_test.py --chat-error-rate 0.05 --compare baseline.json
+
+Con --compare el script termina con código 1 si el throughput baja o la
+latencia (p50/p95) sube más que --threshold en algún nivel.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_azure import find_free_port, mock_environment, start_mock_process, start_server_in_thread  # noqa: E402
+from report import run_meta, summarize  # noqa: E402
+
+QUESTION_TEMPLATES = [
+    "¿Qué es la fertilización con nitrógeno? (consulta {i})",
+    "¿Cómo se siembra el aguacate en clima subtropical? (consulta {i})",
+    "Ventajas del riego por goteo, consulta {i}",
+    "¿Cómo se controlan las plagas de forma integrada? (consulta {i})",
+    "¿Cómo se corrige la acidez del suelo? (consulta {i})",
+]
+
+
+async def run_level(base_url: str, concurrency: int, total_requests: int, distinct_questions: int, model: str):
+    """Lanza total_requests consultas con ese nivel de concurrencia y resume los resultados"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    stages = defaultdict(list)
+    statuses = Counter()
+    cache_hits = 0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def one_request(i):
+            nonlocal cache_hits
+            template = QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)]
+            payload = {"userQuestion": template.format(i=i % distinct_questions), "model": model}
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/query", json=payload)
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                    return
+                latencies.append((time.perf_counter() - start) * 1000)
+            statuses[str(response.status_code)] += 1
+            if response.status_code != 200:
+                return
+            body = response.json()
+            cache_hits += bool(body.get("cache_hit"))
+            for stage, milliseconds in (body.get("timings") or {}).items():
+                if stage != "total":
+                    stages[stage].append(milliseconds)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request(i) for i in range(total_requests)))
+        elapsed = time.perf_counter() - start
+
+    errors = total_requests - statuses["200"]
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(statuses["200"] / elapsed, 2),
+        "errors": errors,
+        "error_rate": round(errors / total_requests, 4),
+        "statuses": dict(statuses),
+        "cache_hits": cache_hits,
+        "latency_ms": summarize(latencies),
+        "stages_ms": {stage: summarize(values) for stage, values in sorted(stages.items())},
+    }
+
+
+def print_level(result):
+    latency = result["latency_ms"]
+    print(
+        f"{result['concurrency']:>5} {result['requests']:>5} {result['errors']:>4} "
+        f"{result['throughput_rps']:>8.1f} {latency.get('p50', 0):>8.1f} {latency.get('p95', 0):>8.1f} "
+        f"{latency.get('p99', 0):>8.1f}   "
+        + " ".join(f"{stage}={values['p50']:.1f}" for stage, values in result["stages_ms"].items())
+    )
+
+
+def compare(baseline, current, threshold: float):
+    """Imprime la diferencia con otra ejecución; devuelve las regresiones encontradas"""
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    commit = baseline.get("meta", {}).get("git", {}).get("commit", "")[:10] or "?"
+    print(f"\nComparación con {commit} (umbral {threshold:.0%}):")
+    print(f"{'conc':>5} {'métrica':<20} {'antes':>9} {'ahora':>9} {'cambio':>8}")
+
+    regressions = []
+    for level in current["levels"]:
+        before = previous.get(level["concurrency"])
+        if before is None:
+            continue
+        # (nombre, antes, ahora, True si más alto es mejor, True si cuenta como regresión).
+        # Las etapas solo se muestran como desglose.
+        metrics = [("throughput_rps", before["throughput_rps"], level["throughput_rps"], True, True)]
+        for key in ("p50", "p95"):
+            metrics.append((f"latency_{key}_ms", before["latency_ms"].get(key), level["latency_ms"].get(key), False, True))
+        for stage, values in level["stages_ms"].items():
+            old = before.get("stages_ms", {}).get(stage, {}).get("p50")
+            metrics.append((f"{stage}_p50_ms", old, values.get("p50"), False, False))
+
+        for name, old, new, higher_is_better, gated in metrics:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            flagged = gated and (-change if higher_is_better else change) > threshold
+            if flagged:
+                regressions.append((level["concurrency"], name, old, new))
+            print(f"{level['concurrency']:>5} {name:<20} {old:>9.1f} {new:>9.1f} {change:>+8.1%}"
+                  f"{'  ⚠️ regresión' if flagged else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de /query contra servicios Azure simulados")
+    parser.add_argument("--levels", default="1,4,16,64", help="Niveles de concurrencia separados por comas")
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por nivel")
+    parser.add_argument("--warmup", type=int, default=10, help="Peticiones de calentamiento (no se miden)")
+    parser.add_argument("--questions", type=int, default=0,
+                        help="Preguntas distintas por nivel (0 = todas distintas); menos preguntas, más aciertos de caché")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--cache", action="store_true", help="Mantener activas las cachés de embeddings y respuestas")
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--embedding-error-rate", type=float, default=0.0)
+    parser.add_argument("--search-error-rate", type=float, default=0.0)
+    parser.add_argument("--chat-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de los errores simulados")
+    parser.add_argument("--output", help="Fichero JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="Resultados JSON de referencia (por ejemplo, de otro commit)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Cambio relativo que cuenta como regresión")
+    args = parser.parse_args()
+    levels = [int(value) for value in args.levels.split(",")]
+
+    mock_port = find_free_port()
+    start_mock_process(
+        mock_port, args.embedding_latency, args.search_latency, args.chat_latency,
+        args.embedding_error_rate, args.search_error_rate, args.chat_error_rate, args.seed
+    )
+    os.environ.update(mock_environment(f"http://127.0.0.1:{mock_port}"))
+    if not args.cache:
+        # Sin cachés cada petición recorre todas las etapas
+        os.environ["RAG_EMBEDDING_CACHE_SIZE"] = "0"
+        os.environ["RAG_SEMANTIC_CACHE_SIZE"] = "0"
+        os.environ["RAG_RETRIEVAL_CACHE_SIZE"] = "0"
+
+    # Importar main después de configurar el entorno simulado
+    import main as backend
+
+    # El log por petición de main, httpx y azure distorsiona las mediciones
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in ("main", "httpx", "azure"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    app_port = find_free_port()
+    start_server_in_thread(backend.app, app_port, ready_path="/health/ready")
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    if args.warmup:
+        asyncio.run(run_level(base_url, min(args.warmup, 8), args.warmup, args.warmup, args.model))
+
+    print(f"{'conc':>5} {'req':>5} {'err':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}   etapas (p50 ms)")
+    results = []
+    for level in levels:
+        result = asyncio.run(run_level(base_url, level, args.requests, args.questions or args.requests, args.model))
+        results.append(result)
+        print_level(result)
+
+    report = {
+        "meta": run_meta(),
+        "config": vars(args),
+        "levels": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regresiones por encima del {args.threshold:.0%}")
+            sys.exit(1)
+        print("\n✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
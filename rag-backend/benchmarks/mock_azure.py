@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Servidores locales que imitan Azure OpenAI (embeddings y chat) y Azure Search
+para poder medir el backend sin credenciales ni red.
+
+Cada servicio tiene una latencia artificial y una tasa de errores: una
+fracción de las peticiones responde 429 (con Retry-After) o 500, para medir
+cómo se comporta el backend cuando Azure limita o falla.
+
+Uso directo:
+    python benchmarks/mock_azure.py --port 9100 --chat-latency 0.3 --chat-error-rate 0.05
+"""
+
+import argparse
+import array
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import math
+import multiprocessing
+import random
+import socket
+import threading
+import time
+import urllib.request
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIMENSIONS = 1536
+
+SAMPLE_CHUNKS = [
+    ("Fertilización con nitrógeno", "El nitrógeno es esencial para el crecimiento vegetativo y la síntesis de proteínas."),
+    ("Cultivo de aguacate", "El aguacate se siembra en climas subtropicales con temperaturas entre 20 y 30 grados."),
+    ("Riego por goteo", "El riego por goteo reduce el consumo de agua y mejora la eficiencia de la fertilización."),
+    ("Manejo de plagas", "El control integrado de plagas combina métodos biológicos, culturales y químicos."),
+    ("Suelos ácidos", "El encalado corrige la acidez del suelo y mejora la disponibilidad de nutrientes."),
+]
+
+
+@functools.lru_cache(maxsize=4096)
+def fake_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS):
+    """Embedding determinista basado en hashing de palabras (textos parecidos, vectores parecidos)"""
+    vector = [0.0] * dimensions
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] % 2 == 0 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+async def stream_completion(deployment: str, answer: str, latency: float):
+    """Emite la respuesta palabra a palabra repartiendo la latencia entre los chunks"""
+    words = answer.split(" ")
+    for i, word in enumerate(words):
+        await asyncio.sleep(latency / len(words))
+        chunk = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else " " + word},
+                    "finish_reason": "stop" if i == len(words) - 1 else None,
+                }
+            ],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def injected_error(rng: random.Random, error_rate: float):
+    """Con probabilidad error_rate devuelve un 429 (limitado) o un 500 simulado; si no, None"""
+    if error_rate <= 0 or rng.random() >= error_rate:
+        return None
+    if rng.random() < 0.5:
+        return JSONResponse(
+            {"error": {"code": "429", "message": "Rate limit simulado"}},
+            status_code=429,
+            headers={"Retry-After": "0"}
+        )
+    return JSONResponse({"error": {"code": "InternalServerError", "message": "Error simulado"}}, status_code=500)
+
+
+def create_mock_app(embedding_latency: float = 0.02, search_latency: float = 0.03, chat_latency: float = 0.3,
+                    embedding_error_rate: float = 0.0, search_error_rate: float = 0.0, chat_error_rate: float = 0.0,
+                    seed: int = 0):
+    """Crea la app FastAPI que responde como Azure OpenAI y Azure Search"""
+    app = FastAPI(title="Mock Azure Services")
+    rng = random.Random(seed)
+
+    @app.post("/openai/deployments/{deployment}/embeddings")
+    async def embeddings(deployment: str, request: Request):
+        body = await request.json()
+        error = injected_error(rng, embedding_error_rate)
+        if error is not None:
+            await asyncio.sleep(embedding_latency)
+            return error
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(embedding_latency)
+        tokens = sum(len(text.split()) for text in inputs)
+        encode = body.get("encoding_format") == "base64"
+        return {
+            "object": "list",
+            "model": deployment,
+            "data": [
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": (
+                        base64.b64encode(array.array("f", fake_embedding(text)).tobytes()).decode("ascii")
+                        if encode else fake_embedding(text)
+                    ),
+                }
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        error = injected_error(rng, chat_error_rate)
+        if error is not None:
+            return error
+        question = body["messages"][-1]["content"]
+        if body.get("stream"):
+            return StreamingResponse(
+                stream_completion(deployment, f"Respuesta simulada para: {question}", chat_latency),
+                media_type="text/event-stream"
+            )
+        await asyncio.sleep(chat_latency)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"Respuesta simulada para: {question}"},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+        }
+
+    @app.post("/{path:path}")
+    async def search(path: str, request: Request):
+        # Azure Search usa rutas del tipo /indexes('nombre')/docs/search.post.search
+        body = await request.json()
+        if path.endswith("docs/search.index"):
+            await asyncio.sleep(search_latency)
+            return {
+                "value": [
+                    {"key": action.get("chunk_id"), "status": True, "errorMessage": None, "statusCode": 200}
+                    for action in body.get("value", [])
+                ]
+            }
+        if not path.endswith("docs/search.post.search"):
+            return {"value": []}
+        await asyncio.sleep(search_latency)
+        error = injected_error(rng, search_error_rate)
+        if error is not None:
+            return error
+        top = body.get("top") or 3
+        return {
+            "value": [
+                {
+                    "@search.score": round(1.0 - i * 0.05, 4),
+                    "chunk_id": f"mock_chunk_{i}",
+                    "title": title,
+                    "chunk": chunk,
+                }
+                for i, (title, chunk) in enumerate(SAMPLE_CHUNKS[:top])
+            ]
+        }
+
+    return app
+
+
+def find_free_port():
+    """Devuelve un puerto TCP libre en localhost"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server_in_thread(app, port: int, ready_path: str = None, timeout: float = 60.0):
+    """
+    Arranca una app ASGI con uvicorn en un hilo y espera a que esté lista.
+
+    Con ready_path espera además a que esa ruta responda 200 (el backend
+    inicializa el servicio RAG en segundo plano tras arrancar).
+    """
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    if ready_path:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{ready_path}") as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{ready_path} did not become ready in {timeout:.0f} s")
+            time.sleep(0.05)
+    return server, thread
+
+
+def _run_mock(port: int, settings):
+    uvicorn.run(create_mock_app(*settings), host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_mock_process(port: int, embedding_latency: float = 0.02, search_latency: float = 0.03, chat_latency: float = 0.3,
+                       embedding_error_rate: float = 0.0, search_error_rate: float = 0.0, chat_error_rate: float = 0.0,
+                       seed: int = 0):
+    """Arranca los servicios simulados en otro proceso para no competir por el GIL con el backend"""
+    process = multiprocessing.Process(
+        target=_run_mock,
+        args=(port, (embedding_latency, search_latency, chat_latency,
+                     embedding_error_rate, search_error_rate, chat_error_rate, seed)),
+        daemon=True
+    )
+    process.start()
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Mock server did not start on port {port}")
+
+
+def mock_environment(base_url: str):
+    """Variables de entorno que apuntan el backend a los servidores simulados"""
+    return {
+        "AZURE_OPENAI_API_KEY": "mock-key",
+        "AZURE_OPENAI_ENDPOINT": base_url,
+        "OPENAI_API_VERSION": "2023-05-15",
+        "AZURE_SEARCH_SERVICE_ENDPOINT": base_url,
+        "AZURE_SEARCH_INDEX": "mock-index",
+        "AZURE_SEARCH_ADMIN_KEY": "mock-key",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidores simulados de Azure OpenAI y Azure Search")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--embedding-error-rate", type=float, default=0.0)
+    parser.add_argument("--search-error-rate", type=float, default=0.0)
+    parser.add_argument("--chat-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_mock_app(
+            args.embedding_latency, args.search_latency, args.chat_latency,
+            args.embedding_error_rate, args.search_error_rate, args.chat_error_rate, args.seed
+        ),
+        host="127.0.0.1",
+        port=args.port,
+    )
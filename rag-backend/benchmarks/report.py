@@ -0,0 +1,57 @@
+"""
+Utilidades comunes de los informes JSON de benchmarks y evaluaciones.
+
+load_test.py, bench_startup.py y evaluate.py guardan sus resultados con los
+mismos metadatos (fecha, commit, Python, máquina) y resúmenes de latencia,
+para poder comparar ejecuciones de commits distintos. bench_concurrency.py
+calcula sus percentiles con el mismo summarize.
+"""
+
+import os
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def summarize(values, percentiles=PERCENTILES, digits: int = 2):
+    """Percentiles, media y máximo de una lista de latencias en ms ({} si está vacía)"""
+    if not values:
+        return {}
+    values = np.asarray(values, dtype=np.float64)
+    summary = {f"p{p}": round(float(v), digits) for p, v in zip(percentiles, np.percentile(values, percentiles))}
+    summary["mean"] = round(float(values.mean()), digits)
+    summary["max"] = round(float(values.max()), digits)
+    return summary
+
+
+def git_info():
+    """Commit y rama actuales (vacíos si no es un repositorio git)"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    def run(*command):
+        try:
+            return subprocess.run(["git", *command], cwd=cwd, capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+
+    return {
+        "commit": run("rev-parse", "HEAD"),
+        "branch": run("rev-parse", "--abbrev-ref", "HEAD"),
+        "dirty": bool(run("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def run_meta(**extra):
+    """Metadatos de una ejecución: fecha, commit, versión de Python y máquina"""
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_info(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        **extra,
+    }
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Índice de palabras clave BM25 para el índice local.
+
+Es un índice invertido guardado en formato CSR: para cada término, sus
+postings (fila del índice local y frecuencia del término) están contiguos en
+dos arrays, y offsets indica dónde empieza cada término. Una búsqueda solo
+toca los postings de los términos de la consulta.
+
+Formato del directorio (dentro del índice local, en bm25/):
+    bm25.json        parámetros, número de filas y longitud media
+    vocabulary.json  término -> identificador
+    offsets.npy      inicio de los postings de cada término (nterms + 1)
+    rows.npy         fila de cada posting (int32)
+    freqs.npy        frecuencia del término en la fila (uint16)
+    lengths.npy      número de términos de cada fila
+
+Uso:
+    python bm25_index.py build ./local_index
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+BM25_DIR = "bm25"
+BM25_FILE = "bm25.json"
+TOKEN_PATTERN = re.compile(r"\w\w+")
+
+
+@lru_cache(maxsize=200000)
+def fold_accents(token: str) -> str:
+    if token.isascii():
+        return token
+    token = unicodedata.normalize("NFKD", token)
+    return "".join(char for char in token if not unicodedata.combining(char))
+
+
+def tokenize(text: str):
+    """Minúsculas, sin tildes y palabras de al menos dos caracteres"""
+    # Las tildes se quitan por palabra (con caché) y no por carácter del texto
+    return [fold_accents(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+class BM25Index:
+    """Búsqueda BM25 sobre postings en arrays NumPy (abiertos con mmap al cargar)"""
+
+    def __init__(self, vocabulary, offsets, rows, freqs, lengths, k1: float = 1.2, b: float = 0.75):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.rows = rows
+        self.freqs = freqs
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        self.count = len(lengths)
+        self.average_length = float(lengths.mean()) if self.count else 0.0
+        # Parte del denominador de BM25 que solo depende de la fila
+        self._length_norms = self._norms(lengths)
+        # Postings en memoria de las filas añadidas con extend: término -> (filas, frecuencias)
+        self._extra = {}
+
+    def _norms(self, lengths):
+        return (self.k1 * (1 - self.b + self.b * lengths / (self.average_length or 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts, k1: float = 1.2, b: float = 0.75):
+        """Construye el índice a partir de un iterable de textos (uno por fila)"""
+        vocabulary = {}
+        term_ids, rows, freqs = array("i"), array("i"), array("H")
+        lengths = array("i")
+
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                rows.append(row)
+                freqs.append(min(freq, 65535))
+
+        term_ids = np.frombuffer(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+
+        return cls(
+            vocabulary,
+            offsets,
+            np.frombuffer(rows, dtype=np.int32)[order],
+            np.frombuffer(freqs, dtype=np.uint16)[order],
+            np.frombuffer(lengths, dtype=np.int32).copy(),
+            k1, b
+        )
+
+    def search(self, query: str, top_k: int = 10, deleted=None, allowed=None):
+        """
+        Devuelve (filas, scores BM25) de las top_k filas, ordenadas.
+
+        Con allowed (máscara booleana por fila, p. ej. de un filtro) solo se
+        puntúan las filas permitidas de cada posting.
+        """
+        postings = [self._postings(term) for term in set(tokenize(query))]
+        postings = [(rows, freqs) for rows, freqs in postings if len(rows)]
+        if not postings or not self.count:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = np.zeros(self.count, dtype=np.float32)
+        for rows, freqs in postings:
+            idf = np.log(1.0 + (self.count - len(rows) + 0.5) / (len(rows) + 0.5))
+            if allowed is not None:
+                keep = allowed[rows]
+                rows, freqs = rows[keep], freqs[keep]
+            # Cada fila aparece una sola vez en los postings de un término
+            scores[rows] += idf * freqs * (self.k1 + 1) / (freqs + self._length_norms[rows])
+
+        if deleted is not None:
+            scores[deleted[:self.count]] = 0.0
+
+        candidates = np.flatnonzero(scores)
+        k = min(top_k, len(candidates))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        best = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        best = best[np.argsort(-scores[best])]
+        return best, scores[best]
+
+    def _postings(self, term: str):
+        """(filas, frecuencias) del término, con las de las filas añadidas con extend"""
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            rows, freqs = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        else:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows, freqs = self.rows[start:end], self.freqs[start:end].astype(np.float32)
+        extra = self._extra.get(term)
+        if extra is not None:
+            rows = np.concatenate([rows, np.asarray(extra[0], dtype=np.int32)])
+            freqs = np.concatenate([freqs, np.asarray(extra[1], dtype=np.float32)])
+        return rows, freqs
+
+    def extend(self, texts):
+        """
+        Añade en memoria filas que no están en los postings guardados (las del
+        índice local añadidas después de construir el BM25), normalizadas con
+        la longitud media del índice guardado. No se guardan: para muchas
+        filas conviene reconstruir el índice.
+        """
+        lengths = array("i")
+        for row, text in enumerate(texts, start=self.count):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                rows, freqs = self._extra.setdefault(term, ([], []))
+                rows.append(row)
+                freqs.append(min(freq, 65535))
+        lengths = np.frombuffer(lengths, dtype=np.int32)
+        self._length_norms = np.concatenate([self._length_norms, self._norms(lengths)])
+        self.count += len(lengths)
+
+    def save(self, path: str):
+        """Guarda el índice reemplazando cada fichero: los workers que lo tienen en mmap siguen con el anterior"""
+        os.makedirs(path, exist_ok=True)
+        for name, values in (("offsets.npy", self.offsets), ("rows.npy", self.rows),
+                             ("freqs.npy", self.freqs), ("lengths.npy", self.lengths)):
+            with open(os.path.join(path, name + ".tmp"), "wb") as f:
+                np.save(f, values)
+            os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+        with open(os.path.join(path, "vocabulary.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        os.replace(os.path.join(path, "vocabulary.json.tmp"), os.path.join(path, "vocabulary.json"))
+        with open(os.path.join(path, BM25_FILE + ".tmp"), "w") as f:
+            json.dump({"count": self.count, "terms": len(self.vocabulary), "k1": self.k1, "b": self.b}, f)
+        os.replace(os.path.join(path, BM25_FILE + ".tmp"), os.path.join(path, BM25_FILE))
+
+    @classmethod
+    def load(cls, path: str):
+        with open(os.path.join(path, BM25_FILE)) as f:
+            header = json.load(f)
+        with open(os.path.join(path, "vocabulary.json"), encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        return cls(
+            vocabulary,
+            np.load(os.path.join(path, "offsets.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "rows.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "freqs.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "lengths.npy"), mmap_mode="r"),
+            header["k1"], header["b"]
+        )
+
+
+def indexed_text(chunk) -> str:
+    """Texto de un chunk que indexa BM25: título y texto"""
+    return f"{chunk.get('title', '')} {chunk.get('chunk', '')}"
+
+
+def build_for_local_index(index_path: str, k1: float = 1.2, b: float = 0.75):
+    """Construye el índice BM25 (título + texto de cada chunk) de un índice local existente"""
+    from local_index import LocalVectorIndex
+
+    local = LocalVectorIndex(index_path, use_ann=False)
+    texts = map(indexed_text, map(local.get_chunk, range(local.count)))
+    bm25 = BM25Index.build(texts, k1, b)
+    bm25.save(os.path.join(index_path, BM25_DIR))
+    local.close()
+    return bm25
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye el índice de palabras clave BM25 de un índice local")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("path", help="Directorio del índice local")
+    build_parser.add_argument("--k1", type=float, default=1.2)
+    build_parser.add_argument("--b", type=float, default=0.75)
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+    bm25 = build_for_local_index(args.path, args.k1, args.b)
+    print(f"✅ Índice BM25 con {bm25.count} chunks y {len(bm25.vocabulary)} términos "
+          f"creado en {time.perf_counter() - start:.1f} s")
+    sys.exit(0)
@@ -0,0 +1,162 @@
+import os
+import re
+
+from bm25_index import tokenize
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?;])\s+|\n{2,}")
+# Tokens de formato que añade la API por cada mensaje del chat
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """
+    Cuenta tokens con tiktoken si está instalado.
+
+    Sin tiktoken usa la aproximación habitual de 4 caracteres por token, que
+    basta para repartir el presupuesto de contexto.
+    """
+
+    def __init__(self, encoding_name: str = "o200k_base"):
+        self.encoding = None
+        try:
+            import tiktoken
+        except ImportError:
+            return
+        for name in (encoding_name, "cl100k_base"):
+            try:
+                self.encoding = tiktoken.get_encoding(name)
+                break
+            except ValueError:
+                continue
+
+    @property
+    def exact(self):
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def count_messages(self, messages) -> int:
+        """Tokens de entrada de una lista de mensajes de chat"""
+        return sum(self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def shingles(text: str, size: int = 3):
+    """Conjunto de n-gramas de palabras (hasheados) de un texto"""
+    words = tokenize(text)
+    if len(words) < size:
+        return {hash(word) for word in words}
+    return {hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def split_sentences(text: str):
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+
+
+class ContextBuilder:
+    """
+    Monta el contexto del prompt a partir de los chunks recuperados.
+
+    Recorre los chunks en orden de relevancia y los añade mientras quepan en
+    max_tokens. Descarta los casi duplicados de un chunk ya elegido (similitud
+    de Jaccard entre shingles por encima de dedup_threshold) y, si
+    max_sentences es mayor que 0, reduce cada chunk a sus max_sentences frases
+    con más términos de la pregunta. Un chunk que no cabe entero se recorta
+    por frases al espacio que queda.
+    """
+
+    def __init__(self, max_tokens: int = 3000, dedup_threshold: float = 0.85, max_sentences: int = 0,
+                 counter: TokenCounter = None):
+        self.max_tokens = max_tokens
+        self.dedup_threshold = dedup_threshold
+        self.max_sentences = max_sentences
+        self.counter = counter or TokenCounter()
+
+    @classmethod
+    def from_env(cls):
+        """Crea el constructor con la configuración de las variables de entorno"""
+        return cls(
+            max_tokens=int(os.getenv("RAG_CONTEXT_MAX_TOKENS", 3000)),
+            dedup_threshold=float(os.getenv("RAG_CONTEXT_DEDUP_THRESHOLD", 0.85)),
+            max_sentences=int(os.getenv("RAG_CONTEXT_MAX_SENTENCES", 0))
+        )
+
+    def _relevant_sentences(self, sentences, query_terms, max_tokens: int = None, max_sentences: int = None):
+        """Las frases con más términos de la pregunta, en su orden original"""
+        ranked = sorted(
+            range(len(sentences)),
+            key=lambda i: (-len(query_terms.intersection(tokenize(sentences[i]))), i)
+        )
+        kept, used = [], 0
+        for i in ranked:
+            if max_sentences is not None and len(kept) >= max_sentences:
+                break
+            tokens = self.counter.count(sentences[i])
+            if max_tokens is not None and used + tokens > max_tokens:
+                continue
+            kept.append(i)
+            used += tokens
+        return " ".join(sentences[i] for i in sorted(kept))
+
+    def build(self, question: str, results):
+        """
+        Devuelve un dict con el texto del contexto, los resultados usados (en
+        orden) y estadísticas: context_tokens, duplicates y trimmed.
+        """
+        query_terms = set(tokenize(question))
+        selected, selected_shingles, parts = [], [], []
+        used = duplicates = trimmed = 0
+
+        for result in results:
+            text = result["chunk"]
+            result_shingles = shingles(text)
+            if any(jaccard(result_shingles, other) >= self.dedup_threshold for other in selected_shingles):
+                duplicates += 1
+                continue
+
+            sentences = None
+            was_trimmed = False
+            if self.max_sentences > 0:
+                sentences = split_sentences(text)
+                if len(sentences) > self.max_sentences:
+                    text = self._relevant_sentences(sentences, query_terms, max_sentences=self.max_sentences)
+                    was_trimmed = True
+
+            tokens = self.counter.count(text)
+            remaining = self.max_tokens - used
+            if tokens > remaining:
+                # Recortar por frases al espacio que queda
+                text = self._relevant_sentences(
+                    sentences or split_sentences(text), query_terms,
+                    max_tokens=remaining, max_sentences=self.max_sentences or None
+                )
+                tokens = self.counter.count(text)
+                if not text or tokens > remaining:
+                    continue
+                was_trimmed = True
+            trimmed += was_trimmed
+
+            selected.append(result)
+            selected_shingles.append(result_shingles)
+            parts.append(text)
+            used += tokens
+            if used >= self.max_tokens:
+                break
+
+        return {
+            "context": "\n\n".join(parts),
+            "results": selected,
+            "context_tokens": used,
+            "duplicates": duplicates,
+            "trimmed": trimmed,
+        }
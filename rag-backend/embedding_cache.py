@@ -0,0 +1,181 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza un texto para usarlo como clave (unicode, mayúsculas y espacios)"""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.lower().split())
+
+
+class SQLiteEmbeddingStore:
+    """
+    Almacenamiento persistente de embeddings en SQLite.
+
+    Los vectores se guardan como BLOB de float32, así una caché caliente
+    sobrevive a los reinicios del servidor.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                vector BLOB NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key: str, ttl_seconds: float = None):
+        """Devuelve el vector guardado o None si no existe o ha caducado"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        created_at, blob = row
+        if ttl_seconds and time.time() - created_at > ttl_seconds:
+            return None
+        return np.frombuffer(blob, dtype=np.float32)
+
+    def put(self, key: str, model: str, vector: np.ndarray):
+        """Guarda (o reemplaza) un vector"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, created_at, vector) VALUES (?, ?, ?, ?)",
+                (key, model, time.time(), vector.astype(np.float32).tobytes())
+            )
+            self._conn.commit()
+
+    def purge_expired(self, ttl_seconds: float):
+        """Elimina los vectores caducados"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings WHERE created_at < ?", (time.time() - ttl_seconds,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings con expulsión LRU y caducidad por TTL.
+
+    La clave es el texto normalizado más el nombre del modelo de embeddings.
+    Los vectores se guardan como arrays float32 (6 KB para ada-002 frente a
+    los ~50 KB de una lista de floats de Python). Si se indica un store
+    persistente, los fallos en memoria se consultan ahí antes de dar la
+    entrada por perdida.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 86400, store: SQLiteEmbeddingStore = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        if store is not None and ttl_seconds:
+            # Los vectores caducados nunca se vuelven a leer: se borran al abrir el store
+            store.purge_expired(ttl_seconds)
+
+    @classmethod
+    def from_env(cls):
+        """Crea la caché a partir de las variables RAG_EMBEDDING_CACHE_*"""
+        path = os.getenv("RAG_EMBEDDING_CACHE_PATH")
+        return cls(
+            max_entries=int(os.getenv("RAG_EMBEDDING_CACHE_SIZE", 10000)),
+            ttl_seconds=float(os.getenv("RAG_EMBEDDING_CACHE_TTL", 86400)),
+            store=SQLiteEmbeddingStore(path) if path else None,
+        )
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        payload = f"{model}\x00{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, text: str, model: str):
+        """Devuelve el embedding cacheado como array float32, o None"""
+        if self.max_entries <= 0:
+            return None
+
+        key = self.make_key(text, model)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+
+        if self.store is not None:
+            vector = self.store.get(key, self.ttl_seconds)
+            if vector is not None:
+                self._remember(key, vector, now)
+                with self._lock:
+                    self.hits += 1
+                    self.store_hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text: str, model: str, vector):
+        """Guarda un embedding en la caché (y en el store persistente si lo hay)"""
+        if self.max_entries <= 0:
+            return
+
+        key = self.make_key(text, model)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector, time.time())
+        if self.store is not None:
+            self.store.put(key, model, vector)
+
+    def _remember(self, key: str, vector: np.ndarray, now: float):
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Contadores de aciertos y fallos de la caché"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "store_hits": self.store_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self.store is not None,
+            }
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
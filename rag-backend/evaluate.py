@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Evaluación de la recuperación con un conjunto de preguntas de referencia.
+
+Cada línea del fichero JSONL es una pregunta con los chunk_id relevantes,
+como lista (relevancia binaria) o como dict con la relevancia graduada:
+
+    {"question": "¿Cuándo se aplica el nitrógeno?", "relevant": ["doc1_3", "doc1_4"]}
+    {"question": "Dosis de fósforo en maíz", "relevant": {"doc7_0": 2, "doc7_1": 1}}
+
+Una pregunta puede llevar además "filters" (los mismos que acepta /query),
+que se aplican a su búsqueda:
+
+    {"question": "Variedades recomendadas", "relevant": ["doc9_2"], "filters": {"crop": "maize"}}
+
+Las preguntas se pasan por cada configuración de recuperación (vectorial,
+híbrida, con reranking, distintos nprobe del índice IVF-PQ...) con varias
+consultas en paralelo, y para cada una se calculan recall@k, MRR y nDCG@k,
+la latencia p50/p95 de la búsqueda y los tokens que costaría cada pregunta
+(embedding de la pregunta y contexto que llegaría al modelo). Los embeddings
+de las preguntas se calculan una sola vez, así que la latencia es la de la
+recuperación y el reranking.
+
+Una configuración es un conjunto de variables de entorno que se aplican
+encima de las actuales (RAG_RETRIEVER, RAG_SEARCH_MODE, RAG_RERANKER,
+RAG_ANN_NPROBE...). Además de las predefinidas se pueden definir otras en un
+JSON ({"nombre": {"VARIABLE": "valor"}}) con --config-file.
+
+Uso:
+    python evaluate.py golden.jsonl --configs vector,hybrid,reranked --output eval_baseline.json
+    python evaluate.py golden.jsonl --nprobe 4,16,64 --compare eval_baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from benchmarks.report import run_meta, summarize
+from filters import normalize_filters
+from rag_service import AsyncRAGService, load_azure_settings
+from reranker import RerankStage
+from retrievers import create_retriever
+from timing import StageTimer
+
+DEFAULT_CONFIGS = {
+    "vector": {"RAG_SEARCH_MODE": "vector", "RAG_RERANKER": "none"},
+    "hybrid": {"RAG_SEARCH_MODE": "hybrid", "RAG_RERANKER": "none"},
+    "reranked": {"RAG_SEARCH_MODE": "vector", "RAG_RERANKER": "lexical"},
+    "hybrid_reranked": {"RAG_SEARCH_MODE": "hybrid", "RAG_RERANKER": "lexical"},
+}
+
+
+def load_golden_set(path: str):
+    """Lee el conjunto de referencia; devuelve una lista de (pregunta, {chunk_id: relevancia}, filtros)"""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            relevant = item.get("relevant")
+            if isinstance(relevant, list):
+                relevant = {chunk_id: 1 for chunk_id in relevant}
+            if not item.get("question") or not relevant:
+                raise ValueError(f"{path}:{line_number}: 'question' and a non-empty 'relevant' are required")
+            try:
+                filters = normalize_filters(item.get("filters"))
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: {e}")
+            questions.append((item["question"], {str(k): float(v) for k, v in relevant.items()}, filters))
+    return questions
+
+
+def recall_at_k(ranked, relevant, k: int) -> float:
+    """Fracción de los chunks relevantes que aparecen entre los k primeros"""
+    return len(set(ranked[:k]) & set(relevant)) / len(relevant)
+
+
+def reciprocal_rank(ranked, relevant) -> float:
+    """1 / posición del primer chunk relevante (0 si no aparece ninguno)"""
+    for rank, chunk_id in enumerate(ranked, start=1):
+        if chunk_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked, relevant, k: int) -> float:
+    """nDCG@k con ganancia 2^relevancia - 1 (con relevancia binaria, el nDCG clásico)"""
+    dcg = sum((2 ** relevant.get(chunk_id, 0) - 1) / math.log2(rank + 1)
+              for rank, chunk_id in enumerate(ranked[:k], start=1))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 1) for rank, grade in enumerate(ideal, start=1))
+    return dcg / idcg if idcg else 0.0
+
+
+@contextmanager
+def environment(overrides):
+    """Aplica las variables de overrides mientras dura el bloque"""
+    previous = {name: os.environ.get(name) for name in overrides}
+    os.environ.update({name: str(value) for name, value in overrides.items()})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def select_configs(names: str, config_file: str = None, nprobe: str = None):
+    """Configuraciones a evaluar, en orden: las pedidas por nombre y una por cada nprobe"""
+    available = dict(DEFAULT_CONFIGS)
+    if config_file:
+        with open(config_file, encoding="utf-8") as f:
+            available.update(json.load(f))
+
+    configs = {}
+    for name in filter(None, (name.strip() for name in names.split(","))):
+        if name not in available:
+            raise ValueError(f"Unknown configuration '{name}' (available: {', '.join(available)})")
+        configs[name] = available[name]
+    for value in filter(None, (value.strip() for value in (nprobe or "").split(","))):
+        configs[f"ann_nprobe_{value}"] = {
+            "RAG_RETRIEVER": "local", "RAG_SEARCH_MODE": "vector", "RAG_RERANKER": "none",
+            "RAG_ANN_ENABLED": "true", "RAG_ANN_NPROBE": value,
+        }
+    return configs
+
+
+async def evaluate_config(service, golden, vectors, ks, answer_k: int, concurrency: int, warmup: int):
+    """Pasa las preguntas por el retriever y el reranker que tenga el servicio y resume los resultados"""
+    top_k = max(ks)
+    counter = service.context_builder.counter
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(question, filters, vector):
+        async with semaphore:
+            timer = StageTimer()
+            results = await service.search_documents(question, top_k, query_vector=vector, timer=timer,
+                                                     use_cache=False, filters=filters)
+            return results, timer.total(), timer.timings
+
+    # Las primeras búsquedas pagan la carga de páginas del índice y de los modelos: no se miden
+    for (question, _, filters), vector in list(zip(golden, vectors))[:warmup]:
+        await run(question, filters, vector)
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(run(question, filters, vector) for (question, _, filters), vector in zip(golden, vectors)))
+    elapsed = time.perf_counter() - start
+
+    scores = {f"recall@{k}": [] for k in ks}
+    scores.update({f"ndcg@{k}": [] for k in ks})
+    scores["mrr"] = []
+    latencies, stages, context_tokens, embedding_tokens = [], {}, [], []
+    for (question, relevant, _), (results, latency, timings) in zip(golden, outcomes):
+        ranked = [result["chunk_id"] for result in results]
+        for k in ks:
+            scores[f"recall@{k}"].append(recall_at_k(ranked, relevant, k))
+            scores[f"ndcg@{k}"].append(ndcg_at_k(ranked, relevant, k))
+        scores["mrr"].append(reciprocal_rank(ranked, relevant))
+        latencies.append(latency)
+        for stage, milliseconds in timings.items():
+            stages.setdefault(stage, []).append(milliseconds)
+        # Lo que costaría responder: el contexto con los answer_k primeros, como en /query
+        context_tokens.append(service.context_builder.build(question, results[:answer_k])["context_tokens"])
+        embedding_tokens.append(counter.count(question))
+
+    return {
+        "metrics": {name: round(float(np.mean(values)), 4) for name, values in scores.items()},
+        "latency_ms": summarize(latencies, (50, 95), digits=3),
+        "stages_ms": {stage: summarize(values, (50, 95), digits=3) for stage, values in stages.items()},
+        "throughput_qps": round(len(golden) / elapsed, 2) if elapsed > 0 else None,
+        "tokens": {
+            "embedding_mean": round(float(np.mean(embedding_tokens)), 1),
+            "context_mean": round(float(np.mean(context_tokens)), 1),
+            "context_total": int(sum(context_tokens)),
+        },
+        "per_question": [
+            {"question": question, "retrieved": [result["chunk_id"] for result in results],
+             "reciprocal_rank": rr}
+            for (question, _, _), (results, _, _), rr in zip(golden, outcomes, scores["mrr"])
+        ],
+    }
+
+
+async def run_evaluation(golden, configs, ks, answer_k: int, concurrency: int, warmup: int):
+    # El servicio solo aporta los embeddings, el contexto y search_documents: sin cachés de resultados
+    with environment({"RAG_RETRIEVAL_CACHE_SIZE": 0, "RAG_QUERY_LOG_SIZE": 0, "RAG_WARMUP_TOP_N": 0}):
+        service = AsyncRAGService()
+    default_retriever, default_reranker = service.retriever, service.reranker
+    report = {}
+    try:
+        start = time.perf_counter()
+        vectors = await service.get_embeddings([question for question, _, _ in golden])
+        print(f"Embeddings de {len(golden)} preguntas en {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        for name, overrides in configs.items():
+            with environment(overrides):
+                settings = load_azure_settings(require_search=os.getenv("RAG_RETRIEVER", "azure") == "azure")
+                service.retriever = create_retriever(settings)
+                service.reranker = RerankStage.from_env()
+            try:
+                report[name] = dict(
+                    await evaluate_config(service, golden, vectors, ks, answer_k, concurrency, warmup),
+                    overrides=overrides
+                )
+            finally:
+                await service.retriever.close()
+            print_config(name, report[name], ks)
+    finally:
+        service.retriever, service.reranker = default_retriever, default_reranker
+        await service.close()
+    return report
+
+
+def print_config(name: str, result, ks):
+    metrics = result["metrics"]
+    k = max(ks)
+    print(f"{name:<18} recall@{k} {metrics[f'recall@{k}']:.3f}  MRR {metrics['mrr']:.3f}  "
+          f"nDCG@{k} {metrics[f'ndcg@{k}']:.3f}  p50 {result['latency_ms'].get('p50', 0):.1f} ms  "
+          f"p95 {result['latency_ms'].get('p95', 0):.1f} ms  contexto {result['tokens']['context_mean']:.0f} tokens")
+
+
+def print_table(report, ks):
+    columns = [f"recall@{k}" for k in ks] + ["mrr"] + [f"ndcg@{k}" for k in ks]
+    print(f"\n{'config':<18}" + "".join(f"{column:>10}" for column in columns)
+          + f"{'p50 ms':>9}{'p95 ms':>9}{'tokens':>8}")
+    for name, result in report.items():
+        print(f"{name:<18}" + "".join(f"{result['metrics'][column]:>10.3f}" for column in columns)
+              + f"{result['latency_ms'].get('p50', 0):>9.1f}{result['latency_ms'].get('p95', 0):>9.1f}"
+              + f"{result['tokens']['context_mean']:>8.0f}")
+
+
+def compare(baseline, current, quality_threshold: float, latency_threshold: float):
+    """
+    Imprime la diferencia con otra evaluación; devuelve las regresiones.
+
+    Una métrica de calidad es regresión si baja más de quality_threshold (en
+    valor absoluto); la latencia p50/p95, si sube más de latency_threshold
+    (relativo). Los tokens solo se muestran.
+    """
+    commit = baseline.get("meta", {}).get("git", {}).get("commit", "")[:10] or "?"
+    print(f"\nComparación con {commit} (calidad -{quality_threshold:.3f}, latencia +{latency_threshold:.0%}):")
+    print(f"{'config':<18} {'métrica':<14} {'antes':>9} {'ahora':>9} {'cambio':>9}")
+
+    regressions = []
+    for name, result in current["configs"].items():
+        before = baseline["configs"].get(name)
+        if before is None:
+            continue
+        rows = []
+        for metric, value in result["metrics"].items():
+            old = before["metrics"].get(metric)
+            if old is not None:
+                rows.append((metric, old, value, value - old, old - value > quality_threshold, False))
+        for key in ("p50", "p95"):
+            old, new = before["latency_ms"].get(key), result["latency_ms"].get(key)
+            if old and new is not None:
+                change = (new - old) / old
+                rows.append((f"latency_{key}_ms", old, new, change, change > latency_threshold, True))
+        old, new = before["tokens"].get("context_mean"), result["tokens"].get("context_mean")
+        if old and new is not None:
+            rows.append(("context_tokens", old, new, (new - old) / old, False, True))
+
+        for metric, old, new, change, flagged, relative in rows:
+            if flagged:
+                regressions.append((name, metric, old, new))
+            shown = f"{change:>+9.1%}" if relative else f"{change:>+9.3f}"
+            print(f"{name:<18} {metric:<14} {old:>9.3f} {new:>9.3f} {shown}{'  ⚠️ regresión' if flagged else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calidad y latencia de la recuperación sobre preguntas de referencia")
+    parser.add_argument("golden", help="JSONL con question y los chunk_id relevantes (relevant)")
+    parser.add_argument("--configs", default="vector,hybrid,reranked",
+                        help=f"Configuraciones separadas por comas (predefinidas: {', '.join(DEFAULT_CONFIGS)})")
+    parser.add_argument("--config-file", help='JSON con más configuraciones: {"nombre": {"VARIABLE": "valor"}}')
+    parser.add_argument("--nprobe", help="Valores de nprobe del índice IVF-PQ a evaluar (índice local), p. ej. 4,16,64")
+    parser.add_argument("--k", default="1,3,5,10", help="Cortes k de recall@k y nDCG@k")
+    parser.add_argument("--answer-k", type=int, default=3, help="Resultados que entran en el contexto de la respuesta")
+    parser.add_argument("--concurrency", type=int, default=4, help="Preguntas en paralelo")
+    parser.add_argument("--warmup", type=int, default=3, help="Preguntas no medidas antes de cada configuración")
+    parser.add_argument("--output", help="Fichero JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="Resultados JSON de referencia (por ejemplo, de otro commit)")
+    parser.add_argument("--quality-threshold", type=float, default=0.01,
+                        help="Bajada absoluta de recall, MRR o nDCG que cuenta como regresión")
+    parser.add_argument("--latency-threshold", type=float, default=0.2,
+                        help="Subida relativa de la latencia p50/p95 que cuenta como regresión")
+    parser.add_argument("--per-question", action="store_true", help="Guardar en el JSON lo recuperado por pregunta")
+    args = parser.parse_args()
+
+    golden = load_golden_set(args.golden)
+    ks = sorted({int(k) for k in args.k.split(",")})
+    configs = select_configs(args.configs, args.config_file, args.nprobe)
+    if not configs:
+        parser.error("no configurations to evaluate")
+    print(f"{len(golden)} preguntas, configuraciones: {', '.join(configs)}")
+
+    results = asyncio.run(run_evaluation(golden, configs, ks, args.answer_k, args.concurrency, args.warmup))
+    print_table(results, ks)
+    if not args.per_question:
+        for result in results.values():
+            result.pop("per_question")
+
+    report = {
+        "meta": run_meta(golden_set=os.path.abspath(args.golden), questions=len(golden)),
+        "config": vars(args),
+        "configs": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.quality_threshold, args.latency_threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regresiones")
+            sys.exit(1)
+        print("\n✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Filtros por metadatos de las búsquedas.
+
+Un filtro es un dict campo -> valor o lista de valores, por ejemplo
+{"crop": "maize", "region": ["norte", "centro"]}: un chunk pasa si, para
+cada campo, su valor es uno de los indicados (AND entre campos, OR dentro de
+un campo). Los valores son escalares (texto, número o booleano).
+
+En Azure Search se traduce a un filtro OData; en el índice local se
+resuelve con el índice de atributos (ver attribute_index.py).
+"""
+
+import json
+import os
+import re
+
+FIELD_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]{0,63}$")
+# Campos propios de cada chunk, que no se pueden usar como metadatos
+RESERVED_FIELDS = {"chunk_id", "parent_id", "title", "chunk"}
+MAX_FILTER_VALUES = 100
+
+
+def filterable_fields():
+    """Campos admitidos según RAG_FILTER_FIELDS (None = cualquiera)"""
+    fields = [field.strip() for field in os.getenv("RAG_FILTER_FIELDS", "").split(",") if field.strip()]
+    return set(fields) or None
+
+
+def is_scalar(value) -> bool:
+    return isinstance(value, (str, int, float, bool))
+
+
+def normalize_filters(filters):
+    """
+    Valida un filtro y lo devuelve en forma canónica: campos ordenados y una
+    lista de valores sin repetir por campo. Devuelve None si no filtra nada.
+    Lanza ValueError si un campo o un valor no son válidos.
+    """
+    if not filters:
+        return None
+    allowed = filterable_fields()
+    normalized = {}
+    for field in sorted(filters):
+        if not FIELD_PATTERN.match(field) or field in RESERVED_FIELDS:
+            raise ValueError(f"Invalid filter field '{field}'")
+        if allowed is not None and field not in allowed:
+            raise ValueError(f"Field '{field}' is not filterable (RAG_FILTER_FIELDS: {', '.join(sorted(allowed))})")
+        values = filters[field] if isinstance(filters[field], (list, tuple)) else [filters[field]]
+        if not values or len(values) > MAX_FILTER_VALUES:
+            raise ValueError(f"Filter '{field}' needs between 1 and {MAX_FILTER_VALUES} values")
+        if not all(is_scalar(value) for value in values):
+            raise ValueError(f"Filter '{field}' values must be strings, numbers or booleans")
+        normalized[field] = list(dict.fromkeys(values))
+    return normalized
+
+
+def filters_key(filters) -> str:
+    """Clave estable de un filtro para las cachés ('' sin filtro)"""
+    filters = normalize_filters(filters)
+    return json.dumps(filters, ensure_ascii=False, sort_keys=True) if filters else ""
+
+
+def odata_literal(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + value.replace("'", "''") + "'"
+
+
+def to_odata(filters):
+    """Expresión $filter de OData para Azure Search (None sin filtro)"""
+    filters = normalize_filters(filters)
+    if not filters:
+        return None
+    clauses = []
+    for field, values in filters.items():
+        if len(values) == 1:
+            clauses.append(f"{field} eq {odata_literal(values[0])}")
+        elif all(isinstance(value, str) and "|" not in value for value in values):
+            # search.in es más rápido que una cadena de "or" con muchos valores
+            joined = "|".join(values).replace("'", "''")
+            clauses.append(f"search.in({field}, '{joined}', '|')")
+        else:
+            clauses.append("(" + " or ".join(f"{field} eq {odata_literal(value)}" for value in values) + ")")
+    return " and ".join(clauses)
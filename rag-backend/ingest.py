@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""
+Pipeline de ingesta: documentos -> chunks -> embeddings -> índice.
+
+Cada etapa es un generador, así que en memoria solo hay unos pocos lotes a
+la vez sin importar el tamaño del corpus:
+
+    iter_documents  recorre el directorio (PDF, texto y markdown)
+    iter_chunks     trocea el texto en streaming con tamaño y solape
+    plan_changes    descarta los ficheros y chunks que no han cambiado desde
+                    la última ingesta (ver ingest_manifest.py)
+    Embedder        calcula embeddings por lotes con un pool de hilos y
+                    reintentos con backoff ante límites de cuota
+    *Sink           sube los chunks a Azure Search por lotes o al índice local
+
+La ingesta es incremental: una pasada sobre un corpus sin cambios solo hace
+un stat por fichero y ninguna llamada de embeddings. Los chunks de los
+documentos modificados se actualizan (upsert) y los de los documentos
+borrados o acortados se eliminan del índice.
+
+Cada chunk lleva como campos los metadatos de su documento, que sirven para
+filtrar las búsquedas (ver filters.py): los de --metadata, comunes a todos,
+y los del fichero <documento>.meta.json si existe (p. ej. guia.pdf.meta.json
+con {"crop": "maize", "region": "norte"}), que tienen prioridad.
+
+Uso:
+    python ingest.py ./docs --target azure
+    python ingest.py ./docs --target azure --metadata collection=fichas --metadata language=es
+    python ingest.py ./docs --target local --index-path ./local_index --build-ann
+    python ingest.py ./docs --target local --index-path ./local_index --quantize int8
+    python ingest.py ./docs --target local --index-path ./local_index --full
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import openai
+
+from filters import FIELD_PATTERN, RESERVED_FIELDS, is_scalar
+from ingest_manifest import IngestManifest
+from rag_service import EMBEDDING_MODEL, decode_embedding, load_azure_settings
+from resilience import retry_after_seconds
+
+DEFAULT_EXTENSIONS = (".pdf", ".txt", ".md", ".markdown")
+READ_BLOCK_SIZE = 1 << 20
+MANIFEST_FILE = "ingest_manifest.sqlite"
+METADATA_SUFFIX = ".meta.json"
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+def document_id(relative_path: str) -> str:
+    """Identificador estable de un documento (válido como clave de Azure Search)"""
+    return hashlib.sha1(relative_path.replace(os.sep, "/").encode("utf-8")).hexdigest()[:16]
+
+
+def read_text_blocks(path: str):
+    """Lee un fichero de texto por bloques"""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def read_pdf_pages(path: str):
+    """Extrae el texto de un PDF página a página (requiere pypdf)"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ImportError("PDF ingestion requires pypdf: pip install pypdf")
+
+    reader = PdfReader(path)
+    for page in reader.pages:
+        text = page.extract_text() or ""
+        if text:
+            yield text + "\n"
+
+
+def check_metadata(metadata, origin: str):
+    """Comprueba que los metadatos se pueden indexar y filtrar; devuelve el mismo dict"""
+    for field, value in metadata.items():
+        if not FIELD_PATTERN.match(field) or field in RESERVED_FIELDS or field == "source":
+            raise ValueError(f"{origin}: invalid metadata field '{field}'")
+        if not is_scalar(value):
+            raise ValueError(f"{origin}: metadata '{field}' must be a string, number or boolean")
+    return metadata
+
+
+def read_metadata(path: str):
+    """Metadatos del fichero <path>.meta.json ({} si no existe)"""
+    metadata_path = path + METADATA_SUFFIX
+    if not os.path.exists(metadata_path):
+        return {}
+    with open(metadata_path, encoding="utf-8") as f:
+        return check_metadata(json.load(f), metadata_path)
+
+
+def iter_documents(root: str, extensions=DEFAULT_EXTENSIONS, metadata=None):
+    """
+    Recorre root y produce un dict por documento.
+
+    El texto no se lee aquí: "segments" es un generador de bloques (páginas
+    en los PDF) que se consume al trocear. "metadata" combina metadata
+    (comunes a todos) con los del fichero .meta.json del documento.
+    """
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            extension = os.path.splitext(name)[1].lower()
+            if extension not in extensions:
+                continue
+            path = os.path.join(directory, name)
+            relative_path = os.path.relpath(path, root)
+            yield {
+                "path": path,
+                "relative_path": relative_path,
+                "parent_id": document_id(relative_path),
+                "title": os.path.splitext(name)[0],
+                "segments": read_pdf_pages(path) if extension == ".pdf" else read_text_blocks(path),
+                "metadata": {**(metadata or {}), **read_metadata(path)},
+            }
+
+
+def chunk_text(segments, chunk_size: int = 2000, chunk_overlap: int = 200):
+    """
+    Trocea un flujo de texto en chunks de como mucho chunk_size caracteres.
+
+    Cada chunk empieza chunk_overlap caracteres antes del final del anterior y
+    se intenta cortar en un espacio para no partir palabras; el solape
+    también empieza en una palabra. El último trozo solo se emite si añade
+    texto al chunk anterior.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+
+    buffer = ""
+    covered = 0  # Caracteres de buffer que ya están en algún chunk
+    for segment in segments:
+        buffer += segment
+        start = 0
+        while len(buffer) - start >= chunk_size:
+            end = start + chunk_size
+            cut = buffer.rfind(" ", start + chunk_size // 2, end)
+            if cut <= start:
+                cut = end
+            chunk = buffer[start:cut].strip()
+            if chunk:
+                yield chunk
+            covered = cut
+            # El solape empieza en la primera palabra entera de los últimos chunk_overlap caracteres
+            overlap = buffer.find(" ", cut - chunk_overlap, cut) if chunk_overlap else -1
+            start = max(overlap + 1 if overlap != -1 else cut, start + 1)
+        buffer = buffer[start:]
+        covered = max(covered - start, 0)
+
+    if buffer[covered:].strip():
+        chunk = buffer.strip()
+        if chunk:
+            yield chunk
+
+
+def iter_chunks(documents, chunk_size: int = 2000, chunk_overlap: int = 200):
+    """Produce un dict por chunk con chunk_id, parent_id, title, chunk, source y los metadatos"""
+    for document in documents:
+        for i, chunk in enumerate(chunk_text(document["segments"], chunk_size, chunk_overlap)):
+            yield {
+                **document.get("metadata", {}),
+                "chunk_id": f"{document['parent_id']}_{i}",
+                "parent_id": document["parent_id"],
+                "title": document["title"],
+                "chunk": chunk,
+                "source": document["relative_path"],
+            }
+
+
+def content_hash(chunk, model: str = EMBEDDING_MODEL) -> str:
+    """Hash de lo que determina el embedding y el documento indexado de un chunk"""
+    parts = [model, chunk["title"], chunk["chunk"]]
+    metadata = {key: value for key, value in chunk.items() if key not in RESERVED_FIELDS and key != "source"}
+    if metadata:
+        # Sin metadatos el hash no cambia respecto a los manifiestos anteriores
+        parts.append(json.dumps(metadata, ensure_ascii=False, sort_keys=True))
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def file_signature(path: str):
+    """(tamaño, mtime) del documento; editar su .meta.json cuenta como modificarlo"""
+    stat = os.stat(path)
+    mtime = stat.st_mtime_ns
+    if os.path.exists(path + METADATA_SUFFIX):
+        mtime = max(mtime, os.stat(path + METADATA_SUFFIX).st_mtime_ns)
+    return stat.st_size, mtime
+
+
+def plan_changes(documents, manifest: IngestManifest, stats: dict, deleted_ids: list,
+                 chunk_size: int = 2000, chunk_overlap: int = 200, model: str = EMBEDDING_MODEL,
+                 force: bool = False, metadata=None):
+    """
+    Produce solo los chunks nuevos o modificados respecto al manifiesto.
+
+    Los ficheros con el mismo tamaño y fecha de modificación no se leen. Los
+    chunk_id que ya no existen (documentos borrados o que ahora tienen menos
+    chunks) se añaden a deleted_ids. El manifiesto se actualiza sobre la
+    marcha, pero sin confirmar: eso lo hace run_pipeline al final. Cambiar
+    los metadatos comunes (metadata) obliga a revisar todos los ficheros.
+    """
+    settings = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "model": model}
+    if metadata:
+        settings["metadata"] = metadata
+    rescan = force or manifest.get_setting("chunking") != settings
+    known_files = manifest.files()
+    seen = set()
+
+    for document in documents:
+        relative_path = document["relative_path"]
+        seen.add(relative_path)
+        size, mtime = file_signature(document["path"])
+        known = known_files.get(relative_path)
+        if not rescan and known == (document["parent_id"], size, mtime):
+            stats["files_unchanged"] += 1
+            continue
+
+        previous = manifest.chunk_hashes(document["parent_id"])
+        hashes = {}
+        for chunk in iter_chunks([document], chunk_size, chunk_overlap):
+            hashes[chunk["chunk_id"]] = content_hash(chunk, model)
+            if not force and previous.get(chunk["chunk_id"]) == hashes[chunk["chunk_id"]]:
+                stats["chunks_unchanged"] += 1
+                continue
+            yield chunk
+
+        deleted_ids.extend(previous.keys() - hashes.keys())
+        manifest.set_chunks(document["parent_id"], hashes)
+        manifest.set_file(relative_path, document["parent_id"], size, mtime)
+
+    for relative_path, (parent_id, _, _) in known_files.items():
+        if relative_path not in seen:
+            deleted_ids.extend(manifest.chunk_hashes(parent_id))
+            manifest.remove_file(relative_path, parent_id)
+            stats["files_deleted"] += 1
+
+    manifest.set_setting("chunking", settings)
+
+
+def batched(iterable, size: int):
+    """Agrupa un iterable en listas de como mucho size elementos"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Embedder:
+    """
+    Calcula embeddings de lotes de chunks en paralelo.
+
+    Mantiene como mucho max_workers * 2 lotes en vuelo y los devuelve en el
+    mismo orden en que entraron. Los errores de cuota (429) y transitorios se
+    reintentan con backoff exponencial con jitter, respetando Retry-After.
+    """
+
+    def __init__(self, client, model: str = EMBEDDING_MODEL, max_workers: int = 4, max_retries: int = 8):
+        self.client = client
+        self.model = model
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.calls = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        """Embeddings de una lista de textos (una llamada, con reintentos)"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._lock:
+                    self.calls += 1
+                response = self.client.embeddings.create(
+                    model=self.model,
+                    input=texts,
+                    encoding_format="base64"
+                )
+                vectors = [None] * len(texts)
+                for item in response.data:
+                    vectors[item.index] = decode_embedding(item.embedding)
+                return vectors
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                delay = retry_after_seconds(e) or min(60.0, 2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay / 2))
+
+    def embed_batches(self, batches):
+        """Recibe lotes de chunks y produce (lote, vectores) en orden"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            in_flight = deque()
+            for batch in batches:
+                in_flight.append((batch, pool.submit(self.embed, [chunk["chunk"] for chunk in batch])))
+                if len(in_flight) >= self.max_workers * 2:
+                    batch, future = in_flight.popleft()
+                    yield batch, future.result()
+            while in_flight:
+                batch, future = in_flight.popleft()
+                yield batch, future.result()
+
+
+class AzureSearchSink:
+    """Sube los chunks a Azure Search en lotes de merge_or_upload_documents (upsert)"""
+
+    def __init__(self, search_client, batch_size: int = 1000, vector_field: str = "text_vector"):
+        self.search_client = search_client
+        self.batch_size = batch_size
+        self.vector_field = vector_field
+        self._pending = []
+        self.uploaded = 0
+
+    def write(self, chunks, vectors):
+        for chunk, vector in zip(chunks, vectors):
+            document = {key: value for key, value in chunk.items() if key != "source"}
+            document[self.vector_field] = vector.tolist()
+            self._pending.append(document)
+        while len(self._pending) >= self.batch_size:
+            self._flush(self._pending[:self.batch_size])
+            self._pending = self._pending[self.batch_size:]
+
+    def _flush(self, documents):
+        results = self.search_client.merge_or_upload_documents(documents=documents)
+        failed = [result.key for result in results if not result.succeeded]
+        if failed:
+            raise RuntimeError(f"Failed to upload {len(failed)} documents, e.g. {failed[:5]}")
+        self.uploaded += len(documents)
+
+    def delete(self, chunk_ids):
+        """Elimina documentos por chunk_id; devuelve cuántos se han borrado"""
+        for batch in batched(chunk_ids, self.batch_size):
+            results = self.search_client.delete_documents(documents=[{"chunk_id": chunk_id} for chunk_id in batch])
+            failed = [result.key for result in results if not result.succeeded]
+            if failed:
+                raise RuntimeError(f"Failed to delete {len(failed)} documents, e.g. {failed[:5]}")
+        return len(chunk_ids)
+
+    def close(self):
+        if self._pending:
+            self._flush(self._pending)
+            self._pending = []
+
+
+class LocalIndexSink:
+    """
+    Escribe los chunks en un índice local (ver local_index.py).
+
+    Con append=True actualiza el índice existente (upsert por chunk_id); si
+    no, lo crea de nuevo.
+    """
+
+    def __init__(self, path: str, append: bool = True):
+        self.path = path
+        self.append = append
+        self.writer = None
+        self.uploaded = 0
+
+    def _open(self, dimensions: int):
+        from local_index import LocalIndexWriter
+
+        if self.writer is None:
+            self.writer = LocalIndexWriter(self.path, dimensions, append=self.append)
+        return self.writer
+
+    def write(self, chunks, vectors):
+        self._open(len(vectors[0])).add(chunks, vectors)
+        self.uploaded += len(chunks)
+
+    def delete(self, chunk_ids):
+        from local_index import INDEX_FILE, read_header
+
+        if self.writer is None:
+            if not self.append or not os.path.exists(os.path.join(self.path, INDEX_FILE)):
+                return 0
+            self._open(read_header(self.path)["dimensions"])
+        return self.writer.delete(chunk_ids)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def run_pipeline(root: str, embedder: Embedder, sink, manifest: IngestManifest = None, chunk_size: int = 2000,
+                 chunk_overlap: int = 200, batch_size: int = 256, extensions=DEFAULT_EXTENSIONS, force: bool = False,
+                 metadata=None):
+    """
+    Ejecuta la ingesta y devuelve estadísticas.
+
+    Con manifest la ingesta es incremental (ver plan_changes); sin él se
+    procesan todos los chunks. metadata se añade a todos los chunks.
+    """
+    start = time.perf_counter()
+    stats = {"files_unchanged": 0, "files_deleted": 0, "chunks_unchanged": 0, "chunks_deleted": 0}
+    deleted_ids = []
+    documents = iter_documents(root, extensions, metadata)
+    if manifest is not None:
+        chunks = plan_changes(documents, manifest, stats, deleted_ids, chunk_size, chunk_overlap,
+                              embedder.model, force, metadata)
+    else:
+        chunks = iter_chunks(documents, chunk_size, chunk_overlap)
+
+    try:
+        for batch, vectors in embedder.embed_batches(batched(chunks, batch_size)):
+            sink.write(batch, vectors)
+        if deleted_ids:
+            stats["chunks_deleted"] = sink.delete(deleted_ids)
+        sink.close()
+    except BaseException:
+        if manifest is not None:
+            manifest.rollback()
+        raise
+    if manifest is not None:
+        manifest.commit()
+
+    stats.update({
+        "chunks": sink.uploaded,
+        "embedding_calls": embedder.calls,
+        "retries": embedder.retries,
+        "seconds": round(time.perf_counter() - start, 2),
+    })
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta de documentos en el índice RAG")
+    parser.add_argument("directory", help="Directorio con los documentos (PDF, texto, markdown)")
+    parser.add_argument("--target", choices=["azure", "local"], default="azure")
+    parser.add_argument("--index-path", default=os.getenv("RAG_LOCAL_INDEX_PATH"), help="Directorio del índice local")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Tamaño máximo de cada chunk en caracteres")
+    parser.add_argument("--chunk-overlap", type=int, default=200, help="Solape entre chunks en caracteres")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks por llamada de embeddings")
+    parser.add_argument("--workers", type=int, default=4, help="Llamadas de embeddings en paralelo")
+    parser.add_argument("--upload-batch-size", type=int, default=1000, help="Documentos por lote de subida a Azure")
+    parser.add_argument("--build-ann", action="store_true", help="Construir el índice IVF-PQ al terminar (solo local)")
+    parser.add_argument("--build-bm25", action="store_true", help="Construir el índice BM25 al terminar (solo local)")
+    parser.add_argument("--quantize", choices=["float16", "int8"],
+                        help="Construir la copia cuantizada de los vectores al terminar (solo local)")
+    parser.add_argument("--manifest", help="Fichero SQLite con el estado de la ingesta incremental")
+    parser.add_argument("--full", action="store_true", help="Volver a procesar todos los documentos")
+    parser.add_argument("--metadata", action="append", default=[], metavar="CAMPO=VALOR",
+                        help="Metadato común a todos los documentos (repetible), p. ej. language=es")
+    args = parser.parse_args()
+
+    metadata = {}
+    for item in args.metadata:
+        field, separator, value = item.partition("=")
+        if not separator:
+            parser.error(f"--metadata expects CAMPO=VALOR, got '{item}'")
+        metadata[field.strip()] = value.strip()
+    try:
+        check_metadata(metadata, "--metadata")
+    except ValueError as e:
+        parser.error(str(e))
+
+    from openai import AzureOpenAI
+
+    settings = load_azure_settings(require_search=args.target == "azure")
+    client = AzureOpenAI(
+        api_key=settings["AZURE_OPENAI_API_KEY"],
+        azure_endpoint=settings["AZURE_OPENAI_ENDPOINT"],
+        api_version=settings["OPENAI_API_VERSION"],
+        max_retries=0
+    )
+    embedder = Embedder(client, max_workers=args.workers)
+
+    if args.target == "azure":
+        from azure.core.credentials import AzureKeyCredential
+        from azure.search.documents import SearchClient
+
+        sink = AzureSearchSink(
+            SearchClient(
+                endpoint=settings["AZURE_SEARCH_SERVICE_ENDPOINT"],
+                index_name=settings["AZURE_SEARCH_INDEX"],
+                credential=AzureKeyCredential(settings["AZURE_SEARCH_ADMIN_KEY"])
+            ),
+            batch_size=args.upload_batch_size
+        )
+        manifest_path = args.manifest or os.getenv("RAG_INGEST_MANIFEST_PATH", MANIFEST_FILE)
+    else:
+        if not args.index_path:
+            parser.error("--index-path (or RAG_LOCAL_INDEX_PATH) is required for --target local")
+        # Con --full el índice local se crea de nuevo
+        sink = LocalIndexSink(args.index_path, append=not args.full)
+        os.makedirs(args.index_path, exist_ok=True)
+        manifest_path = args.manifest or os.path.join(args.index_path, MANIFEST_FILE)
+
+    manifest = IngestManifest(manifest_path)
+    print(f"🚀 Ingestando {args.directory} en {args.target}...")
+    try:
+        stats = run_pipeline(
+            args.directory, embedder, sink, manifest,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            batch_size=args.batch_size,
+            force=args.full,
+            metadata=metadata
+        )
+    finally:
+        manifest.close()
+    print(f"✅ {stats['chunks']} chunks indexados y {stats['chunks_deleted']} borrados en {stats['seconds']} s "
+          f"({stats['embedding_calls']} llamadas de embeddings, {stats['retries']} reintentos)")
+    print(f"   Sin cambios: {stats['files_unchanged']} ficheros, {stats['chunks_unchanged']} chunks; "
+          f"{stats['files_deleted']} ficheros eliminados")
+
+    if args.build_ann and args.target == "local" and stats["chunks"]:
+        from ann_index import build_for_local_index
+
+        ann = build_for_local_index(args.index_path)
+        print(f"✅ Índice IVF-PQ construido con {ann.count} vectores")
+
+    if args.quantize and args.target == "local" and stats["chunks"]:
+        from quantized_index import build_for_local_index as build_quantized
+
+        quantized = build_quantized(args.index_path, args.quantize)
+        print(f"✅ Vectores {args.quantize} construidos para {quantized.count} filas")
+
+    if args.build_bm25 and args.target == "local" and stats["chunks"]:
+        from bm25_index import build_for_local_index as build_bm25
+
+        bm25 = build_bm25(args.index_path)
+        print(f"✅ Índice BM25 construido con {bm25.count} chunks y {len(bm25.vocabulary)} términos")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+
+
+class IngestManifest:
+    """
+    Estado de la última ingesta, guardado en SQLite.
+
+    Por cada fichero guarda su tamaño y fecha de modificación (para no volver
+    a leer los que no han cambiado) y por cada chunk el hash de su contenido
+    (para volver a calcular embeddings solo de los chunks que han cambiado).
+
+    Los cambios quedan en una transacción abierta hasta commit, que se llama
+    cuando el destino ya ha recibido los chunks: si la ingesta falla a medias,
+    la siguiente vuelve a procesar lo que no llegó a confirmarse.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                relative_path TEXT PRIMARY KEY,
+                parent_id TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                parent_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_parent ON chunks (parent_id);
+            CREATE TABLE IF NOT EXISTS settings (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def files(self):
+        """relative_path -> (parent_id, size, mtime_ns) de todos los ficheros ingestados"""
+        rows = self._conn.execute("SELECT relative_path, parent_id, size, mtime_ns FROM files")
+        return {relative_path: (parent_id, size, mtime_ns) for relative_path, parent_id, size, mtime_ns in rows}
+
+    def chunk_hashes(self, parent_id: str):
+        """chunk_id -> hash del contenido de los chunks de un documento"""
+        rows = self._conn.execute("SELECT chunk_id, content_hash FROM chunks WHERE parent_id = ?", (parent_id,))
+        return dict(rows)
+
+    def set_file(self, relative_path: str, parent_id: str, size: int, mtime_ns: int):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (relative_path, parent_id, size, mtime_ns) VALUES (?, ?, ?, ?)",
+            (relative_path, parent_id, size, mtime_ns)
+        )
+
+    def set_chunks(self, parent_id: str, hashes: dict):
+        """Reemplaza los chunks guardados de un documento"""
+        self._conn.execute("DELETE FROM chunks WHERE parent_id = ?", (parent_id,))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunks (chunk_id, parent_id, content_hash) VALUES (?, ?, ?)",
+            [(chunk_id, parent_id, content_hash) for chunk_id, content_hash in hashes.items()]
+        )
+
+    def remove_file(self, relative_path: str, parent_id: str):
+        self._conn.execute("DELETE FROM files WHERE relative_path = ?", (relative_path,))
+        self._conn.execute("DELETE FROM chunks WHERE parent_id = ?", (parent_id,))
+
+    def get_setting(self, name: str):
+        row = self._conn.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_setting(self, name: str, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)", (name, json.dumps(value))
+        )
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+"""
+Índice vectorial local en disco.
+
+Formato del directorio del índice:
+    index.json    dimensiones, número de filas y métrica
+    vectors.f32   matriz float32 contigua (filas normalizadas), se abre con mmap
+    chunks.jsonl  un JSON por fila con chunk_id, title, chunk y metadatos
+    offsets.u64   posición en bytes de cada fila dentro de chunks.jsonl
+    deleted.u8    marca de borrado (un byte por fila), opcional
+    attributes/   columnas de metadatos para los filtros (ver attribute_index.py)
+    ann/          índice aproximado IVF-PQ opcional (ver ann_index.py)
+    quantized/    copia float16 o int8 de los vectores, opcional (ver quantized_index.py)
+    bm25/         índice de palabras clave BM25 opcional (ver bm25_index.py)
+
+Las actualizaciones no reescriben el índice: una versión nueva de un chunk
+se añade al final y la fila anterior se marca como borrada. `compact`
+elimina las filas borradas.
+
+Uso:
+    python local_index.py build chunks.jsonl ./local_index
+    python local_index.py export-azure ./local_index
+    python local_index.py compact ./local_index
+"""
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ann_index import ANN_DIR, ANN_FILE, IVFPQIndex
+from attribute_index import ATTR_DIR, AttributeIndex, AttributeWriter
+from bm25_index import BM25_DIR
+from filters import filters_key
+from quantized_index import QUANT_DIR, QuantizedVectors
+
+INDEX_FILE = "index.json"
+VECTORS_FILE = "vectors.f32"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "offsets.u64"
+DELETED_FILE = "deleted.u8"
+# Filas por bloque al puntuar un subconjunto de la matriz (acota la copia en memoria)
+SCORE_BLOCK_ROWS = 65536
+
+
+def read_header(path: str):
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def read_deleted(path: str, count: int):
+    """Marcas de borrado de las filas del índice (False para las que no tienen)"""
+    deleted_path = os.path.join(path, DELETED_FILE)
+    if count and os.path.exists(deleted_path) and os.path.getsize(deleted_path) >= count:
+        # Cubre todas las filas: se abre con mmap (un byte 0/1 por fila es un bool de NumPy)
+        return np.memmap(deleted_path, dtype=bool, mode="r", shape=(count,))
+    deleted = np.zeros(count, dtype=bool)
+    if os.path.exists(deleted_path):
+        stored = np.fromfile(deleted_path, dtype=np.uint8)[:count]
+        deleted[:len(stored)] = stored.astype(bool)
+    return deleted
+
+
+def remove_stale(path: str, names):
+    """Borra los ficheros o directorios derivados del índice que ya no le corresponden"""
+    for name in names:
+        stale = os.path.join(path, name)
+        if os.path.isdir(stale):
+            shutil.rmtree(stale)
+        elif os.path.exists(stale):
+            os.remove(stale)
+
+
+def truncate(file_path: str, size: int):
+    """Recorta el fichero a size bytes (si es más largo)"""
+    if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+        with open(file_path, "r+b") as f:
+            f.truncate(size)
+
+
+def advise_random(array):
+    """Desactiva la lectura anticipada del mmap de array (se van a leer filas sueltas)"""
+    handle = getattr(array, "_mmap", None)
+    if handle is not None and hasattr(mmap, "MADV_RANDOM"):
+        handle.madvise(mmap.MADV_RANDOM)
+
+
+def normalize_rows(vectors):
+    """Normaliza cada fila a norma 1 para que el producto escalar sea el coseno"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LocalIndexWriter:
+    """
+    Escribe un índice local añadiendo lotes de chunks.
+
+    Los vectores y los chunks se escriben directamente a disco, así que la
+    memoria usada no depende del tamaño del corpus.
+
+    Con append=True se abre un índice existente para actualizarlo: add hace
+    upsert por chunk_id (la fila anterior queda marcada como borrada) y
+    delete marca filas como borradas. Las columnas de metadatos para los
+    filtros se escriben a la vez que los chunks.
+    """
+
+    def __init__(self, path: str, dimensions: int, append: bool = False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dimensions = dimensions
+        self.count = 0
+        self.deleted = np.zeros(0, dtype=bool)
+        self._rows = None
+
+        if append and os.path.exists(os.path.join(path, INDEX_FILE)):
+            header = read_header(path)
+            if header["dimensions"] != dimensions:
+                raise ValueError(f"Index has {header['dimensions']} dimensions, got {dimensions}")
+            self.count = header["count"]
+            # Copia modificable (read_deleted puede devolver un mmap de solo lectura)
+            self.deleted = np.array(read_deleted(path, self.count))
+            self._truncate()
+            self._rows = self._load_rows()
+            mode = "ab"
+        else:
+            mode = "wb"
+
+        # Al crear el índice de nuevo se escribe en ficheros .tmp que reemplazan a los
+        # anteriores al cerrar: los servidores que los tienen en mmap no ven cómo se truncan
+        self._suffix = ".tmp" if mode == "wb" else ""
+        self._vectors = open(os.path.join(path, VECTORS_FILE + self._suffix), mode)
+        self._chunks = open(os.path.join(path, CHUNKS_FILE + self._suffix), mode)
+        self._offsets = open(os.path.join(path, OFFSETS_FILE + self._suffix), mode)
+        if mode == "wb":
+            self._offsets.write(np.zeros(1, dtype=np.uint64).tobytes())
+        self._attributes = AttributeWriter(path, self.count, append=mode == "ab")
+
+    def _truncate(self):
+        """
+        Descarta lo que una escritura anterior que no llegó a cerrarse dejó
+        después de la fila count: las filas nuevas se añaden justo detrás.
+        """
+        offsets_path = os.path.join(self.path, OFFSETS_FILE)
+        end = np.fromfile(offsets_path, dtype=np.uint64, count=1, offset=self.count * 8)
+        if len(end) != 1:
+            raise ValueError(f"{offsets_path} has fewer than {self.count + 1} offsets")
+        truncate(os.path.join(self.path, VECTORS_FILE), self.count * self.dimensions * 4)
+        truncate(offsets_path, (self.count + 1) * 8)
+        truncate(os.path.join(self.path, CHUNKS_FILE), int(end[0]))
+
+    def _load_rows(self):
+        """chunk_id -> fila vigente, leyendo chunks.jsonl una vez"""
+        rows = {}
+        with open(os.path.join(self.path, CHUNKS_FILE), "rb") as f:
+            for row, line in enumerate(f):
+                if row >= self.count:
+                    break
+                if not self.deleted[row]:
+                    rows[json.loads(line).get("chunk_id")] = row
+        return rows
+
+    def add(self, chunks, vectors):
+        """Añade una lista de chunks (dicts) con sus vectores"""
+        vectors = normalize_rows(vectors)
+        if vectors.shape != (len(chunks), self.dimensions):
+            raise ValueError(f"Expected {len(chunks)} vectors of {self.dimensions} dimensions, got {vectors.shape}")
+
+        if self._rows is not None:
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(chunks), dtype=bool)])
+            for i, chunk in enumerate(chunks):
+                previous = self._rows.get(chunk.get("chunk_id"))
+                if previous is not None:
+                    self.deleted[previous] = True
+                self._rows[chunk.get("chunk_id")] = self.count + i
+
+        self._vectors.write(vectors.tobytes())
+        offsets = []
+        for chunk in chunks:
+            self._chunks.write(json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n")
+            offsets.append(self._chunks.tell())
+        self._offsets.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        self._attributes.add(chunks)
+        self.count += len(chunks)
+
+    def delete(self, chunk_ids):
+        """Marca como borradas las filas vigentes de esos chunk_id; devuelve cuántas"""
+        if self._rows is None:
+            return 0
+        rows = [self._rows.pop(chunk_id) for chunk_id in chunk_ids if chunk_id in self._rows]
+        self.deleted[rows] = True
+        return len(rows)
+
+    def close(self):
+        """Cierra los ficheros y escribe la cabecera del índice"""
+        for handle in (self._vectors, self._chunks, self._offsets):
+            handle.close()
+        self._attributes.close()
+        if self._suffix:
+            for name in (VECTORS_FILE, CHUNKS_FILE, OFFSETS_FILE):
+                os.replace(os.path.join(self.path, name + self._suffix), os.path.join(self.path, name))
+            # Los índices derivados del anterior apuntan a filas que ya no existen
+            remove_stale(self.path, (DELETED_FILE, ANN_DIR, BM25_DIR, QUANT_DIR))
+
+        deleted = np.zeros(self.count, dtype=bool)
+        deleted[:len(self.deleted)] = self.deleted
+        if deleted.any():
+            # Se reemplaza el fichero en vez de sobrescribirlo: los servidores que lo tienen en mmap siguen viendo el anterior
+            deleted_path = os.path.join(self.path, DELETED_FILE)
+            deleted.astype(np.uint8).tofile(deleted_path + ".tmp")
+            os.replace(deleted_path + ".tmp", deleted_path)
+
+        header_path = os.path.join(self.path, INDEX_FILE)
+        with open(header_path + ".tmp", "w") as f:
+            json.dump({
+                "dimensions": self.dimensions,
+                "count": self.count,
+                "deleted": int(deleted.sum()),
+                "metric": "cosine",
+            }, f)
+        os.replace(header_path + ".tmp", header_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalVectorIndex:
+    """
+    Búsqueda top-k por similitud coseno sobre una matriz en mmap.
+
+    Los vectores no se copian a memoria: el sistema operativo carga las páginas
+    del fichero según se usan, y varios workers que abren el mismo índice
+    comparten esas páginas (lectura sin copia). Los textos de los chunks se
+    leen del disco solo para las filas devueltas.
+
+    Si el directorio tiene un índice IVF-PQ (ann/) y use_ann es True, la
+    búsqueda pide top_k * refine candidatos al índice aproximado y los
+    reordena con el coseno exacto de la matriz; si no, recorre la matriz
+    entera. Las filas añadidas después de construir el IVF-PQ se comparan
+    siempre de forma exacta, y las filas borradas nunca se devuelven.
+
+    Con filtros por metadatos, el índice de atributos da primero la máscara
+    de filas que los cumplen. Si son pocas (hasta filter_exact_rows) se
+    comparan solo esas de forma exacta; si no, el IVF-PQ descarta las demás
+    de sus listas antes de calcular distancias, y amplía nprobe si no
+    encuentra top_k. Las máscaras de los filtros más usados se cachean.
+
+    Sin IVF-PQ, si el directorio tiene una copia cuantizada de los vectores
+    (quantized/) y use_quantized es True, la búsqueda recorre esa copia (la
+    mitad o la cuarta parte de memoria) y reordena los top_k * rescore
+    mejores con los vectores float32, de los que solo se leen esas filas.
+    """
+
+    def __init__(self, path: str, use_ann: bool = True, nprobe: int = 16, refine: int = 10,
+                 filter_exact_rows: int = 20000, mask_cache_size: int = 64, use_quantized: bool = True,
+                 rescore: int = 10):
+        header = read_header(path)
+
+        self.path = path
+        self.dimensions = header["dimensions"]
+        self.count = header["count"]
+        if self.count:
+            self.vectors = np.memmap(
+                os.path.join(path, VECTORS_FILE), dtype=np.float32, mode="r",
+                shape=(self.count, self.dimensions)
+            )
+        else:
+            self.vectors = np.zeros((0, self.dimensions), dtype=np.float32)
+        self.offsets = np.memmap(os.path.join(path, OFFSETS_FILE), dtype=np.uint64, mode="r")
+        self.deleted = read_deleted(path, self.count)
+        self.live_count = self.count - int(self.deleted.sum())
+        if self.live_count == self.count:
+            self.deleted = None
+        self._chunks = open(os.path.join(path, CHUNKS_FILE), "rb")
+        self._chunks_lock = threading.Lock()
+
+        self.attributes = AttributeIndex.load(path, self.count)
+        self.filter_exact_rows = filter_exact_rows
+        self.mask_cache_size = mask_cache_size
+        self._masks = OrderedDict()
+        self._masks_lock = threading.Lock()
+
+        self.ann = None
+        if nprobe < 1 or refine < 1:
+            raise ValueError(f"nprobe and refine must be at least 1, got {nprobe} and {refine}")
+        self.nprobe = nprobe
+        self.refine = refine
+        ann_path = os.path.join(path, ANN_DIR)
+        if use_ann and os.path.exists(os.path.join(ann_path, ANN_FILE)):
+            self.ann = IVFPQIndex.load(ann_path)
+            if self.ann.count > self.count:
+                # Construido sobre otra versión del índice (más filas): sus ids no son válidos
+                print(f"Ignoring IVF-PQ index with {self.ann.count} rows for a local index with {self.count}; "
+                      f"rebuild it with: python ann_index.py build {path}")
+                self.ann = None
+
+        self.quantized = QuantizedVectors.load(os.path.join(path, QUANT_DIR), self.vectors) if use_quantized else None
+        self.rescore = rescore
+        if self.quantized is not None:
+            # De vectors.f32 solo se leen los candidatos: sin lectura anticipada no entran en memoria sus vecinos
+            advise_random(self.vectors)
+
+    def filter_mask(self, filters):
+        """
+        (máscara, filas) de las filas vigentes que cumplen el filtro.
+
+        Lanza ValueError si el índice no tiene atributos.
+        """
+        if self.attributes is None:
+            raise ValueError(f"Filters need an attribute index: python attribute_index.py build {self.path}")
+        key = filters_key(filters)
+        with self._masks_lock:
+            cached = self._masks.get(key)
+            if cached is not None:
+                self._masks.move_to_end(key)
+                return cached
+
+        mask = self.attributes.mask(filters)
+        if self.deleted is not None:
+            mask &= ~self.deleted
+        cached = (mask, np.flatnonzero(mask))
+        with self._masks_lock:
+            self._masks[key] = cached
+            while len(self._masks) > self.mask_cache_size:
+                self._masks.popitem(last=False)
+        return cached
+
+    def search(self, query_vector, top_k: int = 3, nprobe: int = None, filters=None):
+        """Devuelve (filas, scores) de los top_k vectores más similares, ordenados"""
+        if self.live_count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if nprobe is not None and nprobe < 1:
+            raise ValueError(f"nprobe must be at least 1, got {nprobe}")
+        nprobe = nprobe or self.nprobe
+        query = normalize_rows(query_vector)[0]
+        if filters:
+            mask, rows = self.filter_mask(filters)
+            if self.ann is None or len(rows) <= self.filter_exact_rows:
+                if self.quantized is not None:
+                    return self._search_quantized(query, top_k, rows, mask)
+                return self._search_rows(query, top_k, rows, mask)
+            return self._search_ann(query, top_k, nprobe, mask)
+        if self.ann is not None:
+            return self._search_ann(query, top_k, nprobe)
+        if self.quantized is not None:
+            return self._search_quantized(query, top_k)
+        return self.search_exact(query, top_k)
+
+    def search_exact(self, query, top_k: int = 3):
+        """Búsqueda exacta recorriendo toda la matriz"""
+        query = normalize_rows(query)[0]
+        scores = self.vectors @ query
+        if self.deleted is not None:
+            scores[self.deleted] = -np.inf
+        k = min(top_k, self.live_count)
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return rows, scores[rows]
+
+    def _search_rows(self, query, top_k: int, rows, mask):
+        """Búsqueda exacta solo entre las filas dadas (ordenadas)"""
+        if not len(rows):
+            return rows, np.zeros(0, dtype=np.float32)
+        if len(rows) > self.count // 2:
+            # Con la mayoría de las filas es más barato recorrer la matriz entera
+            scores = self.vectors @ query
+            scores[~mask] = -np.inf
+            k = min(top_k, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return best, scores[best]
+
+        scores = np.concatenate([
+            self.vectors[rows[start:start + SCORE_BLOCK_ROWS]] @ query
+            for start in range(0, len(rows), SCORE_BLOCK_ROWS)
+        ])
+        k = min(top_k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return rows[best], scores[best]
+
+    def _search_quantized(self, query, top_k: int, rows=None, mask=None):
+        """
+        Búsqueda con los scores aproximados de la matriz cuantizada (en todas
+        las filas o en rows) y reordenación con los vectores float32.
+        """
+        covered = self.quantized.count
+        if rows is None or len(rows) > self.count // 2:
+            # Sin filtro, o con la mayoría de las filas: se recorre la matriz entera
+            excluded = ~mask if mask is not None else self.deleted
+            scores = self.quantized.scores(query)
+            if excluded is not None:
+                scores[excluded[:covered]] = -np.inf
+            ids = None
+            live = covered - (int(excluded[:covered].sum()) if excluded is not None else 0)
+            extra = np.arange(covered, self.count)
+            if excluded is not None:
+                extra = extra[~excluded[covered:]]
+        else:
+            split = int(np.searchsorted(rows, covered))
+            ids, extra = rows[:split], rows[split:]
+            scores = self.quantized.scores(query, ids)
+            live = split
+
+        candidates = np.zeros(0, dtype=np.int64)
+        k = min(top_k * self.rescore, live)
+        if k:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            if ids is not None:
+                candidates = ids[candidates]
+        # Las filas añadidas después de cuantizar se comparan siempre de forma exacta
+        return self._rescore(query, top_k, np.concatenate([candidates, extra]))
+
+    def _search_ann(self, query, top_k: int, nprobe: int, mask=None):
+        candidates, _ = self.ann.search(query, top_k * self.refine, nprobe, allowed=mask)
+        if mask is not None:
+            # Un filtro selectivo puede dejar las listas visitadas casi vacías
+            while len(candidates) < top_k * self.refine and nprobe < self.ann.nlist:
+                nprobe = min(max(nprobe * 4, nprobe + 1), self.ann.nlist)
+                candidates, _ = self.ann.search(query, top_k * self.refine, nprobe, allowed=mask)
+        if self.ann.count < self.count:
+            extra = np.arange(self.ann.count, self.count)
+            if mask is not None:
+                extra = extra[mask[self.ann.count:]]
+            candidates = np.concatenate([candidates, extra])
+        if self.deleted is not None and mask is None:
+            candidates = candidates[~self.deleted[candidates]]
+        return self._rescore(query, top_k, candidates)
+
+    def _rescore(self, query, top_k: int, candidates):
+        """Reordena los candidatos con el coseno exacto de los vectores float32"""
+        if not len(candidates):
+            return candidates, np.zeros(0, dtype=np.float32)
+
+        # Lectura en orden de fila: solo se tocan las páginas de los candidatos
+        candidates = np.sort(candidates)
+        scores = self.vectors[candidates] @ query
+        k = min(top_k, len(candidates))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return candidates[best], scores[best]
+
+    def get_chunk(self, row: int):
+        """Lee del disco el chunk guardado en una fila"""
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        with self._chunks_lock:
+            self._chunks.seek(start)
+            data = self._chunks.read(end - start)
+        return json.loads(data)
+
+    def close(self):
+        self._chunks.close()
+
+
+def build_from_jsonl(source: str, path: str, vector_field: str = "text_vector", batch_size: int = 1000):
+    """Construye un índice a partir de un JSONL con chunks y sus vectores"""
+    writer = None
+    chunks, vectors = [], []
+
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            vector = record.pop(vector_field)
+            if writer is None:
+                writer = LocalIndexWriter(path, len(vector))
+            chunks.append(record)
+            vectors.append(vector)
+            if len(chunks) >= batch_size:
+                writer.add(chunks, vectors)
+                chunks, vectors = [], []
+
+    if writer is None:
+        raise ValueError(f"No chunks found in {source}")
+    if chunks:
+        writer.add(chunks, vectors)
+    writer.close()
+    return writer.count
+
+
+def compact(path: str, batch_size: int = 10000):
+    """Reescribe el índice sin las filas borradas (luego hay que reconstruir el IVF-PQ, el BM25 y los cuantizados)"""
+    index = LocalVectorIndex(path, use_ann=False, use_quantized=False)
+    live_rows = np.arange(index.count) if index.deleted is None else np.flatnonzero(~index.deleted)
+
+    tmp_path = path.rstrip(os.sep) + ".compact"
+    with LocalIndexWriter(tmp_path, index.dimensions) as writer:
+        for start in range(0, len(live_rows), batch_size):
+            rows = live_rows[start:start + batch_size]
+            writer.add([index.get_chunk(int(row)) for row in rows], index.vectors[rows])
+    index.close()
+
+    for name in (INDEX_FILE, VECTORS_FILE, CHUNKS_FILE, OFFSETS_FILE):
+        os.replace(os.path.join(tmp_path, name), os.path.join(path, name))
+    if os.path.isdir(os.path.join(path, ATTR_DIR)):
+        shutil.rmtree(os.path.join(path, ATTR_DIR))
+    os.replace(os.path.join(tmp_path, ATTR_DIR), os.path.join(path, ATTR_DIR))
+    shutil.rmtree(tmp_path)
+    remove_stale(path, (DELETED_FILE, ANN_DIR, BM25_DIR, QUANT_DIR))
+    return writer.count
+
+
+def export_from_azure(path: str, vector_field: str = "text_vector", batch_size: int = 1000):
+    """Copia el índice de Azure Search (con sus vectores) a un índice local"""
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+    from rag_service import load_azure_settings
+
+    settings = load_azure_settings()
+    search_client = SearchClient(
+        endpoint=settings["AZURE_SEARCH_SERVICE_ENDPOINT"],
+        index_name=settings["AZURE_SEARCH_INDEX"],
+        credential=AzureKeyCredential(settings["AZURE_SEARCH_ADMIN_KEY"])
+    )
+
+    writer = None
+    chunks, vectors = [], []
+    for result in search_client.search(search_text="*"):
+        vector = result.get(vector_field)
+        if not vector:
+            raise ValueError(f"Field '{vector_field}' is not retrievable in the Azure Search index")
+        if writer is None:
+            writer = LocalIndexWriter(path, len(vector))
+        # Todos los campos recuperables menos el vector: los metadatos sirven para los filtros
+        chunks.append({
+            key: value for key, value in result.items()
+            if key != vector_field and not key.startswith("@")
+        })
+        vectors.append(vector)
+        if len(chunks) >= batch_size:
+            writer.add(chunks, vectors)
+            chunks, vectors = [], []
+
+    if writer is None:
+        raise ValueError("The Azure Search index is empty")
+    if chunks:
+        writer.add(chunks, vectors)
+    writer.close()
+    return writer.count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye un índice vectorial local")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Construir desde un JSONL con chunks y vectores")
+    build_parser.add_argument("source")
+    build_parser.add_argument("path")
+    build_parser.add_argument("--vector-field", default="text_vector")
+
+    export_parser = subparsers.add_parser("export-azure", help="Copiar el índice de Azure Search")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--vector-field", default="text_vector")
+
+    compact_parser = subparsers.add_parser("compact", help="Eliminar las filas borradas")
+    compact_parser.add_argument("path")
+
+    args = parser.parse_args()
+    if args.command == "compact":
+        count = compact(args.path)
+        print(f"✅ Índice {args.path} compactado: {count} chunks (reconstruye el IVF-PQ y el BM25)")
+        sys.exit(0)
+    if args.command == "build":
+        count = build_from_jsonl(args.source, args.path, args.vector_field)
+    else:
+        count = export_from_azure(args.path, args.vector_field)
+    print(f"✅ Índice local creado en {args.path} con {count} chunks")
+    sys.exit(0)
@@ -1,19 +1,54 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from models import QueryRequest, QueryResponse, ErrorResponse
-from rag_service import RAGService
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from models import (
+    CHAT_MODELS, QueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResponse,
+    CompareRequest, CompareResponse, SessionResponse, ErrorResponse
+)
+from resilience import UpstreamError
+from metrics import (
+    HTTP_DURATION, REGISTRY, record_error, record_result, register_cache_metrics, register_upstream_metrics
+)
+from tracing import setup_tracing, span
+from contextlib import asynccontextmanager
+import asyncio
+import dotenv
+import json
 import logging
+import math
 import os
+import time
+
+# Cargar variables de entorno (rag_service, que también lo hace, se importa más tarde)
+dotenv.load_dotenv()
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    El servicio RAG se inicializa en segundo plano.
+
+    El servidor acepta peticiones desde el primer momento: /health/live
+    responde enseguida y /health/ready devuelve 503 hasta que el servicio
+    está listo. Si la inicialización falla se reintenta con backoff.
+    """
+    task = asyncio.create_task(initialize_service())
+    yield
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    # Cerrar las conexiones compartidas con Azure al apagar el servidor
+    if rag_service is not None:
+        await rag_service.close()
+
 # Crear la aplicación FastAPI
 app = FastAPI(
     title="RAG Backend API",
     description="API para consultar la base de conocimiento usando RAG (Retrieval-Augmented Generation)",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS para producción
@@ -43,22 +78,56 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
     allow_credentials=True,
-    allow_methods=["GET", "POST"],
+    allow_methods=["GET", "POST", "DELETE"],
     allow_headers=["*"],
 )
 
-# Inicializar el servicio RAG con manejo de errores
-try:
-    # Log environment variables for debugging (without showing sensitive values)
+# Trazas OpenTelemetry opcionales (RAG_OTEL_ENABLED=true)
+setup_tracing()
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Latencia de cada petición HTTP (métrica y span raíz de la traza)"""
+    start = time.perf_counter()
+    with span(f"{request.method} {request.url.path}", **{"http.method": request.method}):
+        response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_DURATION.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code
+    )
+    return response
+
+# Servicio RAG: None hasta que initialize_service termina
+rag_service = None
+startup_state = {
+    "state": "starting",
+    "attempts": 0,
+    "error": None,
+    "import_ms": None,
+    "init_ms": None,
+    "ready_ms": None,
+}
+PROCESS_START = time.perf_counter()
+
+def check_environment():
+    """Log environment variables for debugging (without showing sensitive values)"""
     logger.info("Checking environment variables...")
     env_check = {
         "AZURE_OPENAI_API_KEY": "SET" if os.getenv("AZURE_OPENAI_API_KEY") else "MISSING",
         "AZURE_OPENAI_ENDPOINT": "SET" if os.getenv("AZURE_OPENAI_ENDPOINT") else "MISSING",
         "OPENAI_API_VERSION": "SET" if os.getenv("OPENAI_API_VERSION") else "MISSING",
-        "AZURE_SEARCH_SERVICE_ENDPOINT": "SET" if os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT") else "MISSING",
-        "AZURE_SEARCH_INDEX": "SET" if os.getenv("AZURE_SEARCH_INDEX") else "MISSING",
-        "AZURE_SEARCH_ADMIN_KEY": "SET" if os.getenv("AZURE_SEARCH_ADMIN_KEY") else "MISSING",
     }
+    if os.getenv("RAG_RETRIEVER", "azure") == "azure":
+        env_check.update({
+            "AZURE_SEARCH_SERVICE_ENDPOINT": "SET" if os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT") else "MISSING",
+            "AZURE_SEARCH_INDEX": "SET" if os.getenv("AZURE_SEARCH_INDEX") else "MISSING",
+            "AZURE_SEARCH_ADMIN_KEY": "SET" if os.getenv("AZURE_SEARCH_ADMIN_KEY") else "MISSING",
+        })
+    else:
+        env_check["RAG_LOCAL_INDEX_PATH"] = "SET" if os.getenv("RAG_LOCAL_INDEX_PATH") else "MISSING"
     
     missing_vars = [k for k, v in env_check.items() if v == "MISSING"]
     if missing_vars:
@@ -67,30 +136,107 @@ try:
     else:
         logger.info("All environment variables are set")
     
-    rag_service = RAGService()
-    logger.info("RAG Service initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize RAG Service: {str(e)}")
-    logger.error("This usually means environment variables are not set correctly in Railway")
-    rag_service = None
+    # Con varios workers cada proceso tiene su servicio: el estado compartido va en SQLite
+    if int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+        unshared = [
+            name for name in (
+                "RAG_EMBEDDING_CACHE_PATH", "RAG_SEMANTIC_CACHE_PATH", "RAG_SESSION_STORE_PATH", "RAG_QUERY_LOG_PATH"
+            ) if not os.getenv(name)
+        ]
+        if unshared:
+            logger.warning(f"Running {os.getenv('WEB_CONCURRENCY')} workers without shared storage for: {unshared}")
+
+def create_service():
+    """
+    Importa rag_service (los SDK de Azure y OpenAI) y construye el servicio.
+
+    Se ejecuta en un hilo: el import y la carga de índices no bloquean el
+    event loop. Devuelve (servicio, ms del import, ms de la construcción).
+    """
+    start = time.perf_counter()
+    from rag_service import AsyncRAGService
+    imported = time.perf_counter()
+    service = AsyncRAGService()
+    return service, (imported - start) * 1000, (time.perf_counter() - imported) * 1000
+
+async def initialize_service():
+    """Inicializa el servicio RAG, reintentando con backoff exponencial si falla"""
+    global rag_service
+    delay = float(os.getenv("RAG_INIT_RETRY_DELAY", 1))
+    max_delay = float(os.getenv("RAG_INIT_RETRY_MAX_DELAY", 60))
+    max_attempts = int(os.getenv("RAG_INIT_MAX_ATTEMPTS", 0))
+
+    while True:
+        startup_state["attempts"] += 1
+        try:
+            check_environment()
+            service, import_ms, init_ms = await asyncio.to_thread(create_service)
+            break
+        except Exception as e:
+            logger.error(f"Failed to initialize RAG Service: {str(e)}")
+            logger.error("This usually means environment variables are not set correctly in Railway")
+            startup_state["error"] = str(e)
+            if max_attempts and startup_state["attempts"] >= max_attempts:
+                startup_state["state"] = "failed"
+                return
+            startup_state["state"] = "retrying"
+            logger.info(f"Retrying RAG Service initialization in {delay:.0f} s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    register_cache_metrics(service)
+    register_upstream_metrics(service.upstreams())
+    rag_service = service
+    startup_state.update({
+        "state": "ready",
+        "error": None,
+        "import_ms": round(import_ms, 1),
+        "init_ms": round(init_ms, 1),
+        "ready_ms": round((time.perf_counter() - PROCESS_START) * 1000, 1),
+    })
+    logger.info(f"RAG Service initialized successfully: {startup_state}")
+    # Precalentar en segundo plano las cachés con las consultas más frecuentes
+    service.start_warmup()
+
+def upstream_http_error(error: UpstreamError) -> HTTPException:
+    """429 si Azure limita la cuota, 503 si no está disponible; con Retry-After si se conoce"""
+    headers = {"Retry-After": str(max(1, math.ceil(error.retry_after)))} if error.retry_after else None
+    return HTTPException(status_code=error.status_code, detail=str(error), headers=headers)
 
 @app.get("/")
 async def root():
     """Endpoint de salud de la API"""
     return {"message": "RAG Backend API está funcionando correctamente"}
 
+@app.get("/health/live")
+async def liveness():
+    """El proceso responde (no comprueba el servicio RAG)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """200 cuando el servicio RAG está listo para atender consultas, 503 mientras tanto"""
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail=startup_state, headers={"Retry-After": "1"})
+    return {"status": "ready", "startup": startup_state}
+
 @app.get("/health")
 async def health_check():
     """Verificar el estado de la API"""
     health_status = {
         "status": "healthy",
         "service": "RAG Backend",
-        "rag_service_initialized": rag_service is not None
+        "rag_service_initialized": rag_service is not None,
+        "startup": startup_state
     }
     
     if rag_service is None:
         health_status["status"] = "unhealthy"
-        health_status["error"] = "RAG Service not initialized"
+        health_status["error"] = startup_state["error"] or "RAG Service not initialized"
+    else:
+        health_status["upstreams"] = {upstream.service: upstream.stats() for upstream in rag_service.upstreams()}
+        # El precalentamiento no afecta al estado: el servicio ya atiende mientras tanto
+        health_status["warmup"] = rag_service.warmup.progress()
         
     return health_status
 
@@ -100,9 +246,11 @@ async def query_rag(request: QueryRequest):
     Endpoint principal para hacer consultas RAG
     
     - **userQuestion**: La pregunta que quieres hacer a la base de conocimiento
-    - **model**: El modelo de IA a utilizar (gpt-4o-mini, grok-3, DeepSeek-R1, gpt-4o)
+    - **model**: El modelo de IA a utilizar (gpt-4o-mini, grok-3, DeepSeek-R1, gpt-4o o auto)
     - **temperature**: Controla la creatividad de la respuesta (0.0 = más determinista, 1.0 = más creativo)
     - **context**: Contexto personalizado o pre-prompt (opcional)
+    - **sessionId**: Sesión de conversación ('new' abre una; la respuesta trae el session_id a reenviar)
+    - **filters**: Metadatos que deben cumplir los documentos, p. ej. {"crop": "maize", "region": ["norte", "centro"]}
     """
     if rag_service is None:
         raise HTTPException(
@@ -114,29 +262,244 @@ async def query_rag(request: QueryRequest):
         logger.info(f"Procesando consulta: {request.userQuestion}")
         logger.info(f"Modelo: {request.model}, Temperatura: {request.temperature}")
         
-        result = rag_service.generate_answer(
+        result = await rag_service.generate_answer(
             user_question=request.userQuestion,
             model=request.model,
             temperature=request.temperature,
-            context=request.context
+            context=request.context,
+            session_id=request.sessionId,
+            filters=request.filters
         )
         
-        logger.info("Consulta procesada exitosamente")
+        logger.info(f"Consulta procesada exitosamente con {result['selected_model']}: {result['timings']}")
+        record_result("query", result["selected_model"], result)
         return QueryResponse(**result)
         
+    except UpstreamError as e:
+        record_error("query", request.model, type(e).__name__)
+        logger.warning(f"Servicio externo no disponible: {str(e)}")
+        raise upstream_http_error(e)
     except Exception as e:
+        record_error("query", request.model, type(e).__name__)
         logger.error(f"Error procesando consulta: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Error interno del servidor: {str(e)}"
         )
 
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_rag_batch(request: BatchQueryRequest):
+    """
+    Procesa varias consultas RAG en una sola petición
+
+    - **queries**: lista de consultas con el mismo formato que /query
+    - **max_concurrency**: consultas procesándose a la vez (1-64)
+
+    Los embeddings de todas las preguntas se calculan en una sola llamada y
+    el resto del pipeline se ejecuta en paralelo. Un fallo en una consulta no
+    afecta al resto: cada resultado trae su respuesta o su error. Las
+    consultas del lote no usan sesiones (se ignora sessionId).
+    """
+    if rag_service is None:
+        raise HTTPException(
+            status_code=503,
+            detail="RAG Service is not available. Check environment variables and Azure connections."
+        )
+
+    logger.info(f"Procesando lote de {len(request.queries)} consultas")
+
+    items = await rag_service.generate_answers_batch(
+        [
+            {
+                "user_question": query.userQuestion,
+                "model": query.model,
+                "temperature": query.temperature,
+                "context": query.context,
+                "filters": query.filters,
+            }
+            for query in request.queries
+        ],
+        max_concurrency=request.max_concurrency
+    )
+
+    for query, item in zip(request.queries, items):
+        if item["error"] is None:
+            record_result("batch", item["result"]["selected_model"], item["result"])
+        else:
+            record_error("batch", query.model, "BatchItemError")
+
+    failed = sum(1 for item in items if item["error"] is not None)
+    if failed:
+        logger.error(f"{failed} consultas del lote fallaron")
+    logger.info("Lote procesado")
+
+    return BatchQueryResponse(
+        results=items,
+        succeeded=len(items) - failed,
+        failed=failed
+    )
+
+@app.post("/compare", response_model=CompareResponse)
+async def compare_models(request: CompareRequest):
+    """
+    Responde la misma pregunta con varios modelos y compara las respuestas
+
+    - **models**: modelos a comparar (por defecto, todos los disponibles)
+
+    La búsqueda se hace una sola vez y los modelos se consultan en paralelo.
+    Cada resultado trae la respuesta (o el error de ese modelo), su latencia,
+    la similitud con la pregunta y el acuerdo medio con los demás modelos.
+    """
+    if rag_service is None:
+        raise HTTPException(
+            status_code=503,
+            detail="RAG Service is not available. Check environment variables and Azure connections."
+        )
+
+    try:
+        logger.info(f"Comparando {len(request.models)} modelos: {request.userQuestion}")
+
+        result = await rag_service.compare_models(
+            user_question=request.userQuestion,
+            models=request.models,
+            temperature=request.temperature,
+            context=request.context,
+            filters=request.filters
+        )
+
+        for item in result["results"]:
+            if "error" in item:
+                record_error("compare", item["model"], "ModelError")
+            else:
+                record_result("compare", item["model"], {"usage": item["usage"], "timings": {"chat": item["latency_ms"]}})
+        logger.info(f"Comparación procesada exitosamente: {result['timings']}")
+        return CompareResponse(**result)
+
+    except UpstreamError as e:
+        record_error("compare", "all", type(e).__name__)
+        logger.warning(f"Servicio externo no disponible: {str(e)}")
+        raise upstream_http_error(e)
+    except Exception as e:
+        record_error("compare", "all", type(e).__name__)
+        logger.error(f"Error comparando modelos: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error interno del servidor: {str(e)}"
+        )
+
+def format_sse(event: str, data: dict) -> str:
+    """Formatea un evento para server-sent events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/query/stream")
+async def query_rag_stream(request: QueryRequest):
+    """
+    Igual que /query pero devuelve la respuesta como server-sent events
+
+    - **sources**: primer evento, con los documentos recuperados
+    - **delta**: fragmentos de la respuesta según los genera el modelo
+    - **done**: fin de la respuesta (modelo, temperatura, si vino de caché y session_id)
+    - **error**: error producido durante la generación
+    """
+    if rag_service is None:
+        raise HTTPException(
+            status_code=503,
+            detail="RAG Service is not available. Check environment variables and Azure connections."
+        )
+
+    logger.info(f"Procesando consulta en streaming: {request.userQuestion}")
+    logger.info(f"Modelo: {request.model}, Temperatura: {request.temperature}")
+
+    async def event_stream():
+        try:
+            async for item in rag_service.stream_answer(
+                user_question=request.userQuestion,
+                model=request.model,
+                temperature=request.temperature,
+                context=request.context,
+                session_id=request.sessionId,
+                filters=request.filters
+            ):
+                if item["event"] == "done":
+                    record_result("stream", item["data"]["selected_model"], item["data"])
+                yield format_sse(item["event"], item["data"])
+            logger.info("Consulta en streaming procesada exitosamente")
+        except Exception as e:
+            record_error("stream", request.model, type(e).__name__)
+            # Los headers ya se enviaron, así que el error viaja como evento
+            logger.error(f"Error procesando consulta en streaming: {str(e)}")
+            error = {"detail": f"Error interno del servidor: {str(e)}"}
+            if isinstance(e, UpstreamError):
+                error = {"detail": str(e), "status": e.status_code, "retry_after": e.retry_after}
+            yield format_sse("error", error)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/sessions")
+async def sessions_stats():
+    """Estadísticas de las sesiones de conversación"""
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not available.")
+    return rag_service.sessions.stats()
+
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    """Historial de una sesión: resumen de los turnos antiguos y turnos recientes"""
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not available.")
+    session = rag_service.sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return SessionResponse(
+        sessionId=session["id"],
+        summary=session["summary"],
+        summarized_turns=session["summarized_turns"],
+        messages=session["messages"]
+    )
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Borra una sesión y su historial"""
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not available.")
+    if not rag_service.sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {"deleted": session_id}
+
 @app.get("/models")
 async def get_available_models():
-    """Obtener la lista de modelos disponibles"""
+    """Obtener la lista de modelos disponibles (y las estadísticas del router para 'auto')"""
+    return {
+        "models": CHAT_MODELS + ["auto"],
+        "default": "gpt-4o-mini",
+        "routing": rag_service.router.stats() if rag_service is not None else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Estadísticas de las cachés del servicio RAG"""
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not available.")
+
     return {
-        "models": ["gpt-4o-mini", "grok-3", "DeepSeek-R1", "gpt-4o"],
-        "default": "gpt-4o-mini"
+        "embedding_cache": rag_service.embedding_cache.stats(),
+        "answer_cache": rag_service.answer_cache.stats(),
+        "retrieval_cache": rag_service.retrieval_cache.stats(),
+        "query_log": rag_service.query_log.stats(),
+        "rerank_cache": rag_service.reranker.stats() if rag_service.reranker is not None else None,
+        "singleflight": {
+            "answer": rag_service.answer_flights.stats(),
+            "embedding": rag_service.embedding_flights.stats()
+        }
     }
 
 @app.get("/debug/env")
@@ -147,6 +510,9 @@ async def debug_environment():
         "AZURE_SEARCH_INDEX": os.getenv("AZURE_SEARCH_INDEX", "NOT_SET"),
         "AZURE_OPENAI_ENDPOINT": os.getenv("AZURE_OPENAI_ENDPOINT", "NOT_SET"),
         "OPENAI_API_VERSION": os.getenv("OPENAI_API_VERSION", "NOT_SET"),
+        "RAG_RETRIEVER": os.getenv("RAG_RETRIEVER", "azure"),
+        "RAG_LOCAL_INDEX_PATH": os.getenv("RAG_LOCAL_INDEX_PATH", "NOT_SET"),
+        "RAG_SEARCH_MODE": os.getenv("RAG_SEARCH_MODE", "vector"),
         "PORT": os.getenv("PORT", "NOT_SET"),
         "ENVIRONMENT": os.getenv("ENVIRONMENT", "NOT_SET"),
         # No mostrar claves por seguridad
@@ -163,5 +529,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=port,
         reload=False,  # Cambiar a False para producción
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
         log_level="info"
     )
\ No newline at end of file
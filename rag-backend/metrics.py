@@ -0,0 +1,304 @@
+"""
+Métricas del servicio en formato de texto de Prometheus (GET /metrics).
+
+Implementación mínima sin dependencias: contadores, histogramas y valores
+calculados al exportar. Los histogramas publican además los percentiles
+p50/p95/p99 de las últimas observaciones (ventana deslizante) como
+<nombre>_quantiles, para consultarlos sin histogram_quantile.
+"""
+
+import threading
+from bisect import bisect_left
+from collections import deque
+
+import numpy as np
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+WINDOW_SIZE = 1024
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self.header()
+        lines += [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in values]
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS,
+                 quantiles=QUANTILES, window: int = WINDOW_SIZE):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.quantiles = quantiles
+        self.window = window
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                    "recent": deque(maxlen=self.window),
+                }
+            state["buckets"][bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+            state["recent"].append(value)
+
+    def render(self):
+        with self._lock:
+            snapshot = sorted(
+                (key, list(state["buckets"]), state["sum"], state["count"], list(state["recent"]))
+                for key, state in self._values.items()
+            )
+
+        lines = self.header()
+        for key, buckets, total, count, _ in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames, key, {"le": format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+
+        if self.quantiles and snapshot:
+            name = f"{self.name}_quantiles"
+            lines.append(f"# HELP {name} Percentiles of the last {self.window} observations of {self.name}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, _, _, _, recent in snapshot:
+                values = np.quantile(np.asarray(recent), self.quantiles)
+                for quantile, value in zip(self.quantiles, values):
+                    labels = format_labels(self.labelnames, key, {"quantile": quantile})
+                    lines.append(f"{name}{labels} {format_value(value)}")
+        return lines
+
+
+class Collected(Metric):
+    """Valores calculados al exportar (por ejemplo, las estadísticas de las cachés)"""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), metric_type: str = "gauge", collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.type = metric_type
+        self.collect = collect
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.collect()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def unregister(self, name: str):
+        self._metrics = [metric for metric in self._metrics if metric.name != name]
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "rag_requests_total", "Requests handled, by endpoint, model and status", ("endpoint", "model", "status")
+))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "rag_request_duration_seconds", "End-to-end latency of RAG requests", ("endpoint", "model")
+))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "rag_stage_duration_seconds", "Latency of each stage of a RAG request", ("stage", "model")
+))
+TOKENS = REGISTRY.register(Counter(
+    "rag_tokens_total", "Tokens used, by model and kind (prompt, completion, context)", ("model", "kind")
+))
+ANSWER_CACHE_RESULTS = REGISTRY.register(Counter(
+    "rag_answer_cache_requests_total", "Requests answered from the semantic cache (hit) or not (miss)",
+    ("model", "result")
+))
+ERRORS = REGISTRY.register(Counter(
+    "rag_errors_total", "Failed requests, by endpoint and error type", ("endpoint", "error")
+))
+FALLBACKS = REGISTRY.register(Counter(
+    "rag_fallbacks_total", "Degraded paths taken (embedding failures, text search fallback...)", ("kind",)
+))
+ROUTING_DECISIONS = REGISTRY.register(Counter(
+    "rag_routing_decisions_total", "Requests with model=auto, by tier, chosen model and outcome (direct, hedged, failover)",
+    ("tier", "model", "outcome")
+))
+COALESCED = REGISTRY.register(Counter(
+    "rag_coalesced_requests_total", "Calls that reused an identical in-flight call (answer or embedding)", ("kind",)
+))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    "rag_upstream_retries_total", "Retries of calls to Azure OpenAI and Azure Search, by service and reason",
+    ("service", "reason")
+))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "rag_http_request_duration_seconds", "Latency of HTTP requests, by route and status code",
+    ("method", "route", "status"), quantiles=None
+))
+
+
+def record_result(endpoint: str, model: str, result: dict):
+    """Anota las métricas de una respuesta de AsyncRAGService (timings, usage y caché)"""
+    REQUESTS.inc(endpoint=endpoint, model=model, status="ok")
+    ANSWER_CACHE_RESULTS.inc(model=model, result="hit" if result.get("cache_hit") else "miss")
+
+    timings = dict(result.get("timings") or {})
+    total = timings.pop("total", None)
+    if total is not None:
+        REQUEST_DURATION.observe(total / 1000, endpoint=endpoint, model=model)
+    for stage, milliseconds in timings.items():
+        STAGE_DURATION.observe(milliseconds / 1000, stage=stage, model=model)
+
+    routing = result.get("routing")
+    if routing:
+        outcome = "failover" if routing["failover"] else "hedged" if routing["hedged"] else "direct"
+        ROUTING_DECISIONS.inc(tier=routing["tier"], model=routing["model"], outcome=outcome)
+
+    # Los tokens de una respuesta compartida ya se contaron en la petición original
+    usage = {} if result.get("coalesced") else result.get("usage") or {}
+    for kind in ("prompt", "completion", "context"):
+        if usage.get(f"{kind}_tokens"):
+            TOKENS.inc(usage[f"{kind}_tokens"], model=model, kind=kind)
+
+
+def record_error(endpoint: str, model: str, error_type: str):
+    REQUESTS.inc(endpoint=endpoint, model=model, status="error")
+    ERRORS.inc(endpoint=endpoint, error=error_type)
+
+
+def register_cache_metrics(service):
+    """Publica las estadísticas de las cachés del servicio (se leen al exportar)"""
+    def cache_stats():
+        return (
+            ("embedding", service.embedding_cache.stats()),
+            ("answer", service.answer_cache.stats()),
+            ("retrieval", service.retrieval_cache.stats()),
+        )
+
+    def cache_counts():
+        for cache, stats in cache_stats():
+            yield (cache, "hit"), stats.get("hits", 0)
+            yield (cache, "miss"), stats.get("misses", 0)
+
+    def cache_hit_ratio():
+        for cache, stats in cache_stats():
+            yield (cache,), stats.get("hit_rate", 0.0)
+
+    def cache_size():
+        for cache, stats in cache_stats():
+            yield (cache,), stats.get("size", 0)
+
+    for name in ("rag_cache_lookups_total", "rag_cache_hit_ratio", "rag_cache_entries"):
+        REGISTRY.unregister(name)
+    REGISTRY.register(Collected(
+        "rag_cache_lookups_total", "Cache lookups, by cache and result", ("cache", "result"), "counter", cache_counts
+    ))
+    REGISTRY.register(Collected(
+        "rag_cache_hit_ratio", "Cache hit ratio since startup", ("cache",), "gauge", cache_hit_ratio
+    ))
+    REGISTRY.register(Collected(
+        "rag_cache_entries", "Entries currently stored in each cache", ("cache",), "gauge", cache_size
+    ))
+
+
+def register_upstream_metrics(upstreams):
+    """Publica el estado de los circuit breakers y limitadores de resilience.Upstream"""
+    states = {"closed": 0, "half_open": 1, "open": 2}
+
+    def circuit_state():
+        for upstream in upstreams:
+            for key, stats in upstream.stats().items():
+                yield (upstream.service, key), states[stats["circuit"]]
+
+    def concurrency_limit():
+        for upstream in upstreams:
+            for key, stats in upstream.stats().items():
+                yield (upstream.service, key), stats["concurrency_limit"]
+
+    def throttled():
+        for upstream in upstreams:
+            for key, stats in upstream.stats().items():
+                yield (upstream.service, key), stats["throttled"]
+
+    for name in ("rag_upstream_circuit_state", "rag_upstream_concurrency_limit", "rag_upstream_throttled_total"):
+        REGISTRY.unregister(name)
+    REGISTRY.register(Collected(
+        "rag_upstream_circuit_state", "Circuit breaker state per deployment (0 closed, 1 half-open, 2 open)",
+        ("service", "deployment"), "gauge", circuit_state
+    ))
+    REGISTRY.register(Collected(
+        "rag_upstream_concurrency_limit", "Adaptive concurrency limit per deployment",
+        ("service", "deployment"), "gauge", concurrency_limit
+    ))
+    REGISTRY.register(Collected(
+        "rag_upstream_throttled_total", "429 responses received per deployment",
+        ("service", "deployment"), "counter", throttled
+    ))
@@ -1,11 +1,23 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from pydantic import BaseModel, Field, field_validator
+from typing import Dict, List, Optional, Literal, Union, get_args
+
+from filters import normalize_filters
+
+ChatModel = Literal["gpt-4o-mini", "grok-3", "DeepSeek-R1", "gpt-4o"]
+CHAT_MODELS = list(get_args(ChatModel))
+
+FilterValue = Union[str, bool, int, float]
+Filters = Dict[str, Union[FilterValue, List[FilterValue]]]
+FILTERS_DESCRIPTION = (
+    "Filtros por metadatos: campo -> valor o lista de valores, p. ej. "
+    "{'crop': 'maize', 'region': ['norte', 'centro']} (AND entre campos, OR entre valores)"
+)
 
 class QueryRequest(BaseModel):
     userQuestion: str = Field(..., description="La pregunta del usuario")
-    model: Literal["gpt-4o-mini", "grok-3", "DeepSeek-R1", "gpt-4o"] = Field(
+    model: Literal[ChatModel, "auto"] = Field(
         default="gpt-4o-mini", 
-        description="Modelo a utilizar para generar la respuesta"
+        description="Modelo a utilizar para generar la respuesta ('auto' lo elige según la pregunta y la latencia)"
     )
     temperature: float = Field(
         default=0.7, 
@@ -17,6 +29,19 @@ class QueryRequest(BaseModel):
         default=None, 
         description="Contexto o pre-prompt personalizado"
     )
+    sessionId: Optional[str] = Field(
+        default=None,
+        description="Sesión de conversación ('new' abre una); sin ella la consulta no tiene historial"
+    )
+    filters: Optional[Filters] = Field(
+        default=None,
+        description=FILTERS_DESCRIPTION
+    )
+
+    @field_validator("filters")
+    @classmethod
+    def check_filters(cls, filters):
+        return normalize_filters(filters)
 
 class Source(BaseModel):
     chunk_id: str
@@ -24,11 +49,148 @@ class Source(BaseModel):
     chunk: str
     score: float
 
+class Usage(BaseModel):
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    context_tokens: int = Field(description="Tokens del contexto recuperado incluido en el prompt")
+    context_chunks: int = Field(description="Chunks incluidos en el contexto")
+    duplicates_dropped: int = Field(description="Chunks descartados por ser casi duplicados")
+    estimated: bool = Field(
+        default=False,
+        description="True si los tokens son una estimación local y no los de la API"
+    )
+
+class RoutingAttempt(BaseModel):
+    model: str
+    status: Literal["ok", "error", "cancelled"]
+    latency_ms: Optional[float] = None
+
+class RoutingDecision(BaseModel):
+    requested: str
+    model: str = Field(description="Modelo que generó la respuesta")
+    tier: Literal["simple", "complex"] = Field(description="Nivel según la complejidad estimada de la pregunta")
+    complexity: float
+    candidates: List[str] = Field(description="Modelos candidatos en orden de preferencia")
+    reason: str = Field(description="preferred, fallback (el preferido no está sano) o all_degraded")
+    hedged: bool = Field(description="True si se lanzó una petición de respaldo por superar el plazo")
+    failover: bool = Field(description="True si se pasó al siguiente modelo tras un error")
+    attempts: List[RoutingAttempt] = []
+
 class QueryResponse(BaseModel):
     answer: str
     sources: List[Source]
     selected_model: str
     temperature: float
+    cache_hit: bool = Field(
+        default=False,
+        description="True si la respuesta se sirvió desde la caché semántica"
+    )
+    usage: Optional[Usage] = Field(
+        default=None,
+        description="Tokens usados (no se informa en las respuestas de la caché)"
+    )
+    routing: Optional[RoutingDecision] = Field(
+        default=None,
+        description="Decisión del router cuando model='auto'"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        description="Sesión a la que pertenece la respuesta (usar en la siguiente pregunta)"
+    )
+    search_query: Optional[str] = Field(
+        default=None,
+        description="Consulta independiente usada en la búsqueda cuando la pregunta depende del historial"
+    )
+    timings: Optional[Dict[str, float]] = Field(
+        default=None,
+        description="Milisegundos de cada etapa (embed, retrieve, rerank, context, chat...) y total"
+    )
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest] = Field(
+        ...,
+        min_length=1,
+        max_length=1000,
+        description="Consultas a procesar"
+    )
+    max_concurrency: int = Field(
+        default=8,
+        ge=1,
+        le=64,
+        description="Número máximo de consultas procesándose a la vez"
+    )
+
+class BatchItemResult(BaseModel):
+    index: int
+    result: Optional[QueryResponse] = None
+    error: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
+class CompareRequest(BaseModel):
+    userQuestion: str = Field(..., description="La pregunta del usuario")
+    models: List[ChatModel] = Field(
+        default_factory=lambda: list(CHAT_MODELS),
+        min_length=1,
+        description="Modelos a comparar (por defecto, todos)"
+    )
+    temperature: float = Field(
+        default=0.7,
+        ge=0.0,
+        le=1.0,
+        description="Temperatura para la generación de texto (0-1)"
+    )
+    context: Optional[str] = Field(
+        default=None,
+        description="Contexto o pre-prompt personalizado"
+    )
+    filters: Optional[Filters] = Field(
+        default=None,
+        description=FILTERS_DESCRIPTION
+    )
+
+    @field_validator("filters")
+    @classmethod
+    def check_filters(cls, filters):
+        return normalize_filters(filters)
+
+class ModelComparison(BaseModel):
+    model: str
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    similarity: Optional[float] = Field(
+        default=None,
+        description="Similitud coseno entre la pregunta y la respuesta"
+    )
+    agreement: Optional[float] = Field(
+        default=None,
+        description="Similitud coseno media con las respuestas de los demás modelos"
+    )
+    length: int = 0
+    latency_ms: float = 0.0
+    usage: Optional[Usage] = None
+
+class CompareResponse(BaseModel):
+    question: str
+    sources: List[Source]
+    results: List[ModelComparison]
+    timings: Dict[str, float] = Field(
+        description="Milisegundos de cada etapa (la de chat es la del modelo más lento) y total"
+    )
+
+class SessionMessage(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
+
+class SessionResponse(BaseModel):
+    sessionId: str
+    summary: str = Field(description="Resumen de los turnos más antiguos")
+    summarized_turns: int = Field(description="Turnos incluidos en el resumen")
+    messages: List[SessionMessage] = Field(description="Turnos recientes")
 
 class ErrorResponse(BaseModel):
     error: str
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Copia cuantizada de los vectores del índice local, para buscar con menos memoria.
+
+La búsqueda exacta recorre la matriz entera, así que toda ella tiene que
+estar en memoria (en la caché de páginas) para ser rápida: 6 KB por chunk
+en float32 con ada-002. Con una copia cuantizada la búsqueda recorre esa
+copia y solo lee de vectors.f32 las filas candidatas para reordenarlas con
+el coseno exacto:
+
+    float16  2 bytes por dimensión (3 KB por chunk, la mitad que float32)
+    int8     1 byte por dimensión y un factor de escala float32 por fila
+             (1,5 KB por chunk, la cuarta parte), cuantización simétrica
+             con x ≈ código * escala y escala = max|x| / 127
+
+Formato del directorio (dentro del índice local, en quantized/):
+    quantized.json  tipo, dimensiones, número de filas y huella de los vectores
+    vectors.f16     matriz float16, o bien
+    vectors.i8      matriz int8 y
+    scales.f32      escala de cada fila
+
+Las filas añadidas al índice local después de construirla se comparan con
+los vectores float32. Si el índice local se ha reconstruido (la huella de
+sus vectores no coincide) la copia se ignora.
+
+Uso:
+    python quantized_index.py build ./local_index --dtype int8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+QUANT_DIR = "quantized"
+QUANT_FILE = "quantized.json"
+QUANT_DTYPES = ("float16", "int8")
+# Filas de vectors.f32 que se comparan para saber si la copia es de esos vectores
+FINGERPRINT_ROWS = 16
+# Filas que se convierten a float32 a la vez al puntuar: la copia temporal cabe en la caché L2
+QUANT_BLOCK_ROWS = 256
+
+
+def quantize(vectors, dtype: str):
+    """Devuelve (códigos, escalas) de las filas; las escalas son None con float16"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization '{dtype}' (expected {' or '.join(QUANT_DTYPES)})")
+
+
+def fingerprint(vectors, count: int) -> str:
+    """Huella de las primeras count filas: hash de unas filas repartidas entre ellas"""
+    digest = hashlib.sha1(str(count).encode())
+    if count:
+        for row in np.unique(np.linspace(0, count - 1, FINGERPRINT_ROWS).astype(np.int64)):
+            digest.update(np.asarray(vectors[row], dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+class QuantizedVectors:
+    """Matriz cuantizada abierta con mmap que da scores aproximados"""
+
+    def __init__(self, dtype: str, codes, scales=None):
+        self.dtype = dtype
+        self.codes = codes
+        self.scales = scales
+        self.count = len(codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query, rows=None):
+        """Producto escalar aproximado de query con todas las filas (o con rows)"""
+        count = self.count if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, QUANT_BLOCK_ROWS):
+            selected = slice(start, start + QUANT_BLOCK_ROWS) if rows is None else rows[start:start + QUANT_BLOCK_ROWS]
+            block = np.asarray(self.codes[selected], dtype=np.float32) @ query
+            if self.scales is not None:
+                block *= self.scales[selected]
+            scores[start:start + QUANT_BLOCK_ROWS] = block
+        return scores
+
+    @classmethod
+    def load(cls, path: str, vectors=None):
+        """
+        Carga la matriz con mmap; None si el índice local no la tiene.
+
+        Con vectors (la matriz float32 del índice local) comprueba que la
+        copia se construyó a partir de ellos y devuelve None si no.
+        """
+        header_path = os.path.join(path, QUANT_FILE)
+        if not os.path.exists(header_path):
+            return None
+        with open(header_path) as f:
+            header = json.load(f)
+
+        rows = header["count"]
+        if vectors is not None and (rows > len(vectors) or header.get("fingerprint") != fingerprint(vectors, rows)):
+            print(f"Ignoring quantized vectors built from another version of the index; "
+                  f"rebuild them with: python quantized_index.py build {os.path.dirname(path.rstrip(os.sep))}")
+            return None
+        shape = (rows, header["dimensions"])
+        if header["dtype"] == "float16":
+            codes = np.memmap(os.path.join(path, "vectors.f16"), dtype=np.float16, mode="r", shape=shape) \
+                if rows else np.zeros(shape, dtype=np.float16)
+            return cls("float16", codes)
+        codes = np.memmap(os.path.join(path, "vectors.i8"), dtype=np.int8, mode="r", shape=shape) \
+            if rows else np.zeros(shape, dtype=np.int8)
+        scales = np.memmap(os.path.join(path, "scales.f32"), dtype=np.float32, mode="r", shape=(rows,)) \
+            if rows else np.zeros(0, dtype=np.float32)
+        return cls("int8", codes, scales)
+
+
+def build_for_local_index(index_path: str, dtype: str = "int8", batch_size: int = 65536):
+    """Cuantiza los vectores de un índice local existente, por bloques"""
+    from local_index import LocalVectorIndex
+
+    if dtype not in QUANT_DTYPES:
+        raise ValueError(f"Unknown quantization '{dtype}' (expected {' or '.join(QUANT_DTYPES)})")
+    local = LocalVectorIndex(index_path, use_ann=False, use_quantized=False)
+    path = os.path.join(index_path, QUANT_DIR)
+    os.makedirs(path, exist_ok=True)
+    names = ["vectors.f16"] if dtype == "float16" else ["vectors.i8", "scales.f32"]
+    handles = [open(os.path.join(path, name + ".tmp"), "wb") for name in names]
+    for start in range(0, local.count, batch_size):
+        codes, scales = quantize(local.vectors[start:start + batch_size], dtype)
+        handles[0].write(codes.tobytes())
+        if scales is not None:
+            handles[1].write(scales.tobytes())
+    for handle in handles:
+        handle.close()
+    local.close()
+
+    # Los datos se reemplazan antes que la cabecera: los lectores ven la versión anterior o la nueva
+    for name in names:
+        os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+    with open(os.path.join(path, QUANT_FILE + ".tmp"), "w") as f:
+        json.dump({"dtype": dtype, "dimensions": local.dimensions, "count": local.count,
+                   "fingerprint": fingerprint(local.vectors, local.count)}, f)
+    os.replace(os.path.join(path, QUANT_FILE + ".tmp"), os.path.join(path, QUANT_FILE))
+    for stale in {"vectors.f16", "vectors.i8", "scales.f32"} - set(names):
+        if os.path.exists(os.path.join(path, stale)):
+            os.remove(os.path.join(path, stale))
+    return QuantizedVectors.load(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye la copia cuantizada de los vectores de un índice local")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("path", help="Directorio del índice local")
+    build_parser.add_argument("--dtype", choices=QUANT_DTYPES, default="int8")
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+    quantized = build_for_local_index(args.path, args.dtype)
+    print(f"✅ Vectores {args.dtype} de {quantized.count} filas ({quantized.nbytes / 2 ** 20:.1f} MB) "
+          f"creados en {time.perf_counter() - start:.1f} s")
+    sys.exit(0)
@@ -1,40 +1,105 @@
 import os
-from openai import AzureOpenAI
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents.models import VectorizedQuery
+import asyncio
+import base64
+import time
+import httpx
+import numpy as np
+from openai import AsyncAzureOpenAI
 import dotenv
+from context_builder import ContextBuilder
+from embedding_cache import EmbeddingCache, normalize_text
+from filters import filters_key
+from metrics import FALLBACKS
+from reranker import RerankStage
+from resilience import Upstream, UpstreamError, is_transient
+from retrieval_cache import RetrievalCache
+from semantic_cache import SemanticAnswerCache
+from sessions import SessionStore, heuristic_rewrite, heuristic_summary, rewrite_messages, summary_messages
+from singleflight import SingleFlight
+from retrievers import create_retriever, format_search_result
+from router import ModelRouter
+from timing import StageTimer
+from warmup import QueryLog, Warmup
 
 # Cargar variables de entorno
 dotenv.load_dotenv()
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def load_azure_settings(require_search: bool = True):
+    """
+    Lee y valida las variables de entorno de Azure OpenAI y Azure Search.
+
+    Con require_search=False (retriever local) las variables de Azure Search
+    son opcionales.
+    """
+    settings = {
+        "AZURE_OPENAI_API_KEY": os.getenv("AZURE_OPENAI_API_KEY"),
+        "AZURE_OPENAI_ENDPOINT": os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "OPENAI_API_VERSION": os.getenv("OPENAI_API_VERSION"),
+        "AZURE_SEARCH_SERVICE_ENDPOINT": os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT"),
+        "AZURE_SEARCH_INDEX": os.getenv("AZURE_SEARCH_INDEX"),
+        "AZURE_SEARCH_ADMIN_KEY": os.getenv("AZURE_SEARCH_ADMIN_KEY"),
+    }
+
+    optional = set() if require_search else {
+        "AZURE_SEARCH_SERVICE_ENDPOINT", "AZURE_SEARCH_INDEX", "AZURE_SEARCH_ADMIN_KEY"
+    }
+    missing_vars = [var for var, value in settings.items() if not value and var not in optional]
+    if missing_vars:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+    return settings
+
+
+def build_system_message(retrieved_context: str, context: str = None):
+    """Construye el mensaje de sistema con el contexto recuperado"""
+    if context:
+        return f"""
+{context}
+
+Context from knowledge base:
+{retrieved_context}
+"""
+    return f"""
+You are an AI Assistant.
+Be brief in your answers. Answer ONLY with the facts listed in the retrieved text.
+
+Context:
+{retrieved_context}
+"""
+
+
+def decode_embedding(data):
+    """Decodifica un embedding pedido con encoding_format="base64" (float32 little-endian)"""
+    if isinstance(data, str):
+        return np.frombuffer(base64.b64decode(data), dtype="<f4")
+    return np.asarray(data, dtype=np.float32)
+
+
 class RAGService:
     def __init__(self):
+        settings = load_azure_settings()
+
         # Configuración de Azure OpenAI
-        self.azure_openai_api_key = os.getenv("AZURE_OPENAI_API_KEY")
-        self.azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-        self.openai_api_version = os.getenv("OPENAI_API_VERSION")
-        self.embedding_model = "text-embedding-ada-002"
-        
+        self.azure_openai_api_key = settings["AZURE_OPENAI_API_KEY"]
+        self.azure_openai_endpoint = settings["AZURE_OPENAI_ENDPOINT"]
+        self.openai_api_version = settings["OPENAI_API_VERSION"]
+        self.embedding_model = EMBEDDING_MODEL
+
         # Configuración de Azure Search
-        self.azure_search_endpoint = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT")
-        self.azure_search_index = os.getenv("AZURE_SEARCH_INDEX")
-        self.azure_search_key = os.getenv("AZURE_SEARCH_ADMIN_KEY")
-        
-        # Validar que todas las variables de entorno estén configuradas
-        required_vars = {
-            "AZURE_OPENAI_API_KEY": self.azure_openai_api_key,
-            "AZURE_OPENAI_ENDPOINT": self.azure_openai_endpoint,
-            "OPENAI_API_VERSION": self.openai_api_version,
-            "AZURE_SEARCH_SERVICE_ENDPOINT": self.azure_search_endpoint,
-            "AZURE_SEARCH_INDEX": self.azure_search_index,
-            "AZURE_SEARCH_ADMIN_KEY": self.azure_search_key,
-        }
-        
-        missing_vars = [var for var, value in required_vars.items() if not value]
-        if missing_vars:
-            raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
-        
+        self.azure_search_endpoint = settings["AZURE_SEARCH_SERVICE_ENDPOINT"]
+        self.azure_search_index = settings["AZURE_SEARCH_INDEX"]
+        self.azure_search_key = settings["AZURE_SEARCH_ADMIN_KEY"]
+        self.search_mode = os.getenv("RAG_SEARCH_MODE", "vector")
+        self.hybrid_candidates = int(os.getenv("RAG_HYBRID_CANDIDATES", 50))
+
+        # Clientes síncronos: solo los usa esta clase, así que se importan aquí
+        from openai import AzureOpenAI
+        from azure.core.credentials import AzureKeyCredential
+        from azure.search.documents import SearchClient
+
         # Inicializar clientes
         try:
             self.openai_client = AzureOpenAI(
@@ -42,7 +107,7 @@ class RAGService:
                 azure_endpoint=self.azure_openai_endpoint,
                 api_version=self.openai_api_version
             )
-            
+
             self.search_client = SearchClient(
                 endpoint=self.azure_search_endpoint,
                 index_name=self.azure_search_index,
@@ -50,79 +115,63 @@ class RAGService:
             )
         except Exception as e:
             raise ValueError(f"Failed to initialize Azure clients: {str(e)}")
-    
+
     def get_embedding(self, text: str):
         """Obtiene el embedding de un texto usando Azure OpenAI"""
         return self.openai_client.embeddings.create(
             model=self.embedding_model,
             input=text
         ).data[0].embedding
-    
+
     def search_documents(self, query: str, top_k: int = 3):
         """Busca documentos relevantes en Azure Search"""
+        from azure.search.documents.models import VectorizedQuery
+
         try:
             # Obtener el embedding del query
             query_vector = self.get_embedding(query)
-            
-            # Usar VectorizedQuery con el vector calculado
+
+            # Usar VectorizedQuery con el vector calculado (en modo híbrido
+            # Azure fusiona en la misma petición la búsqueda de texto con RRF)
+            hybrid = self.search_mode == "hybrid"
             search_results = self.search_client.search(
-                search_text=None,
+                search_text=query if hybrid else None,
                 top=top_k,
                 vector_queries=[
                     VectorizedQuery(
                         vector=query_vector,
-                        k_nearest_neighbors=top_k,
+                        k_nearest_neighbors=max(top_k, self.hybrid_candidates) if hybrid else top_k,
                         fields="text_vector"
                     )
                 ]
             )
         except Exception as e:
+            # Si Azure está limitando o caído, una segunda búsqueda solo añade carga
+            if is_transient(e):
+                raise
             # Fallback a búsqueda de texto simple
             print(f"Vector search failed, falling back to text search: {e}")
+            FALLBACKS.inc(kind="text_search")
             search_results = self.search_client.search(
                 search_text=query,
                 top=top_k
             )
-        
-        results = []
-        for result in search_results:
-            results.append({
-                "chunk_id": result.get("chunk_id", ""),
-                "title": result.get("title", ""),
-                "chunk": result.get("chunk", ""),
-                "score": result.get("@search.score", 0)
-            })
-        
-        return results
-    
+
+        return [format_search_result(result) for result in search_results]
+
     def generate_answer(self, user_question: str, model: str, temperature: float, context: str = None):
         """Genera una respuesta usando RAG"""
         try:
             # Buscar documentos relevantes
             search_results = self.search_documents(user_question)
-            
+
             # Construir contexto de los resultados de búsqueda
             retrieved_context = ""
             for result in search_results:
                 retrieved_context += result["chunk"] + "\n\n"
-            
-            # Usar el contexto proporcionado o el predeterminado
-            if context:
-                system_message = f"""
-{context}
 
-Context from knowledge base:
-{retrieved_context}
-"""
-            else:
-                system_message = f"""
-You are an AI Assistant.
-Be brief in your answers. Answer ONLY with the facts listed in the retrieved text.
+            system_message = build_system_message(retrieved_context, context)
 
-Context:
-{retrieved_context}
-"""
-            
             # Generar respuesta
             response = self.openai_client.chat.completions.create(
                 model=model,
@@ -132,15 +181,722 @@ Context:
                     {"role": "user", "content": user_question},
                 ],
             )
-            
+
             answer = response.choices[0].message.content
-            
+
             return {
                 "answer": answer,
                 "sources": search_results,
                 "selected_model": model,
                 "temperature": temperature
             }
-            
+
+        except Exception as e:
+            raise Exception(f"Error generating answer: {str(e)}")
+
+
+class AsyncRAGService:
+    """
+    Variante asíncrona de RAGService para usar desde FastAPI.
+
+    Usa AsyncAzureOpenAI y un retriever asíncrono (Azure Search o un índice
+    local, según RAG_RETRIEVER), de modo que las llamadas a Azure no bloquean
+    el event loop de uvicorn. Los clientes se crean una sola vez y reutilizan
+    sus conexiones entre requests.
+    """
+
+    def __init__(self):
+        settings = load_azure_settings(require_search=os.getenv("RAG_RETRIEVER", "azure") == "azure")
+
+        # Configuración de Azure OpenAI
+        self.azure_openai_api_key = settings["AZURE_OPENAI_API_KEY"]
+        self.azure_openai_endpoint = settings["AZURE_OPENAI_ENDPOINT"]
+        self.openai_api_version = settings["OPENAI_API_VERSION"]
+        self.embedding_model = EMBEDDING_MODEL
+
+        # Máximo de textos por llamada a embeddings.create
+        self.embedding_batch_size = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", 2048))
+
+        # Tamaño del pool de conexiones HTTP compartido
+        max_connections = int(os.getenv("RAG_HTTP_MAX_CONNECTIONS", 100))
+        max_keepalive = int(os.getenv("RAG_HTTP_MAX_KEEPALIVE", 20))
+        timeout = float(os.getenv("RAG_HTTP_TIMEOUT", 60))
+
+        # Inicializar clientes
+        try:
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_keepalive
+                ),
+                timeout=timeout
+            )
+
+            # Sin reintentos del SDK: los hace self.openai_upstream (ver resilience.py)
+            self.openai_client = AsyncAzureOpenAI(
+                api_key=self.azure_openai_api_key,
+                azure_endpoint=self.azure_openai_endpoint,
+                api_version=self.openai_api_version,
+                http_client=self.http_client,
+                max_retries=0
+            )
+            self.openai_upstream = Upstream.from_env("openai")
+
+            # Backend de recuperación (Azure Search o índice local)
+            self.retriever = create_retriever(settings)
+            # Reranking opcional de los candidatos (RAG_RERANKER)
+            self.reranker = RerankStage.from_env()
+        except Exception as e:
+            raise ValueError(f"Failed to initialize Azure clients: {str(e)}")
+
+        # Caché de embeddings de las consultas y caché semántica de respuestas
+        self.embedding_cache = EmbeddingCache.from_env()
+        self.answer_cache = SemanticAnswerCache.from_env()
+        # Resultados de búsqueda de las consultas repetidas, precalentados al arrancar
+        self.retrieval_cache = RetrievalCache.from_env()
+        self.query_log = QueryLog.from_env()
+        self.warmup = Warmup.from_env(self.query_log)
+        self._warmup_task = None
+        self.context_builder = ContextBuilder.from_env()
+        # Enrutado de model="auto" según la pregunta y la latencia de cada modelo
+        self.router = ModelRouter.from_env()
+
+        # Las peticiones idénticas que llegan a la vez comparten las llamadas a Azure
+        coalesce = os.getenv("RAG_SINGLEFLIGHT_ENABLED", "true") == "true"
+        self.answer_flights = SingleFlight("answer", coalesce)
+        self.embedding_flights = SingleFlight("embedding", coalesce)
+
+        # Sesiones de conversación: historial acotado y reescritura de la pregunta
+        self.sessions = SessionStore.from_env()
+        self.session_model = os.getenv("RAG_SESSION_MODEL", "gpt-4o-mini")
+        self.session_rewrite = os.getenv("RAG_SESSION_REWRITE", "llm")
+        self._compacting = set()
+        self._background = set()
+
+    def upstreams(self):
+        """Capas de resiliencia (resilience.Upstream) de los servicios externos en uso"""
+        upstreams = [self.openai_upstream]
+        for retriever in (self.retriever, getattr(self.retriever, "vector", None)):
+            if getattr(retriever, "upstream", None) is not None:
+                upstreams.append(retriever.upstream)
+        return upstreams
+
+    def start_warmup(self):
+        """Lanza en segundo plano el precalentamiento de las cachés (ver warmup.py)"""
+        if self._warmup_task is None or self._warmup_task.done():
+            self._warmup_task = asyncio.create_task(self.warmup.run_forever(self))
+        return self._warmup_task
+
+    async def close(self):
+        """Cierra las conexiones abiertas con Azure"""
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+        # Los resúmenes de sesión pendientes terminan antes de cerrar los clientes
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        self.embedding_cache.close()
+        self.answer_cache.close()
+        self.sessions.close()
+        self.query_log.close()
+        await self.retriever.close()
+        await self.openai_client.close()
+        await self.http_client.aclose()
+
+    async def get_embedding(self, text: str):
+        """Obtiene el embedding de un texto usando Azure OpenAI (array float32)"""
+        cached = self.embedding_cache.get(text, self.embedding_model)
+        if cached is not None:
+            return cached
+
+        async def embed():
+            # En base64 la respuesta pesa menos y evita validar 1536 floats uno a uno
+            response = await self.openai_upstream.call(self.embedding_model, lambda: self.openai_client.embeddings.create(
+                model=self.embedding_model,
+                input=text,
+                encoding_format="base64"
+            ))
+            vector = decode_embedding(response.data[0].embedding)
+            self.embedding_cache.put(text, self.embedding_model, vector)
+            return vector
+
+        # Si el mismo texto ya se está pidiendo, se espera esa llamada
+        vector, _ = await self.embedding_flights.do((self.embedding_model, normalize_text(text)), embed)
+        return vector
+
+    async def get_embeddings(self, texts):
+        """
+        Obtiene los embeddings de varios textos con el mínimo de llamadas.
+
+        Los textos ya cacheados no se piden; el resto (sin duplicados) se envía
+        como lista en una sola llamada a embeddings.create, troceada según
+        RAG_EMBEDDING_BATCH_SIZE.
+        """
+        vectors = [self.embedding_cache.get(text, self.embedding_model) for text in texts]
+        pending = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+
+        computed = {}
+        for start in range(0, len(pending), self.embedding_batch_size):
+            batch = pending[start:start + self.embedding_batch_size]
+            response = await self.openai_upstream.call(self.embedding_model, lambda: self.openai_client.embeddings.create(
+                model=self.embedding_model,
+                input=batch,
+                encoding_format="base64"
+            ))
+            for item in response.data:
+                vector = decode_embedding(item.embedding)
+                computed[batch[item.index]] = vector
+                self.embedding_cache.put(batch[item.index], self.embedding_model, vector)
+
+        return [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+
+    async def search_documents(self, query: str, top_k: int = 3, query_vector=None, timer: StageTimer = None,
+                               use_cache: bool = True, filters=None):
+        """
+        Busca documentos relevantes con el retriever configurado.
+
+        Con reranker se piden más candidatos (RAG_RERANK_CANDIDATES) y se
+        quedan los top_k mejores según el reranker. Si se pasa un timer, se
+        anotan los tiempos de cada etapa. Los resultados se guardan en la
+        caché de recuperación; con use_cache=False no se consulta (pero se
+        actualiza), como hace el precalentamiento. filters limita la
+        búsqueda a los chunks con esos metadatos (ver filters.py).
+        """
+        timer = timer or StageTimer()
+
+        if use_cache:
+            with timer.stage("retrieval_cache"):
+                cached = self.retrieval_cache.get(query, top_k, filters)
+            if cached is not None:
+                return cached
+
+        # Obtener el embedding del query si no viene ya calculado
+        if query_vector is None:
+            try:
+                with timer.stage("embed"):
+                    query_vector = await self.get_embedding(query)
+            except Exception as e:
+                print(f"Query embedding failed, searching without vector: {e}")
+                FALLBACKS.inc(kind="embedding_failed")
+
+        fetch_k = max(top_k, self.reranker.candidates) if self.reranker is not None else top_k
+        with timer.stage("retrieve"):
+            results, degraded = await self.retriever.search(query, query_vector, fetch_k, filters)
+
+        if self.reranker is not None:
+            with timer.stage("rerank"):
+                results = await self.reranker.rerank(query, results, top_k)
+
+        # Los resultados de un camino de respaldo (sin embedding, búsqueda de texto
+        # en vez de vectorial o una búsqueda híbrida fallida) no se cachean
+        if query_vector is not None and not degraded:
+            self.retrieval_cache.put(query, top_k, results, filters)
+        return results
+
+    def build_messages(self, user_question: str, search_results, context: str = None, session=None,
+                       search_query: str = None):
+        """
+        Construye los mensajes de chat a partir de los documentos recuperados.
+
+        Devuelve (mensajes, packed), donde packed es el resultado de
+        ContextBuilder.build: los chunks que han entrado en el presupuesto de
+        tokens y sus estadísticas. Con sesión se añaden, entre el mensaje de
+        sistema y la pregunta, el resumen de la conversación y sus turnos
+        recientes (acotados a RAG_SESSION_HISTORY_TOKENS).
+        """
+        packed = self.context_builder.build(search_query or user_question, search_results)
+        system_message = build_system_message(packed["context"], context)
+
+        messages = [{"role": "system", "content": system_message}]
+        if session is not None:
+            if session["summary"]:
+                messages.append({
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{session['summary']}"
+                })
+            messages += self.sessions.history(session, self.context_builder.counter)
+        messages.append({"role": "user", "content": user_question})
+        return messages, packed
+
+    def build_usage(self, messages, packed, answer: str, usage=None):
+        """Tokens de la petición: los que devuelve la API o, si no los hay, una estimación"""
+        counter = self.context_builder.counter
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            prompt_tokens, completion_tokens = counter.count_messages(messages), counter.count(answer)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "context_tokens": packed["context_tokens"],
+            "context_chunks": len(packed["results"]),
+            "duplicates_dropped": packed["duplicates"],
+            "estimated": usage is None,
+        }
+
+    async def embed_question(self, user_question: str):
+        """Embedding de la pregunta, o None si falla (la búsqueda caerá a texto)"""
+        try:
+            return await self.get_embedding(user_question)
+        except Exception as e:
+            print(f"Question embedding failed, skipping answer cache: {e}")
+            FALLBACKS.inc(kind="embedding_failed")
+            return None
+
+    async def condense_question(self, session, user_question: str):
+        """
+        Consulta de búsqueda independiente a partir de la pregunta y la conversación.
+
+        Con RAG_SESSION_REWRITE=llm la escribe RAG_SESSION_MODEL con el resumen
+        y los últimos turnos; si falla (o con heuristic) se usa
+        sessions.heuristic_rewrite.
+        """
+        if not session["messages"]:
+            return user_question
+        if self.session_rewrite == "llm":
+            try:
+                response = await self.openai_upstream.call(self.session_model, lambda: self.openai_client.chat.completions.create(
+                    model=self.session_model,
+                    temperature=0,
+                    max_tokens=100,
+                    messages=rewrite_messages(session, user_question),
+                ))
+                query = (response.choices[0].message.content or "").strip()
+                if query:
+                    return query
+            except Exception as e:
+                print(f"Query rewrite failed, using the heuristic rewrite: {e}")
+                FALLBACKS.inc(kind="query_rewrite_failed")
+        return heuristic_rewrite(session, user_question)
+
+    def remember_turn(self, session, user_question: str, answer: str):
+        """Guarda el turno en la sesión y, si el historial se pasa del presupuesto, lo resume en segundo plano"""
+        self.sessions.append(session, user_question, answer)
+        counter = self.context_builder.counter
+        if self.sessions.needs_compaction(session, counter) and session["id"] not in self._compacting:
+            self._compacting.add(session["id"])
+            task = asyncio.create_task(self.compact_session(session))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def compact_session(self, session):
+        """Resume los turnos más antiguos de la sesión junto con su resumen anterior"""
+        counter = self.context_builder.counter
+        max_tokens = self.sessions.summary_tokens
+        try:
+            folded, _ = self.sessions.split_for_compaction(session, counter)
+            if not folded:
+                return
+            summary = ""
+            try:
+                response = await self.openai_upstream.call(self.session_model, lambda: self.openai_client.chat.completions.create(
+                    model=self.session_model,
+                    temperature=0,
+                    max_tokens=max_tokens,
+                    messages=summary_messages(session["summary"], folded, max_tokens),
+                ))
+                summary = (response.choices[0].message.content or "").strip()
+            except Exception as e:
+                print(f"Session summary failed, keeping the questions as summary: {e}")
+                FALLBACKS.inc(kind="session_summary_failed")
+            if not summary:
+                summary = heuristic_summary(session["summary"], folded, max_tokens, counter)
+            self.sessions.compact(session, folded, summary)
+        finally:
+            self._compacting.discard(session["id"])
+
+    async def generate_answer(self, user_question: str, model: str, temperature: float, context: str = None,
+                              query_vector=None, session_id: str = None, filters=None):
+        """
+        Genera una respuesta usando RAG.
+
+        Con model="auto" el modelo lo elige ModelRouter (ver router.py) y la
+        decisión se devuelve en routing. Las peticiones idénticas (pregunta,
+        modelo, temperatura y contexto) que llegan mientras otra está en curso
+        esperan su resultado en vez de repetir las llamadas; el resultado
+        compartido lleva coalesced=True.
+
+        Con session_id la pregunta se responde dentro de esa conversación
+        ('new' o un id desconocido abren una nueva) y el resultado trae el
+        session_id y la consulta usada en la búsqueda. Con filters solo se
+        buscan los chunks con esos metadatos.
+        """
+        session = self.sessions.get_or_create(session_id) if session_id is not None else None
+        if session is None or not session["messages"]:
+            self.query_log.record(user_question)
+        if session is not None and session["messages"]:
+            # Con historial la respuesta depende de la conversación: sin caché ni agrupación
+            result = await self._generate_answer(
+                user_question, model, temperature, context, query_vector, session, filters
+            )
+        else:
+            key = (normalize_text(user_question), model, temperature, context, filters_key(filters))
+            result, shared = await self.answer_flights.do(
+                key, lambda: self._generate_answer(
+                    user_question, model, temperature, context, query_vector, filters=filters
+                )
+            )
+            if shared:
+                result = dict(result, coalesced=True)
+
+        if session is not None:
+            self.remember_turn(session, user_question, result["answer"])
+            result = dict(result, session_id=session["id"])
+        return result
+
+    async def _generate_answer(self, user_question: str, model: str, temperature: float, context: str = None,
+                               query_vector=None, session=None, filters=None):
+        timer = StageTimer()
+        routing = self.router.choose(user_question) if model == "auto" else None
+        if routing is not None:
+            model = routing["model"]
+        try:
+            search_query = user_question
+            if session is not None:
+                with timer.stage("rewrite"):
+                    search_query = await self.condense_question(session, user_question)
+
+            if query_vector is None:
+                with timer.stage("embed"):
+                    query_vector = await self.embed_question(search_query)
+
+            # Reutilizar la respuesta de una pregunta equivalente si la hay
+            if query_vector is not None and session is None:
+                with timer.stage("answer_cache"):
+                    cached = self.answer_cache.lookup(query_vector, model, temperature, context, filters)
+                if cached is not None:
+                    return {
+                        "answer": cached["answer"],
+                        "sources": cached["sources"],
+                        "selected_model": model,
+                        "temperature": temperature,
+                        "cache_hit": True,
+                        "routing": routing,
+                        "timings": timer.as_dict()
+                    }
+
+            # Buscar documentos relevantes
+            search_results = await self.search_documents(
+                search_query, query_vector=query_vector, timer=timer, filters=filters
+            )
+
+            # Generar respuesta
+            with timer.stage("context"):
+                messages, packed = self.build_messages(user_question, search_results, context, session, search_query)
+
+            async def ask(chat_model):
+                return await self.openai_upstream.call(chat_model, lambda: self.openai_client.chat.completions.create(
+                    model=chat_model,
+                    temperature=temperature,
+                    messages=messages,
+                ))
+
+            with timer.stage("chat"):
+                if routing is not None:
+                    response, routing = await self.router.complete(routing, ask)
+                    model = routing["model"]
+                else:
+                    # Las llamadas con modelo explícito también alimentan las estadísticas del router
+                    response = await self.router.call(model, ask)
+
+            answer = response.choices[0].message.content
+            sources = packed["results"]
+
+            if query_vector is not None and session is None:
+                self.answer_cache.store(query_vector, model, temperature, context, answer, sources, filters)
+
+            return {
+                "answer": answer,
+                "sources": sources,
+                "selected_model": model,
+                "temperature": temperature,
+                "cache_hit": False,
+                "usage": self.build_usage(messages, packed, answer, response.usage),
+                "routing": routing,
+                "search_query": search_query if session is not None else None,
+                "timings": timer.as_dict()
+            }
+
+        except UpstreamError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error generating answer: {str(e)}")
+
+    async def generate_answers_batch(self, queries, max_concurrency: int = 8):
+        """
+        Genera respuestas para una lista de consultas.
+
+        Cada consulta es un dict con user_question, model, temperature, context
+        y filters.
+        Los embeddings se calculan todos juntos y después las búsquedas y las
+        llamadas al chat se ejecutan en paralelo con como mucho max_concurrency
+        en vuelo. Devuelve un resultado o un error por consulta, en orden.
+        """
+        try:
+            vectors = await self.get_embeddings([query["user_question"] for query in queries])
+        except Exception as e:
+            # Cada consulta intentará su propio embedding (o caerá a texto)
+            print(f"Batch embedding failed, embedding queries one by one: {e}")
+            FALLBACKS.inc(kind="batch_embedding_failed")
+            vectors = [None] * len(queries)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(index, query, query_vector):
+            async with semaphore:
+                try:
+                    result = await self.generate_answer(
+                        user_question=query["user_question"],
+                        model=query["model"],
+                        temperature=query["temperature"],
+                        context=query.get("context"),
+                        query_vector=query_vector,
+                        filters=query.get("filters")
+                    )
+                    return {"index": index, "result": result, "error": None}
+                except Exception as e:
+                    return {"index": index, "result": None, "error": str(e)}
+
+        return await asyncio.gather(*(
+            run(index, query, query_vector)
+            for index, (query, query_vector) in enumerate(zip(queries, vectors))
+        ))
+
+    async def compare_models(self, user_question: str, models, temperature: float, context: str = None,
+                             filters=None):
+        """
+        Responde la misma pregunta con varios modelos y compara las respuestas.
+
+        La búsqueda y el contexto se preparan una sola vez y las llamadas al
+        chat se lanzan todas a la vez, así que la comparación tarda lo que el
+        modelo más lento. Después se piden los embeddings de todas las
+        respuestas en una sola llamada y se calculan con NumPy la similitud
+        de cada respuesta con la pregunta y con las de los demás modelos.
+        """
+        models = list(dict.fromkeys(models))
+        timer = StageTimer()
+        self.query_log.record(user_question)
+
+        with timer.stage("embed"):
+            query_vector = await self.embed_question(user_question)
+        search_results = await self.search_documents(
+            user_question, query_vector=query_vector, timer=timer, filters=filters
+        )
+        with timer.stage("context"):
+            messages, packed = self.build_messages(user_question, search_results, context)
+        sources = packed["results"]
+
+        async def ask(model):
+            start = time.perf_counter()
+            response = await self.openai_upstream.call(model, lambda: self.openai_client.chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=messages,
+            ))
+            return response, round((time.perf_counter() - start) * 1000, 3)
+
+        with timer.stage("chat"):
+            responses = await asyncio.gather(*(ask(model) for model in models), return_exceptions=True)
+
+        results = []
+        for model, outcome in zip(models, responses):
+            if isinstance(outcome, Exception):
+                print(f"Model {model} failed during comparison: {outcome}")
+                results.append({"model": model, "error": str(outcome)})
+                continue
+            response, latency_ms = outcome
+            answer = (response.choices[0].message.content or "").strip()
+            results.append({
+                "model": model,
+                "answer": answer,
+                "length": len(answer),
+                "latency_ms": latency_ms,
+                "usage": self.build_usage(messages, packed, answer, response.usage),
+            })
+            if query_vector is not None:
+                self.answer_cache.store(query_vector, model, temperature, context, answer, sources, filters)
+
+        if all("error" in result for result in results):
+            if isinstance(responses[0], UpstreamError):
+                raise responses[0]
+            raise Exception(f"Error comparing models: {results[0]['error']}")
+
+        answered = [result for result in results if result.get("answer")]
+
+        if answered:
+            try:
+                with timer.stage("answer_embed"):
+                    vectors = await self.get_embeddings([result["answer"] for result in answered])
+                with timer.stage("similarity"):
+                    self.score_answers(answered, query_vector, vectors)
+            except Exception as e:
+                print(f"Answer embedding failed, comparing without similarity: {e}")
+                FALLBACKS.inc(kind="compare_embedding_failed")
+
+        return {
+            "question": user_question,
+            "sources": sources,
+            "results": results,
+            "timings": timer.as_dict(),
+        }
+
+    @staticmethod
+    def score_answers(answered, query_vector, vectors):
+        """Añade a cada respuesta su similitud con la pregunta y el acuerdo medio con las demás"""
+        matrix = np.vstack(vectors).astype(np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        if query_vector is not None:
+            question = np.asarray(query_vector, dtype=np.float32)
+            question = question / max(float(np.linalg.norm(question)), 1e-12)
+            for result, similarity in zip(answered, matrix @ question):
+                result["similarity"] = round(float(similarity), 4)
+
+        if len(answered) > 1:
+            pairwise = matrix @ matrix.T
+            agreement = (pairwise.sum(axis=1) - np.diag(pairwise)) / (len(answered) - 1)
+            for result, value in zip(answered, agreement):
+                result["agreement"] = round(float(value), 4)
+
+    async def stream_answer(self, user_question: str, model: str, temperature: float, context: str = None,
+                            session_id: str = None, filters=None):
+        """
+        Genera una respuesta usando RAG emitiendo eventos a medida que llegan.
+
+        Produce primero un evento "sources" con los documentos recuperados, luego
+        un evento "delta" por cada fragmento de texto del modelo y por último un
+        evento "done". Con model="auto" el modelo se elige al empezar (sin
+        cobertura, pero si falla la llamada se prueba el siguiente candidato).
+        Con session_id se responde dentro de la conversación, como en
+        generate_answer, y el evento "done" trae el session_id. filters
+        limita la búsqueda como en generate_answer.
+        """
+        timer = StageTimer()
+        routing = self.router.choose(user_question) if model == "auto" else None
+        if routing is not None:
+            model = routing["model"]
+        session = self.sessions.get_or_create(session_id) if session_id is not None else None
+        follow_up = session is not None and bool(session["messages"])
+        if not follow_up:
+            self.query_log.record(user_question)
+        session_data = {"session_id": session["id"]} if session is not None else {}
+        try:
+            search_query = user_question
+            if follow_up:
+                with timer.stage("rewrite"):
+                    search_query = await self.condense_question(session, user_question)
+                session_data["search_query"] = search_query
+
+            with timer.stage("embed"):
+                query_vector = await self.embed_question(search_query)
+
+            # Una respuesta cacheada se envía entera en un solo delta
+            if query_vector is not None and not follow_up:
+                with timer.stage("answer_cache"):
+                    cached = self.answer_cache.lookup(query_vector, model, temperature, context, filters)
+                if cached is not None:
+                    if session is not None:
+                        self.remember_turn(session, user_question, cached["answer"])
+                    yield {"event": "sources", "data": {"sources": cached["sources"]}}
+                    yield {"event": "delta", "data": {"content": cached["answer"]}}
+                    yield {
+                        "event": "done",
+                        "data": {
+                            "selected_model": model,
+                            "temperature": temperature,
+                            "cache_hit": True,
+                            "routing": routing,
+                            **session_data,
+                            "timings": timer.as_dict()
+                        }
+                    }
+                    return
+
+            # Buscar documentos relevantes
+            search_results = await self.search_documents(
+                search_query, query_vector=query_vector, timer=timer, filters=filters
+            )
+            with timer.stage("context"):
+                messages, packed = self.build_messages(
+                    user_question, search_results, context, session if follow_up else None, search_query
+                )
+            sources = packed["results"]
+            yield {"event": "sources", "data": {"sources": sources}}
+
+            # Generar respuesta en streaming
+            chat_start = timer.total()
+            candidates = routing["candidates"][:max(1, self.router.max_attempts)] if routing else [model]
+            for attempt, candidate in enumerate(candidates):
+                call_start = time.perf_counter()
+                try:
+                    stream = await self.openai_upstream.call(candidate, lambda: self.openai_client.chat.completions.create(
+                        model=candidate,
+                        temperature=temperature,
+                        messages=messages,
+                        stream=True,
+                    ))
+                    break
+                except Exception as e:
+                    # Como en router.call: los errores (y la latencia del stream completo, abajo)
+                    # alimentan las estadísticas con las que model="auto" elige modelo
+                    latency_ms = (time.perf_counter() - call_start) * 1000
+                    self.router.record(candidate, latency_ms, ok=False)
+                    if attempt == len(candidates) - 1:
+                        raise
+                    print(f"Model {candidate} failed, trying the next one: {e}")
+                    routing["failover"] = True
+                    routing["attempts"].append({"model": candidate, "status": "error", "latency_ms": round(latency_ms, 3)})
+            model = candidate
+            if routing is not None:
+                routing["model"] = model
+
+            answer_parts = []
+            try:
+                async for chunk in stream:
+                    # Azure envía chunks sin choices con los resultados del filtro de contenido
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        if not answer_parts:
+                            timer.add("first_token", timer.total() - chat_start)
+                        answer_parts.append(content)
+                        yield {"event": "delta", "data": {"content": content}}
+            except Exception:
+                self.router.record(model, (time.perf_counter() - call_start) * 1000, ok=False)
+                raise
+            except BaseException:
+                # El cliente se ha desconectado: el tiempo hasta entonces no es la latencia del modelo
+                self.router.record_cancelled(model)
+                raise
+            latency_ms = (time.perf_counter() - call_start) * 1000
+            self.router.record(model, latency_ms, ok=True)
+            if routing is not None:
+                routing["attempts"].append({"model": model, "status": "ok", "latency_ms": round(latency_ms, 3)})
+            timer.add("chat", timer.total() - chat_start)
+
+            answer = "".join(answer_parts)
+            if query_vector is not None and not follow_up:
+                self.answer_cache.store(query_vector, model, temperature, context, answer, sources, filters)
+            if session is not None:
+                self.remember_turn(session, user_question, answer)
+
+            # La API en streaming no devuelve el uso de tokens: se estima
+            yield {
+                "event": "done",
+                "data": {
+                    "selected_model": model,
+                    "temperature": temperature,
+                    "cache_hit": False,
+                    "usage": self.build_usage(messages, packed, answer),
+                    "routing": routing,
+                    **session_data,
+                    "timings": timer.as_dict()
+                }
+            }
+
+        except UpstreamError:
+            raise
         except Exception as e:
-            raise Exception(f"Error generating answer: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error generating answer: {str(e)}")
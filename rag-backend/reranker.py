@@ -0,0 +1,239 @@
+import asyncio
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from bm25_index import tokenize
+from embedding_cache import normalize_text
+
+# Prefijo con el que se comparan las palabras, para que las variantes de una
+# misma palabra (aguacate / aguacates) cuenten como coincidencia
+STEM_LENGTH = 5
+
+
+def stems(text: str):
+    return [token[:STEM_LENGTH] for token in tokenize(text)]
+
+
+def min_max(scores):
+    """Escala los scores a [0, 1] (todos 0 si son iguales)"""
+    scores = np.asarray(scores, dtype=np.float32)
+    if not len(scores):
+        return scores
+    spread = scores.max() - scores.min()
+    if spread == 0:
+        return np.zeros_like(scores)
+    return (scores - scores.min()) / spread
+
+
+class LexicalReranker:
+    """
+    Reranker léxico sin modelo: BM25 de los términos de la pregunta calculado
+    sobre los candidatos, más un extra por cada par de palabras consecutivas
+    de la pregunta que aparece en el chunk.
+
+    Los términos se cuentan por candidato y el scoring es una operación
+    matricial (candidatos x términos). Como el IDF se calcula sobre el
+    conjunto de candidatos, sus scores no se cachean (además cuesta menos
+    calcularlos que buscarlos).
+    """
+
+    name = "lexical"
+    cacheable = False
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, bigram_weight: float = 0.5):
+        self.k1 = k1
+        self.b = b
+        self.bigram_weight = bigram_weight
+
+    def score(self, query: str, texts):
+        terms = list(dict.fromkeys(stems(query)))
+        if not terms or not texts:
+            return np.zeros(len(texts), dtype=np.float32)
+        term_index = {term: j for j, term in enumerate(terms)}
+        query_bigrams = set(zip(terms, terms[1:]))
+
+        counts = np.zeros((len(texts), len(terms)), dtype=np.float32)
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        bigrams = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = stems(text)
+            lengths[row] = len(words)
+            for term, count in Counter(words).items():
+                j = term_index.get(term)
+                if j is not None:
+                    counts[row, j] = count
+            if query_bigrams:
+                bigrams[row] = len(query_bigrams.intersection(zip(words, words[1:])))
+
+        document_frequency = (counts > 0).sum(axis=0)
+        idf = np.log(1.0 + (len(texts) - document_frequency + 0.5) / (document_frequency + 0.5))
+        length_norms = self.k1 * (1 - self.b + self.b * lengths / (lengths.mean() or 1.0))
+        bm25 = (idf * counts * (self.k1 + 1) / (counts + length_norms[:, np.newaxis])).sum(axis=1)
+        return bm25 + self.bigram_weight * bigrams
+
+
+class OnnxCrossEncoderReranker:
+    """
+    Cross-encoder exportado a ONNX (por ejemplo un MiniLM de MS MARCO).
+
+    Requiere onnxruntime y tokenizers. model_path es el .onnx y
+    tokenizer_path el tokenizer.json del mismo modelo.
+    """
+
+    name = "onnx"
+    cacheable = True
+
+    def __init__(self, model_path: str, tokenizer_path: str, max_length: int = 512, threads: int = 0):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("The ONNX reranker requires onnxruntime and tokenizers: pip install onnxruntime tokenizers")
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def score(self, query: str, texts):
+        encodings = self.tokenizer.encode_batch([(query, text) for text in texts])
+        inputs = {
+            "input_ids": np.asarray([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.asarray([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.asarray([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+        return np.asarray(logits, dtype=np.float32).reshape(len(texts), -1)[:, 0]
+
+
+class RerankStage:
+    """
+    Reordena los candidatos de la búsqueda con un reranker.
+
+    Los candidatos se puntúan en lotes de batch_size y el score de cada
+    (pregunta, chunk_id) se guarda en una caché LRU (salvo en los rerankers
+    cuyo score depende del conjunto de candidatos). El orden final mezcla el
+    score del reranker con el de la búsqueda, ambos escalados a [0, 1]:
+    weight * reranker + (1 - weight) * búsqueda. Los rerankers con modelo se
+    ejecutan en un hilo para no bloquear el event loop.
+    """
+
+    def __init__(self, reranker, candidates: int = 20, batch_size: int = 16, weight: float = 0.5,
+                 cache_size: int = 50000, budget_ms: float = 50.0):
+        self.reranker = reranker
+        self.candidates = candidates
+        self.batch_size = batch_size
+        self.weight = weight
+        self.cache_size = cache_size
+        self.budget_ms = budget_ms
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.over_budget = 0
+
+    @classmethod
+    def from_env(cls):
+        """Crea la etapa según RAG_RERANKER (none, lexical u onnx), o None si está desactivada"""
+        kind = os.getenv("RAG_RERANKER", "none")
+        if kind == "none":
+            return None
+        if kind == "lexical":
+            reranker = LexicalReranker()
+            default_weight = 0.5
+        elif kind == "onnx":
+            model_path = os.getenv("RAG_RERANK_MODEL_PATH")
+            tokenizer_path = os.getenv("RAG_RERANK_TOKENIZER_PATH")
+            if not model_path or not tokenizer_path:
+                raise ValueError("RAG_RERANK_MODEL_PATH and RAG_RERANK_TOKENIZER_PATH are required when RAG_RERANKER=onnx")
+            reranker = OnnxCrossEncoderReranker(model_path, tokenizer_path)
+            default_weight = 1.0
+        else:
+            raise ValueError(f"Unknown RAG_RERANKER '{kind}' (expected 'none', 'lexical' or 'onnx')")
+
+        return cls(
+            reranker,
+            candidates=int(os.getenv("RAG_RERANK_CANDIDATES", 20)),
+            batch_size=int(os.getenv("RAG_RERANK_BATCH_SIZE", 16)),
+            weight=float(os.getenv("RAG_RERANK_WEIGHT", default_weight)),
+            cache_size=int(os.getenv("RAG_RERANK_CACHE_SIZE", 50000)),
+            budget_ms=float(os.getenv("RAG_RERANK_BUDGET_MS", 50))
+        )
+
+    def _cache_get(self, key):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key, score: float):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def score(self, query: str, results):
+        """Score del reranker de cada resultado (de la caché o calculado en lotes)"""
+        if not self.reranker.cacheable:
+            return self._score_batches(query, [result["chunk"] for result in results])
+
+        normalized_query = normalize_text(query)
+        keys = [(normalized_query, result["chunk_id"]) for result in results]
+        scores = np.array([self._cache_get(key) if key[1] else None for key in keys], dtype=object)
+        pending = [i for i, score in enumerate(scores) if score is None]
+
+        computed = self._score_batches(query, [results[i]["chunk"] for i in pending])
+        for i, score in zip(pending, computed):
+            scores[i] = float(score)
+            if keys[i][1]:
+                self._cache_put(keys[i], float(score))
+
+        return scores.astype(np.float32)
+
+    def _score_batches(self, query: str, texts):
+        if not self.reranker.cacheable:
+            # Los scores relativos al conjunto se calculan en una sola pasada
+            return self.reranker.score(query, texts)
+        scores = [
+            self.reranker.score(query, texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+    async def rerank(self, query: str, results, top_k: int):
+        """Devuelve los top_k resultados reordenados (el campo score pasa a ser el combinado)"""
+        if len(results) <= 1:
+            return results[:top_k]
+
+        start = time.perf_counter()
+        if isinstance(self.reranker, LexicalReranker):
+            rerank_scores = self.score(query, results)
+        else:
+            rerank_scores = await asyncio.to_thread(self.score, query, results)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > self.budget_ms:
+            self.over_budget += 1
+            print(f"Reranking {len(results)} candidates took {elapsed_ms:.1f} ms (budget {self.budget_ms:.0f} ms)")
+
+        retrieval_scores = np.array([result["score"] for result in results], dtype=np.float32)
+        combined = self.weight * min_max(rerank_scores) + (1 - self.weight) * min_max(retrieval_scores)
+        order = np.argsort(-combined, kind="stable")[:top_k]
+        return [dict(results[i], score=float(combined[i])) for i in order]
+
+    def stats(self):
+        return {
+            "reranker": self.reranker.name,
+            "candidates": self.candidates,
+            "cache_size": len(self._cache),
+            "over_budget": self.over_budget,
+        }
@@ -0,0 +1,265 @@
+"""
+Capa común para las llamadas a Azure OpenAI y Azure Search.
+
+Cada llamada pasa por tres mecanismos, por despliegue (clave):
+
+- Reintentos con backoff exponencial con jitter para los errores
+  transitorios (429, 5xx, timeouts y errores de conexión). Se respeta
+  Retry-After; si pide esperar más que max_delay no se reintenta y el error
+  llega al cliente como 429 con ese Retry-After.
+- Circuit breaker: tras failure_threshold fallos seguidos (sin contar los
+  429) se deja de llamar durante reset_timeout segundos y se responde 503;
+  después se deja pasar una petición de prueba.
+- Limitador de concurrencia adaptativo (AIMD): cada respuesta correcta sube
+  el límite en 1/límite y cada 429 lo divide por dos (como mucho una vez por
+  segundo), de modo que la concurrencia se ajusta sola a la cuota de TPM/RPM
+  del despliegue en vez de provocar tormentas de reintentos.
+
+Los SDK se configuran sin reintentos propios para que solo reintente esta
+capa.
+"""
+
+import asyncio
+import os
+import random
+import time
+
+from metrics import UPSTREAM_RETRIES
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """Fallo de un servicio externo tras los reintentos; status_code es el que se devuelve al cliente"""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+def retry_after_seconds(error):
+    """Segundos indicados por la cabecera Retry-After de un error de Azure, si la hay"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header in ("retry-after-ms", "retry-after"):
+        value = response.headers.get(header)
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                continue
+            return seconds / 1000 if header == "retry-after-ms" else seconds
+    return None
+
+
+def status_code_of(error):
+    """Código HTTP de un error de openai o de azure-core (None si no hubo respuesta)"""
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_transient(error) -> bool:
+    """True si merece la pena reintentar: 429, 5xx, timeouts y errores de conexión"""
+    status = status_code_of(error)
+    if status is not None:
+        return status in TRANSIENT_STATUS_CODES
+    # Sin respuesta HTTP: timeouts y conexiones fallidas (openai y azure-core)
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {
+        "APIConnectionError", "APITimeoutError", "ServiceRequestError", "ServiceResponseError",
+        "TimeoutError", "ConnectionError",
+    })
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def before_call(self):
+        """Lanza CircuitOpenError si el circuito está abierto"""
+        if self.state == "open":
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open)", 503, remaining)
+            self.state = "half_open"
+        if self.state == "half_open":
+            # Solo una petición de prueba a la vez
+            if self._probing:
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit half-open)", 503, 1.0)
+            self._probing = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self):
+        """Fin de una llamada que no cuenta ni como éxito ni como fallo (p. ej. un 429)"""
+        self._probing = False
+
+
+class AdaptiveLimiter:
+    """Límite de peticiones en vuelo con aumento aditivo y reducción multiplicativa (AIMD)"""
+
+    def __init__(self, initial: int = 32, minimum: int = 1, maximum: int = 100, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.throttled = 0
+        self._last_decrease = 0.0
+        self._condition = None
+
+    async def acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while self.in_flight >= int(self.limit):
+                await self._condition.wait()
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            free = int(self.limit) - self.in_flight
+            if free > 0:
+                self._condition.notify(free)
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self):
+        self.throttled += 1
+        now = time.monotonic()
+        # Una ráfaga de 429 de peticiones que ya estaban en vuelo reduce el límite una sola vez
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+
+class Upstream:
+    """Reintentos, circuit breaker y limitador de un servicio externo, por despliegue"""
+
+    def __init__(self, service: str, max_retries: int = 3, base_delay: float = 0.25, max_delay: float = 10.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, initial_concurrency: int = 32,
+                 max_concurrency: int = 100):
+        self.service = service
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.breakers = {}
+        self.limiters = {}
+
+    @classmethod
+    def from_env(cls, service: str):
+        return cls(
+            service,
+            max_retries=int(os.getenv("RAG_RETRY_MAX_RETRIES", 3)),
+            base_delay=float(os.getenv("RAG_RETRY_BASE_DELAY", 0.25)),
+            max_delay=float(os.getenv("RAG_RETRY_MAX_DELAY", 10)),
+            failure_threshold=int(os.getenv("RAG_CIRCUIT_FAILURE_THRESHOLD", 5)),
+            reset_timeout=float(os.getenv("RAG_CIRCUIT_RESET_TIMEOUT", 30)),
+            initial_concurrency=int(os.getenv("RAG_UPSTREAM_CONCURRENCY", 32)),
+            max_concurrency=int(os.getenv("RAG_UPSTREAM_MAX_CONCURRENCY", 100))
+        )
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(f"{self.service}:{key}", self.failure_threshold, self.reset_timeout)
+        return self.breakers[key]
+
+    def limiter(self, key: str) -> AdaptiveLimiter:
+        if key not in self.limiters:
+            self.limiters[key] = AdaptiveLimiter(self.initial_concurrency, maximum=self.max_concurrency)
+        return self.limiters[key]
+
+    def backoff(self, attempt: int) -> float:
+        """Espera del reintento attempt (0, 1, ...): exponencial con jitter completo"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, key: str, operation):
+        """Ejecuta await operation() para el despliegue key con reintentos, breaker y limitador"""
+        name = f"{self.service}:{key}"
+        breaker = self.breaker(key)
+        limiter = self.limiter(key)
+
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            # Se comprueba después de esperar turno: el circuito puede haberse abierto mientras tanto
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                await limiter.release()
+                raise
+            try:
+                result = await operation()
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    breaker.release()
+                    raise
+                status = status_code_of(e)
+                if status == 429:
+                    limiter.on_throttle()
+                    breaker.release()
+                else:
+                    breaker.record_failure()
+                error = e
+            else:
+                limiter.on_success()
+                breaker.record_success()
+                return result
+            finally:
+                await limiter.release()
+
+            retry_after = retry_after_seconds(error)
+            if attempt == self.max_retries or (retry_after is not None and retry_after > self.max_delay):
+                break
+            UPSTREAM_RETRIES.inc(service=self.service, reason=str(status or type(error).__name__))
+            delay = retry_after if retry_after is not None else self.backoff(attempt)
+            await asyncio.sleep(delay + random.uniform(0, self.base_delay))
+
+        if status == 429:
+            raise UpstreamError(f"{name} is rate limited: {error}", 429, retry_after or self.max_delay) from error
+        raise UpstreamError(f"{name} failed after {attempt + 1} attempts: {error}", 503, retry_after) from error
+
+    def stats(self):
+        return {
+            key: {
+                "circuit": self.breakers[key].state if key in self.breakers else "closed",
+                "concurrency_limit": round(limiter.limit, 1),
+                "in_flight": limiter.in_flight,
+                "throttled": limiter.throttled,
+            }
+            for key, limiter in self.limiters.items()
+        }
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from embedding_cache import normalize_text
+from filters import filters_key
+
+
+class RetrievalCache:
+    """
+    Caché de resultados de búsqueda con expulsión LRU y caducidad por TTL.
+
+    La clave es la consulta normalizada más el número de resultados pedido y
+    los filtros, así que sirve para cualquier modelo, temperatura o contexto: a diferencia
+    de la caché semántica de respuestas, evita el embedding, la búsqueda y el
+    reranking aunque la respuesta se vuelva a generar. El TTL acota cuánto
+    tarda en notarse un cambio del índice.
+    """
+
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        """Crea la caché a partir de las variables RAG_RETRIEVAL_CACHE_*"""
+        return cls(
+            max_entries=int(os.getenv("RAG_RETRIEVAL_CACHE_SIZE", 5000)),
+            ttl_seconds=float(os.getenv("RAG_RETRIEVAL_CACHE_TTL", 600)),
+        )
+
+    @staticmethod
+    def make_key(query: str, top_k: int, filters=None):
+        return normalize_text(query), top_k, filters_key(filters)
+
+    def get(self, query: str, top_k: int, filters=None):
+        """Devuelve una copia de los resultados cacheados o None"""
+        if self.max_entries <= 0:
+            return None
+
+        key = self.make_key(query, top_k, filters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, results = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return [dict(result) for result in results]
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, query: str, top_k: int, results, filters=None):
+        if self.max_entries <= 0:
+            return
+
+        key = self.make_key(query, top_k, filters)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, [dict(result) for result in results])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
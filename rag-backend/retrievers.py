@@ -0,0 +1,311 @@
+import asyncio
+import os
+
+from bm25_index import BM25_DIR, BM25_FILE, BM25Index, indexed_text
+from filters import to_odata
+from local_index import LocalVectorIndex
+from metrics import FALLBACKS
+from resilience import Upstream, UpstreamError
+
+# A partir de este tamaño (filas x dimensiones) la búsqueda local se hace en un
+# hilo para no bloquear el event loop; por debajo es más barato hacerla inline.
+LOCAL_SEARCH_THREAD_THRESHOLD = 4_000_000
+# Lo mismo para BM25, en número de filas
+KEYWORD_SEARCH_THREAD_THRESHOLD = 20_000
+
+
+def format_search_result(result):
+    """Convierte un resultado de Azure Search al formato de la API"""
+    return {
+        "chunk_id": result.get("chunk_id", ""),
+        "title": result.get("title", ""),
+        "chunk": result.get("chunk", ""),
+        "score": result.get("@search.score", 0)
+    }
+
+
+def reciprocal_rank_fusion(result_lists, top_k: int, k: int = 60):
+    """
+    Fusiona listas de resultados ordenadas con Reciprocal Rank Fusion.
+
+    Cada chunk suma 1 / (k + posición) por cada lista en la que aparece; el
+    score de la salida es esa suma.
+    """
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            entry = fused.setdefault(result["chunk_id"], dict(result, score=0.0))
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda result: result["score"], reverse=True)[:top_k]
+
+
+class Retriever:
+    """
+    Interfaz común de los backends de recuperación.
+
+    search devuelve (resultados, degradado): una lista de dicts con
+    chunk_id, title, chunk y score, ordenada de más a menos relevante, y
+    True si se ha usado un camino de respaldo (búsqueda de texto en vez de
+    vectorial, una de las dos búsquedas híbridas ha fallado), para no
+    cachear esos resultados. filters limita la búsqueda a los chunks con
+    esos metadatos (ver filters.py).
+    """
+
+    name = "base"
+
+    async def search(self, query: str, query_vector, top_k: int = 3, filters=None):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class AzureSearchRetriever(Retriever):
+    """
+    Búsqueda en Azure Search, con búsqueda de texto como respaldo.
+
+    En modo "hybrid" la búsqueda de texto y la vectorial van en la misma
+    petición y Azure las fusiona con RRF, así que no añade latencia respecto
+    a la vectorial. hybrid_candidates es el número de vecinos que aporta la
+    parte vectorial a la fusión.
+
+    Las llamadas pasan por resilience.Upstream (reintentos, circuit breaker y
+    limitador). La búsqueda de texto solo se usa si Azure rechaza la consulta
+    vectorial; si el servicio está limitando o caído se propaga el error en
+    vez de lanzarle una segunda petición.
+
+    Los filtros se envían como $filter de OData y se aplican antes de la
+    búsqueda vectorial (preFilter); los campos deben ser filtrables en el
+    índice.
+    """
+
+    name = "azure"
+
+    def __init__(self, endpoint: str, index_name: str, key: str, vector_field: str = "text_vector",
+                 mode: str = "vector", hybrid_candidates: int = 50):
+        self.vector_field = vector_field
+        self.mode = mode
+        self.hybrid_candidates = hybrid_candidates
+        self.index_name = index_name
+        # El SDK (y aiohttp) solo se importan si se usa Azure Search
+        from azure.core.credentials import AzureKeyCredential
+        from azure.search.documents.aio import SearchClient as AsyncSearchClient
+
+        # Sin reintentos del SDK: los hace self.upstream
+        self.search_client = AsyncSearchClient(
+            endpoint=endpoint,
+            index_name=index_name,
+            credential=AzureKeyCredential(key),
+            retry_total=0
+        )
+        self.upstream = Upstream.from_env("search")
+
+    async def _search(self, **kwargs):
+        # La petición se hace al leer la primera página, así que se lee aquí
+        search_results = await self.search_client.search(**kwargs)
+        return [format_search_result(result) async for result in search_results]
+
+    async def search(self, query: str, query_vector, top_k: int = 3, filters=None):
+        from azure.search.documents.models import VectorizedQuery
+
+        odata = to_odata(filters)
+        if query_vector is not None:
+            try:
+                # Usar VectorizedQuery con el vector calculado
+                hybrid = self.mode == "hybrid"
+                results = await self.upstream.call(self.index_name, lambda: self._search(
+                    search_text=query if hybrid else None,
+                    top=top_k,
+                    filter=odata,
+                    vector_filter_mode="preFilter" if odata else None,
+                    vector_queries=[
+                        VectorizedQuery(
+                            vector=query_vector.tolist(),
+                            k_nearest_neighbors=max(top_k, self.hybrid_candidates) if hybrid else top_k,
+                            fields=self.vector_field
+                        )
+                    ]
+                ))
+                return results, False
+            except UpstreamError:
+                raise
+            except Exception as e:
+                print(f"Vector search failed, falling back to text search: {e}")
+                FALLBACKS.inc(kind="text_search")
+
+        # Fallback a búsqueda de texto simple
+        results = await self.upstream.call(self.index_name, lambda: self._search(search_text=query, top=top_k, filter=odata))
+        return results, query_vector is not None
+
+    async def close(self):
+        await self.search_client.close()
+
+
+def local_results(index: LocalVectorIndex, rows, scores):
+    """Lee los chunks de las filas devueltas por una búsqueda local"""
+    results = []
+    for row, score in zip(rows, scores):
+        chunk = index.get_chunk(int(row))
+        results.append({
+            "chunk_id": chunk.get("chunk_id", ""),
+            "title": chunk.get("title", ""),
+            "chunk": chunk.get("chunk", ""),
+            "score": float(score)
+        })
+    return results
+
+
+class LocalRetriever(Retriever):
+    """Búsqueda sobre un LocalVectorIndex en disco, exacta o IVF-PQ (sin servicios externos)"""
+
+    name = "local"
+
+    def __init__(self, index: LocalVectorIndex):
+        self.index = index
+
+    def _search(self, query_vector, top_k: int, filters=None):
+        rows, scores = self.index.search(query_vector, top_k, filters=filters)
+        return local_results(self.index, rows, scores)
+
+    async def search(self, query: str, query_vector, top_k: int = 3, filters=None):
+        if query_vector is None:
+            raise ValueError("Local retrieval requires a query embedding")
+
+        if self.index.count * self.index.dimensions >= LOCAL_SEARCH_THREAD_THRESHOLD:
+            return await asyncio.to_thread(self._search, query_vector, top_k, filters), False
+        return self._search(query_vector, top_k, filters), False
+
+    async def close(self):
+        self.index.close()
+
+
+class KeywordRetriever(Retriever):
+    """
+    Búsqueda BM25 sobre el índice local (no necesita embedding de la consulta).
+
+    Las filas añadidas al índice local después de construir el BM25 (ingesta
+    incremental) se indexan en memoria al arrancar, como hace la búsqueda
+    cuantizada con las filas que no tiene su copia.
+    """
+
+    name = "keyword"
+
+    def __init__(self, index: LocalVectorIndex, bm25: BM25Index):
+        self.index = index
+        self.bm25 = bm25
+        if bm25.count < index.count:
+            print(f"BM25 index covers {bm25.count} of {index.count} rows; indexing the other "
+                  f"{index.count - bm25.count} in memory. Rebuild it with: python bm25_index.py build {index.path}")
+            bm25.extend(indexed_text(index.get_chunk(row)) for row in range(bm25.count, index.count))
+
+    def _search(self, query: str, top_k: int, filters=None):
+        if filters:
+            # La máscara del filtro ya excluye las filas borradas
+            mask, _ = self.index.filter_mask(filters)
+            rows, scores = self.bm25.search(query, top_k, allowed=mask)
+        else:
+            rows, scores = self.bm25.search(query, top_k, deleted=self.index.deleted)
+        return local_results(self.index, rows, scores)
+
+    async def search(self, query: str, query_vector, top_k: int = 3, filters=None):
+        if self.bm25.count >= KEYWORD_SEARCH_THREAD_THRESHOLD:
+            return await asyncio.to_thread(self._search, query, top_k, filters), False
+        return self._search(query, top_k, filters), False
+
+
+class HybridRetriever(Retriever):
+    """
+    Combina una búsqueda vectorial y otra por palabras clave con RRF.
+
+    Las dos búsquedas se lanzan a la vez, así que la latencia es la de la más
+    lenta y no la suma. Cada una aporta candidates resultados a la fusión. Si
+    no hay embedding de la consulta, o una de las dos falla, se usa solo la
+    otra.
+    """
+
+    name = "hybrid"
+
+    def __init__(self, vector: Retriever, keyword: Retriever, candidates: int = 50, rrf_k: int = 60):
+        self.vector = vector
+        self.keyword = keyword
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    async def search(self, query: str, query_vector, top_k: int = 3, filters=None):
+        candidates = max(top_k, self.candidates)
+        if query_vector is None:
+            results, degraded = await self.keyword.search(query, None, candidates, filters)
+            return results[:top_k], degraded
+
+        vector_results, keyword_results = await asyncio.gather(
+            self.vector.search(query, query_vector, candidates, filters),
+            self.keyword.search(query, query_vector, candidates, filters),
+            return_exceptions=True
+        )
+        result_lists, degraded = [], False
+        for name, outcome in (("Vector", vector_results), ("Keyword", keyword_results)):
+            if isinstance(outcome, Exception):
+                print(f"{name} search failed in hybrid retrieval: {outcome}")
+                FALLBACKS.inc(kind=f"hybrid_{name.lower()}_failed")
+                degraded = True
+            else:
+                results, leg_degraded = outcome
+                result_lists.append(results)
+                degraded = degraded or leg_degraded
+        if not result_lists:
+            raise vector_results
+        return reciprocal_rank_fusion(result_lists, top_k, self.rrf_k), degraded
+
+    async def close(self):
+        await self.vector.close()
+
+
+def create_retriever(settings):
+    """
+    Crea el retriever indicado por RAG_RETRIEVER (azure por defecto o local).
+
+    RAG_SEARCH_MODE elige entre búsqueda vectorial (por defecto) e híbrida
+    (vectorial + palabras clave con RRF).
+    """
+    kind = os.getenv("RAG_RETRIEVER", "azure")
+    mode = os.getenv("RAG_SEARCH_MODE", "vector")
+    if mode not in ("vector", "hybrid"):
+        raise ValueError(f"Unknown RAG_SEARCH_MODE '{mode}' (expected 'vector' or 'hybrid')")
+    candidates = int(os.getenv("RAG_HYBRID_CANDIDATES", 50))
+
+    if kind == "local":
+        path = os.getenv("RAG_LOCAL_INDEX_PATH")
+        if not path:
+            raise ValueError("RAG_LOCAL_INDEX_PATH is required when RAG_RETRIEVER=local")
+        index = LocalVectorIndex(
+            path,
+            use_ann=os.getenv("RAG_ANN_ENABLED", "true") == "true",
+            nprobe=int(os.getenv("RAG_ANN_NPROBE", 16)),
+            refine=int(os.getenv("RAG_ANN_REFINE", 10)),
+            filter_exact_rows=int(os.getenv("RAG_FILTER_EXACT_ROWS", 20000)),
+            use_quantized=os.getenv("RAG_QUANTIZED_ENABLED", "true") == "true",
+            rescore=int(os.getenv("RAG_QUANTIZED_RESCORE", 10))
+        )
+        if mode == "vector":
+            return LocalRetriever(index)
+
+        bm25_path = os.path.join(path, BM25_DIR)
+        if not os.path.exists(os.path.join(bm25_path, BM25_FILE)):
+            raise ValueError(f"Hybrid search needs a BM25 index: python bm25_index.py build {path}")
+        return HybridRetriever(
+            LocalRetriever(index),
+            KeywordRetriever(index, BM25Index.load(bm25_path)),
+            candidates=candidates,
+            rrf_k=int(os.getenv("RAG_RRF_K", 60))
+        )
+
+    if kind == "azure":
+        return AzureSearchRetriever(
+            endpoint=settings["AZURE_SEARCH_SERVICE_ENDPOINT"],
+            index_name=settings["AZURE_SEARCH_INDEX"],
+            key=settings["AZURE_SEARCH_ADMIN_KEY"],
+            mode=mode,
+            hybrid_candidates=candidates
+        )
+
+    raise ValueError(f"Unknown RAG_RETRIEVER '{kind}' (expected 'azure' or 'local')")
@@ -0,0 +1,260 @@
+"""
+Enrutado de consultas entre modelos (model="auto").
+
+Cada consulta se clasifica como simple o compleja con una estimación
+barata (longitud y marcadores de razonamiento) y se envía al primer modelo
+sano de la lista de ese nivel. Un modelo está sano si en la ventana reciente
+su p95 de latencia está dentro del SLO y su tasa de errores por debajo del
+máximo; las muestras caducan, así que un modelo descartado vuelve a probarse
+pasado un tiempo.
+
+Si el modelo elegido no responde antes del plazo de cobertura (su p95 o,
+sin muestras, el SLO) se lanza la misma petición al siguiente modelo y se
+usa la primera respuesta (hedging). Si falla, se pasa directamente al
+siguiente.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from bm25_index import tokenize
+
+DEFAULT_SIMPLE_MODELS = "gpt-4o-mini,gpt-4o,grok-3"
+DEFAULT_COMPLEX_MODELS = "gpt-4o,grok-3,gpt-4o-mini"
+
+# Palabras y expresiones (sin tildes) que suelen indicar que la pregunta pide razonar o comparar
+REASONING_WORDS = {
+    "porque", "compara", "comparar", "comparacion", "diferencia", "diferencias", "explica", "explicar",
+    "analiza", "analizar", "ventajas", "desventajas", "relacion", "impacto", "afecta", "evalua", "justifica",
+    "why", "compare", "difference", "explain", "analyze", "tradeoffs", "impact",
+}
+REASONING_PHRASES = ("por que", "paso a paso", "step by step")
+
+
+def estimate_complexity(question: str) -> float:
+    """Complejidad estimada de la pregunta entre 0 y 1 (sin llamar a ningún modelo)"""
+    words = tokenize(question)
+    if not words:
+        return 0.0
+    length = min(len(words) / 40, 1.0)
+    text = f" {' '.join(words)} "
+    markers = sum(1 for word in words if word in REASONING_WORDS)
+    markers += sum(1 for phrase in REASONING_PHRASES if f" {phrase} " in text)
+    markers = min(markers / 2, 1.0)
+    parts = min((question.count("?") + question.count(";")) / 3, 1.0)
+    return round(0.5 * length + 0.35 * markers + 0.15 * parts, 3)
+
+
+class ModelStats:
+    """Latencias y errores recientes de un modelo (ventana de window segundos)"""
+
+    def __init__(self, window: float = 300.0, max_samples: int = 200):
+        self.window = window
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self.cancelled = 0
+
+    def record(self, latency_ms: float, ok: bool):
+        with self._lock:
+            self._samples.append((time.monotonic(), latency_ms, ok))
+
+    def record_cancelled(self):
+        with self._lock:
+            self.cancelled += 1
+
+    def snapshot(self):
+        """(latencias de las respuestas correctas, número de muestras, tasa de errores)"""
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            samples = list(self._samples)
+        latencies = np.array([latency for _, latency, ok in samples if ok], dtype=np.float64)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        return latencies, len(samples), errors / len(samples) if samples else 0.0
+
+
+class ModelRouter:
+    def __init__(self, simple_models, complex_models, slo_ms: float = 8000.0, hedge_ms: float = 0.0,
+                 complexity_threshold: float = 0.4, max_error_rate: float = 0.2, min_samples: int = 5,
+                 max_attempts: int = 2, window: float = 300.0):
+        self.tiers = {"simple": list(simple_models), "complex": list(complex_models)}
+        self.slo_ms = slo_ms
+        self.hedge_ms = hedge_ms
+        self.complexity_threshold = complexity_threshold
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.max_attempts = max_attempts
+        self.window = window
+        self._stats = {}
+
+    @classmethod
+    def from_env(cls):
+        def models(name, default):
+            return [model.strip() for model in os.getenv(name, default).split(",") if model.strip()]
+
+        return cls(
+            simple_models=models("RAG_ROUTER_SIMPLE_MODELS", DEFAULT_SIMPLE_MODELS),
+            complex_models=models("RAG_ROUTER_COMPLEX_MODELS", DEFAULT_COMPLEX_MODELS),
+            slo_ms=float(os.getenv("RAG_ROUTER_SLO_MS", 8000)),
+            hedge_ms=float(os.getenv("RAG_ROUTER_HEDGE_MS", 0)),
+            complexity_threshold=float(os.getenv("RAG_ROUTER_COMPLEXITY_THRESHOLD", 0.4)),
+            max_error_rate=float(os.getenv("RAG_ROUTER_MAX_ERROR_RATE", 0.2)),
+            max_attempts=int(os.getenv("RAG_ROUTER_MAX_ATTEMPTS", 2)),
+            window=float(os.getenv("RAG_ROUTER_WINDOW_SECONDS", 300))
+        )
+
+    def stats_for(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats.setdefault(model, ModelStats(self.window))
+        return stats
+
+    def health(self, model: str):
+        latencies, samples, error_rate = self.stats_for(model).snapshot()
+        p95 = float(np.percentile(latencies, 95)) if len(latencies) else None
+        healthy = samples < self.min_samples or (
+            error_rate <= self.max_error_rate and (p95 is None or p95 <= self.slo_ms)
+        )
+        return {"samples": samples, "p95_ms": p95, "error_rate": error_rate, "healthy": healthy}
+
+    def choose(self, question: str):
+        """Decide el modelo de una consulta; devuelve la decisión con los candidatos en orden"""
+        complexity = estimate_complexity(question)
+        tier = "complex" if complexity >= self.complexity_threshold else "simple"
+        health = {model: self.health(model) for model in self.tiers[tier]}
+
+        # Primero los sanos en el orden de preferencia; después el resto, de menos a más lento
+        healthy = [model for model in self.tiers[tier] if health[model]["healthy"]]
+        degraded = sorted(
+            (model for model in self.tiers[tier] if not health[model]["healthy"]),
+            key=lambda model: (health[model]["error_rate"] > self.max_error_rate, health[model]["p95_ms"] or 0.0)
+        )
+        candidates = healthy + degraded
+        return {
+            "requested": "auto",
+            "model": candidates[0],
+            "tier": tier,
+            "complexity": complexity,
+            "candidates": candidates,
+            "reason": "preferred" if candidates[0] == self.tiers[tier][0] else (
+                "fallback" if healthy else "all_degraded"
+            ),
+            "hedged": False,
+            "failover": False,
+            "attempts": [],
+        }
+
+    def hedge_delay(self, model: str) -> float:
+        """Segundos que se espera al modelo antes de lanzar la petición de respaldo"""
+        if self.hedge_ms > 0:
+            return self.hedge_ms / 1000
+        p95 = self.health(model)["p95_ms"]
+        return min(p95 if p95 is not None else self.slo_ms, self.slo_ms) / 1000
+
+    def record(self, model: str, latency_ms: float, ok: bool):
+        """Anota una llamada hecha fuera de call (las respuestas en streaming)"""
+        self.stats_for(model).record(latency_ms, ok)
+
+    def record_cancelled(self, model: str):
+        self.stats_for(model).record_cancelled()
+
+    async def call(self, model: str, request):
+        """Ejecuta request(model) anotando su latencia y si ha fallado"""
+        start = time.perf_counter()
+        try:
+            response = await request(model)
+        except asyncio.CancelledError:
+            # Cancelada porque respondió antes otro modelo: el tiempo hasta cancelarla no es su
+            # latencia y bajaría el p95 justo de los modelos lentos, así que solo se cuenta
+            self.record_cancelled(model)
+            raise
+        except Exception:
+            self.record(model, (time.perf_counter() - start) * 1000, ok=False)
+            raise
+        self.record(model, (time.perf_counter() - start) * 1000, ok=True)
+        return response
+
+    async def complete(self, decision, request):
+        """
+        Ejecuta request(model) según la decisión de choose, con cobertura y failover.
+
+        Devuelve (respuesta, decisión) con el modelo que respondió y los
+        intentos realizados.
+        """
+        candidates = decision["candidates"][:max(1, self.max_attempts)]
+        pending = {}
+        started = {}
+        launched = 0
+        last_error = None
+
+        def launch():
+            nonlocal launched
+            model = candidates[launched]
+            launched += 1
+            task = asyncio.create_task(self.call(model, request))
+            pending[task] = model
+            started[model] = time.perf_counter()
+
+        def attempt(model, status):
+            decision["attempts"].append({
+                "model": model,
+                "status": status,
+                "latency_ms": round((time.perf_counter() - started[model]) * 1000, 3),
+            })
+
+        launch()
+        try:
+            while pending:
+                can_hedge = not decision["hedged"] and launched < len(candidates) and len(pending) == 1
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay(candidates[0]) if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    decision["hedged"] = True
+                    launch()
+                    continue
+
+                for task in done:
+                    model = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        last_error = e
+                        attempt(model, "error")
+                        print(f"Model {model} failed, trying the next one: {e}")
+                        if not pending and launched < len(candidates):
+                            decision["failover"] = True
+                            launch()
+                        continue
+                    attempt(model, "ok")
+                    decision["model"] = model
+                    return response, decision
+            raise last_error
+        finally:
+            for task, model in pending.items():
+                task.cancel()
+                attempt(model, "cancelled")
+
+    def stats(self):
+        models = dict.fromkeys(self.tiers["simple"] + self.tiers["complex"])
+        models.update(dict.fromkeys(self._stats))
+        result = {}
+        for model in models:
+            latencies, samples, error_rate = self.stats_for(model).snapshot()
+            result[model] = {
+                "samples": samples,
+                "p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+                "p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+                "error_rate": round(error_rate, 3),
+                "cancelled": self.stats_for(model).cancelled,
+                "healthy": self.health(model)["healthy"],
+            }
+        return {"slo_ms": self.slo_ms, "tiers": self.tiers, "models": result}
@@ -0,0 +1,272 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from filters import filters_key
+
+
+class SQLiteAnswerStore:
+    """
+    Respuestas de la caché semántica compartidas entre procesos en SQLite (WAL).
+
+    Cada worker escribe aquí las respuestas que genera y lee periódicamente
+    las filas nuevas de los demás, que añade a su matriz en memoria. Las filas
+    tienen id creciente, así que leer las novedades es una consulta por rango.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                vector BLOB NOT NULL,
+                payload TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_created_at ON answers (created_at)")
+        self._conn.commit()
+
+    def put(self, scope: int, created_at: float, vector: np.ndarray, payload) -> int:
+        """Guarda una respuesta y devuelve su id"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (scope, created_at, vector, payload) VALUES (?, ?, ?, ?)",
+                (scope, created_at, vector.astype(np.float32).tobytes(), json.dumps(payload, ensure_ascii=False))
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def since(self, last_id: int, min_created_at: float, limit: int):
+        """Filas (id, scope, created_at, vector, payload) posteriores a last_id y no caducadas"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, scope, created_at, vector, payload FROM answers "
+                "WHERE id > ? AND created_at >= ? ORDER BY id LIMIT ?",
+                (last_id, min_created_at, limit)
+            ).fetchall()
+        return [
+            (row_id, scope, created_at, np.frombuffer(blob, dtype=np.float32), json.loads(payload))
+            for row_id, scope, created_at, blob, payload in rows
+        ]
+
+    def last_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM answers").fetchone()[0]
+
+    def purge_expired(self, ttl_seconds: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - ttl_seconds,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SemanticAnswerCache:
+    """
+    Caché de respuestas por similitud semántica de la pregunta.
+
+    Las preguntas se guardan como filas normalizadas de una matriz float32, de
+    modo que la búsqueda es un único producto matriz-vector en NumPy. Solo se
+    reutiliza una respuesta si el modelo, la temperatura, el contexto y los
+    filtros coinciden y la similitud coseno supera el umbral. Cuando la caché está
+    llena se expulsa la entrada usada hace más tiempo.
+
+    Con shared_store (SQLiteAnswerStore) las respuestas se comparten entre
+    workers: antes de buscar se incorporan las filas nuevas del store, como
+    mucho cada sync_interval segundos.
+    """
+
+    def __init__(self, max_entries: int = 20000, threshold: float = 0.96, ttl_seconds: float = 3600,
+                 shared_store: SQLiteAnswerStore = None, sync_interval: float = 1.0):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.shared_store = shared_store
+        self.sync_interval = sync_interval
+        self._last_sync = 0.0
+        self._last_id = 0
+        self._own_ids = set()
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._scopes = np.zeros(0, dtype=np.int64)
+        self._expires_at = np.zeros(0, dtype=np.float64)
+        self._last_used = np.zeros(0, dtype=np.float64)
+        self._payloads = []
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.synced = 0
+        if shared_store is not None:
+            shared_store.purge_expired(ttl_seconds)
+
+    @classmethod
+    def from_env(cls):
+        """Crea la caché a partir de las variables RAG_SEMANTIC_CACHE_*"""
+        path = os.getenv("RAG_SEMANTIC_CACHE_PATH")
+        return cls(
+            max_entries=int(os.getenv("RAG_SEMANTIC_CACHE_SIZE", 20000)),
+            threshold=float(os.getenv("RAG_SEMANTIC_CACHE_THRESHOLD", 0.96)),
+            ttl_seconds=float(os.getenv("RAG_SEMANTIC_CACHE_TTL", 3600)),
+            shared_store=SQLiteAnswerStore(path) if path else None,
+            sync_interval=float(os.getenv("RAG_SEMANTIC_CACHE_SYNC_INTERVAL", 1.0)),
+        )
+
+    @staticmethod
+    def make_scope(model: str, temperature: float, context: str = None, filters=None) -> int:
+        """Identificador de los parámetros que deben coincidir para reutilizar una respuesta"""
+        payload = f"{model}\x00{temperature:.4f}\x00{context or ''}"
+        if filters:
+            payload += f"\x00{filters_key(filters)}"
+        payload = payload.encode("utf-8")
+        return int.from_bytes(hashlib.sha1(payload).digest()[:8], "little", signed=True)
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector, model: str, temperature: float, context: str = None, filters=None):
+        """Devuelve la respuesta cacheada más similar (con su similitud) o None"""
+        if self.max_entries <= 0:
+            return None
+
+        query = self._normalize(vector)
+        scope = self.make_scope(model, temperature, context, filters)
+        now = time.time()
+        self.sync(now)
+
+        with self._lock:
+            n = self._size
+            if n == 0:
+                self.misses += 1
+                return None
+
+            scores = self._vectors[:n] @ query
+            valid = (self._scopes[:n] == scope) & (self._expires_at[:n] > now)
+            scores = np.where(valid, scores, -np.inf)
+            best = int(np.argmax(scores))
+
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._last_used[best] = now
+            self.hits += 1
+            payload = copy.deepcopy(self._payloads[best])
+
+        payload["similarity"] = float(scores[best])
+        return payload
+
+    def store(self, vector, model: str, temperature: float, context: str, answer: str, sources, filters=None):
+        """Guarda una respuesta generada para la pregunta representada por vector"""
+        if self.max_entries <= 0:
+            return
+
+        query = self._normalize(vector)
+        scope = self.make_scope(model, temperature, context, filters)
+        payload = {"answer": answer, "sources": copy.deepcopy(sources)}
+        now = time.time()
+        self._insert(query, scope, now, payload)
+
+        if self.shared_store is not None:
+            row_id = self.shared_store.put(scope, now, query, payload)
+            with self._lock:
+                self._own_ids.add(row_id)
+
+    def sync(self, now: float = None):
+        """Incorpora las respuestas que otros workers han guardado en shared_store"""
+        if self.shared_store is None:
+            return
+        now = now or time.time()
+        if now - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = now
+
+        rows = self.shared_store.since(self._last_id, now - self.ttl_seconds, self.max_entries)
+        for row_id, scope, created_at, vector, payload in rows:
+            self._last_id = max(self._last_id, row_id)
+            with self._lock:
+                own = row_id in self._own_ids
+                self._own_ids.discard(row_id)
+            if not own:
+                self._insert(vector, scope, created_at, payload)
+                self.synced += 1
+
+    def _insert(self, query, scope: int, created_at: float, payload):
+        with self._lock:
+            slot = self._free_slot(query.shape[0], time.time())
+            self._vectors[slot] = query
+            self._scopes[slot] = scope
+            self._expires_at[slot] = created_at + self.ttl_seconds
+            self._last_used[slot] = created_at
+            self._payloads[slot] = payload
+
+    def _free_slot(self, dimensions: int, now: float) -> int:
+        if self._vectors is None:
+            capacity = min(self.max_entries, 1024)
+            self._vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+            self._scopes = np.zeros(capacity, dtype=np.int64)
+            self._expires_at = np.zeros(capacity, dtype=np.float64)
+            self._last_used = np.zeros(capacity, dtype=np.float64)
+            self._payloads = [None] * capacity
+
+        if self._size < self.max_entries:
+            if self._size == self._vectors.shape[0]:
+                self._grow(min(self.max_entries, self._size * 2))
+            self._size += 1
+            return self._size - 1
+
+        # Reutilizar primero las entradas caducadas y si no la menos usada
+        n = self._size
+        expired = np.flatnonzero(self._expires_at[:n] <= now)
+        if expired.size:
+            return int(expired[0])
+        self.evictions += 1
+        return int(np.argmin(self._last_used[:n]))
+
+    def _grow(self, capacity: int):
+        extra = capacity - self._vectors.shape[0]
+        self._vectors = np.vstack([self._vectors, np.zeros((extra, self._vectors.shape[1]), dtype=np.float32)])
+        self._scopes = np.concatenate([self._scopes, np.zeros(extra, dtype=np.int64)])
+        self._expires_at = np.concatenate([self._expires_at, np.zeros(extra, dtype=np.float64)])
+        self._last_used = np.concatenate([self._last_used, np.zeros(extra, dtype=np.float64)])
+        self._payloads.extend([None] * extra)
+
+    def stats(self):
+        """Contadores de aciertos y fallos de la caché"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": self._size,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self.shared_store is not None,
+                "synced": self.synced,
+            }
+
+    def close(self):
+        if self.shared_store is not None:
+            self.shared_store.close()
@@ -0,0 +1,323 @@
+"""
+Sesiones de conversación con historial en el servidor.
+
+Cada sesión guarda los últimos mensajes y un resumen de los turnos
+anteriores. Cuando los mensajes superan history_tokens, los más antiguos se
+resumen hasta dejar la mitad del presupuesto, de modo que la parte del
+prompt dedicada al historial (resumen + turnos recientes) tiene un tamaño
+acotado por largo que sea la conversación.
+
+Las sesiones viven en un LRU en memoria con caducidad por inactividad y,
+opcionalmente, en SQLite para que sobrevivan a los reinicios y las
+compartan los workers.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from bm25_index import tokenize
+
+REWRITE_PROMPT = (
+    "Rewrite the user's last question as a standalone search query for a document search engine. "
+    "Resolve pronouns and references using the conversation. Keep the language of the question. "
+    "Return only the query."
+)
+SUMMARY_PROMPT = (
+    "Update the summary of the conversation with the new turns. Keep the facts, names, figures and "
+    "the user's goals that later questions may refer to. Write at most {words} words and return only "
+    "the summary."
+)
+
+
+class SQLiteSessionStore:
+    """Almacenamiento persistente de sesiones en SQLite (una fila JSON por sesión)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, session_id: str, ttl_seconds: float = None):
+        """Devuelve la sesión guardada o None si no existe o ha caducado"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at, data FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        updated_at, data = row
+        if ttl_seconds and time.time() - updated_at > ttl_seconds:
+            return None
+        return json.loads(data)
+
+    def put(self, session):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, updated_at, data) VALUES (?, ?, ?)",
+                (session["id"], session["updated_at"], json.dumps(session, ensure_ascii=False))
+            )
+            self._conn.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+
+    def purge_expired(self, ttl_seconds: float):
+        """Elimina las sesiones caducadas"""
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - ttl_seconds,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SessionStore:
+    """
+    Sesiones en un LRU acotado a max_sessions, con caducidad por inactividad.
+
+    Una sesión es un dict con id, summary (resumen de los turnos ya
+    compactados), messages (turnos recientes como mensajes de chat),
+    summarized_turns y updated_at. Si hay store persistente, las sesiones se
+    leen siempre de SQLite (así las comparten los workers) y cada cambio se
+    escribe ahí.
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 86400, history_tokens: int = 1500,
+                 summary_tokens: int = 300, store: SQLiteSessionStore = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.store = store
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.compactions = 0
+        if store is not None and ttl_seconds:
+            # Las caducadas solo se saltaban al leerlas: se borran al abrir el store
+            store.purge_expired(ttl_seconds)
+
+    @classmethod
+    def from_env(cls):
+        """Crea el almacén a partir de las variables RAG_SESSION_*"""
+        path = os.getenv("RAG_SESSION_STORE_PATH")
+        return cls(
+            max_sessions=int(os.getenv("RAG_SESSION_MAX", 1000)),
+            ttl_seconds=float(os.getenv("RAG_SESSION_TTL", 86400)),
+            history_tokens=int(os.getenv("RAG_SESSION_HISTORY_TOKENS", 1500)),
+            summary_tokens=int(os.getenv("RAG_SESSION_SUMMARY_TOKENS", 300)),
+            store=SQLiteSessionStore(path) if path else None,
+        )
+
+    def create(self):
+        session = {
+            "id": uuid.uuid4().hex,
+            "summary": "",
+            "messages": [],
+            "summarized_turns": 0,
+            "updated_at": time.time(),
+        }
+        with self._lock:
+            self.created += 1
+        self.save(session)
+        return session
+
+    def get(self, session_id: str):
+        """Devuelve la sesión o None si no existe o ha caducado"""
+        if self.store is not None:
+            # Con varios workers otro proceso puede haberla cambiado: manda el store
+            session = self.store.get(session_id, self.ttl_seconds)
+            if session is not None:
+                self._remember(session)
+                return session
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            return None
+
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if now - session["updated_at"] <= self.ttl_seconds:
+                    self._sessions.move_to_end(session_id)
+                    return session
+                del self._sessions[session_id]
+                self.expired += 1
+        return None
+
+    def get_or_create(self, session_id: str = None):
+        """Sesión con ese id; si no existe (o id es 'new') se abre una nueva con otro id"""
+        session = self.get(session_id) if session_id and session_id != "new" else None
+        if session is None:
+            if session_id and session_id != "new":
+                print(f"Session {session_id} not found or expired, starting a new one")
+            session = self.create()
+        return session
+
+    def append(self, session, user_question: str, answer: str):
+        """Añade un turno (pregunta y respuesta) a la sesión"""
+        session["messages"].append({"role": "user", "content": user_question})
+        session["messages"].append({"role": "assistant", "content": answer})
+        self.save(session)
+
+    def save(self, session):
+        session["updated_at"] = time.time()
+        self._remember(session)
+        if self.store is not None:
+            self.store.put(session)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            found = self._sessions.pop(session_id, None) is not None
+        if self.store is not None:
+            found = found or self.store.get(session_id) is not None
+            self.store.delete(session_id)
+        return found
+
+    def _remember(self, session):
+        with self._lock:
+            self._sessions[session["id"]] = session
+            self._sessions.move_to_end(session["id"])
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def history(self, session, counter):
+        """
+        Mensajes del historial que entran en el prompt.
+
+        Los turnos más recientes que quepan en history_tokens; si la sesión
+        aún no se ha compactado y se pasa, los más antiguos se quedan fuera
+        hasta que se resuman.
+        """
+        budget = self.history_tokens
+        selected = []
+        for message in reversed(session["messages"]):
+            budget -= counter.count_messages([message])
+            if budget < 0:
+                break
+            selected.append(message)
+        selected.reverse()
+        # El historial empieza siempre por una pregunta del usuario
+        while selected and selected[0]["role"] != "user":
+            selected.pop(0)
+        return selected
+
+    def needs_compaction(self, session, counter) -> bool:
+        return counter.count_messages(session["messages"]) > self.history_tokens
+
+    def split_for_compaction(self, session, counter):
+        """
+        Divide los mensajes en (a resumir, a conservar).
+
+        Se conservan los turnos más recientes que quepan en la mitad de
+        history_tokens, para no tener que resumir en cada turno.
+        """
+        budget = self.history_tokens // 2
+        keep = len(session["messages"])
+        while keep >= 2:
+            budget -= counter.count_messages(session["messages"][keep - 2:keep])
+            if budget < 0:
+                break
+            keep -= 2
+        return session["messages"][:keep], session["messages"][keep:]
+
+    def compact(self, session, folded, summary: str):
+        """Sustituye los mensajes resumidos por el nuevo resumen"""
+        # Mientras se resumía pudieron llegar más turnos (quizá a otro worker): se parte de la versión actual
+        session = self.get(session["id"])
+        if session is not None and session["messages"][:len(folded)] == folded:
+            session["messages"] = session["messages"][len(folded):]
+            session["summary"] = summary
+            session["summarized_turns"] += len(folded) // 2
+            with self._lock:
+                self.compactions += 1
+            self.save(session)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "history_tokens": self.history_tokens,
+                "summary_tokens": self.summary_tokens,
+                "created": self.created,
+                "expired": self.expired,
+                "compactions": self.compactions,
+                "persistent": self.store is not None,
+            }
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+def transcript(summary: str, messages) -> str:
+    """Texto de la conversación para los prompts de reescritura y resumen"""
+    lines = [f"Summary of earlier conversation: {summary}"] if summary else []
+    for message in messages:
+        speaker = "User" if message["role"] == "user" else "Assistant"
+        lines.append(f"{speaker}: {message['content']}")
+    return "\n".join(lines)
+
+
+def rewrite_messages(session, user_question: str, max_turns: int = 3):
+    """Mensajes para condensar la pregunta y los últimos max_turns turnos en una consulta independiente"""
+    recent = session["messages"][-2 * max_turns:] if max_turns > 0 else []
+    return [
+        {"role": "system", "content": REWRITE_PROMPT},
+        {"role": "user", "content": f"{transcript(session['summary'], recent)}\n\nLast question: {user_question}"},
+    ]
+
+
+def summary_messages(summary: str, folded, max_tokens: int):
+    """Mensajes para incorporar los turnos folded al resumen de la sesión"""
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT.format(words=max(20, int(max_tokens * 0.75)))},
+        {"role": "user", "content": transcript(summary, folded)},
+    ]
+
+
+def heuristic_rewrite(session, user_question: str, min_words: int = 8) -> str:
+    """
+    Consulta independiente sin llamar al modelo.
+
+    Las preguntas cortas ("¿y el precio?") suelen depender de la anterior,
+    así que se les antepone la última pregunta del usuario.
+    """
+    if len(tokenize(user_question)) >= min_words:
+        return user_question
+    previous = next((m["content"] for m in reversed(session["messages"]) if m["role"] == "user"), None)
+    return f"{previous} {user_question}" if previous else user_question
+
+
+def heuristic_summary(summary: str, folded, max_tokens: int, counter) -> str:
+    """Resumen sin llamar al modelo: las preguntas del usuario, recortando por el principio"""
+    parts = [summary] if summary else []
+    parts += [f"User asked: {m['content']}" for m in folded if m["role"] == "user"]
+    while len(parts) > 1 and counter.count(" ".join(parts)) > max_tokens:
+        parts.pop(0)
+    text = " ".join(parts)
+    # Una sola pregunta muy larga se corta (aprox. 4 caracteres por token)
+    return text if counter.count(text) <= max_tokens else text[-max_tokens * 4:]
@@ -0,0 +1,53 @@
+import asyncio
+
+from metrics import COALESCED
+
+
+class SingleFlight:
+    """
+    Agrupa las llamadas concurrentes con la misma clave.
+
+    La primera llamada con una clave lanza la operación en una tarea y las
+    que llegan mientras sigue en curso esperan esa misma tarea en vez de
+    repetirla. Todas reciben el mismo resultado (o la misma excepción). La
+    tarea se protege con asyncio.shield, así que si el cliente que la lanzó
+    se desconecta el resto sigue esperando su resultado.
+    """
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self._inflight = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, operation):
+        """Devuelve (resultado, compartido): compartido es True si se reutilizó una llamada en curso"""
+        if not self.enabled:
+            return await operation(), False
+
+        self.calls += 1
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+            COALESCED.inc(kind=self.name)
+        else:
+            task = asyncio.ensure_future(operation())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        # Marca la excepción como leída por si ya no queda nadie esperando
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": len(self._inflight),
+        }
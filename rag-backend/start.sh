@@ -1,4 +1,6 @@
 #!/bin/bash
 # Script de inicio para Railway
 echo "Starting RAG Backend on port ${PORT:-8000}"
-exec uvicorn main:app --host 0.0.0.0 --port ${PORT:-8000}
\ No newline at end of file
+# WEB_CONCURRENCY: número de workers (procesos) de uvicorn
+echo "Workers: ${WEB_CONCURRENCY:-1}"
+exec uvicorn main:app --host 0.0.0.0 --port ${PORT:-8000} --workers ${WEB_CONCURRENCY:-1}
\ No newline at end of file
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Pruebas del índice local (sin servicios externos).
+
+Uso:
+    python -m pytest test_local_index.py
+    python test_local_index.py
+"""
+
+import gc
+import tempfile
+import zlib
+
+import numpy as np
+
+from local_index import LocalIndexWriter, LocalVectorIndex
+
+
+def vectors_for(names, dimensions=8):
+    """Un vector distinto por nombre, estable entre ejecuciones"""
+    return [np.random.default_rng(zlib.crc32(name.encode())).standard_normal(dimensions) for name in names]
+
+
+def test_append_after_failed_append():
+    """Una actualización que falla sin cerrar el escritor no desplaza las filas de la siguiente"""
+    with tempfile.TemporaryDirectory() as path:
+        names = ["A0", "A1", "A2"]
+        with LocalIndexWriter(path, 8) as writer:
+            writer.add([{"chunk_id": name, "crop": "maize"} for name in names], vectors_for(names))
+
+        failed = LocalIndexWriter(path, 8, append=True)
+        failed.add([{"chunk_id": "B0-failed", "crop": "wheat"}], vectors_for(["B0-failed"]))
+        # La ingesta se interrumpe: los ficheros quedan con la fila escrita pero sin cabecera nueva
+        del failed
+        gc.collect()
+
+        with LocalIndexWriter(path, 8, append=True) as writer:
+            writer.add([{"chunk_id": "B0", "crop": "rice"}], vectors_for(["B0"]))
+
+        index = LocalVectorIndex(path)
+        assert index.count == 4
+        assert [index.get_chunk(row)["chunk_id"] for row in range(index.count)] == names + ["B0"]
+        rows, scores = index.search(vectors_for(["B0"])[0], top_k=1)
+        assert index.get_chunk(int(rows[0]))["chunk_id"] == "B0"
+        assert np.isclose(scores[0], 1.0)
+        rows, _ = index.search(vectors_for(["B0"])[0], top_k=4, filters={"crop": "rice"})
+        assert [index.get_chunk(int(row))["chunk_id"] for row in rows] == ["B0"]
+        index.close()
+
+
+if __name__ == "__main__":
+    test_append_after_failed_append()
+    print("✅ test_local_index OK")
@@ -0,0 +1,41 @@
+import time
+from contextlib import contextmanager
+
+from tracing import span
+
+
+class StageTimer:
+    """
+    Mide la duración de las etapas de una petición.
+
+        timer = StageTimer()
+        with timer.stage("retrieve"):
+            ...
+        timer.timings  # {"retrieve": 12.3} en milisegundos
+
+    Una etapa que se repite acumula su tiempo. Si las trazas están activadas
+    (ver tracing.py) cada etapa es además un span.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            with span(f"rag.{name}"):
+                yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name: str, milliseconds: float):
+        self.timings[name] = round(self.timings.get(name, 0.0) + milliseconds, 3)
+
+    def total(self):
+        """Milisegundos desde que se creó el timer"""
+        return round((time.perf_counter() - self.start) * 1000, 3)
+
+    def as_dict(self):
+        return dict(self.timings, total=self.total())
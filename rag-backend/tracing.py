@@ -0,0 +1,67 @@
+"""
+Trazas OpenTelemetry opcionales (RAG_OTEL_ENABLED=true).
+
+Usa los paquetes que instala azure-ai-inference[opentelemetry]
+(opentelemetry-api/sdk y azure-core-tracing-opentelemetry): además de los
+spans de cada etapa del servicio, el SDK de Azure Search emite sus propios
+spans como hijos. Las trazas se envían por OTLP si OTEL_EXPORTER_OTLP_ENDPOINT
+está definida (requiere opentelemetry-exporter-otlp) y si no se escriben en
+consola.
+"""
+
+import logging
+import os
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+
+
+def setup_tracing(service_name: str = "rag-backend"):
+    """Configura el TracerProvider global; devuelve el tracer o None si está desactivado"""
+    global _tracer
+    if os.getenv("RAG_OTEL_ENABLED", "false") != "true":
+        return None
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        logger.warning("RAG_OTEL_ENABLED is set but OpenTelemetry is not installed: "
+                       "pip install azure-ai-inference[opentelemetry]")
+        return None
+
+    provider = TracerProvider(resource=Resource.create({
+        "service.name": os.getenv("OTEL_SERVICE_NAME", service_name)
+    }))
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter()
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+    # Spans de los SDK de Azure (Azure Search)
+    try:
+        from azure.core.settings import settings
+        settings.tracing_implementation = "opentelemetry"
+    except Exception as e:
+        logger.warning(f"Azure SDK tracing not enabled: {e}")
+
+    _tracer = trace.get_tracer(service_name)
+    logger.info("OpenTelemetry tracing enabled")
+    return _tracer
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Span con ese nombre si las trazas están activadas (si no, no hace nada)"""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
@@ -0,0 +1,220 @@
+"""
+Registro de consultas frecuentes y precalentamiento de las cachés.
+
+QueryLog cuenta cuántas veces llega cada consulta (normalizada). Al arrancar
+(y, si se configura, cada cierto tiempo) Warmup toma las N más frecuentes y
+calcula sus embeddings y resultados de búsqueda para dejarlos en la caché de
+embeddings y en la de recuperación. Se ejecuta en segundo plano: el servidor
+atiende peticiones mientras tanto y el progreso se ve en /health.
+
+Para que el registro sobreviva a los despliegues hay que guardarlo en SQLite
+(RAG_QUERY_LOG_PATH); las cuentas se acumulan en memoria y se escriben por
+lotes para no tocar el disco en cada petición.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from embedding_cache import normalize_text
+
+
+class QueryLog:
+    def __init__(self, path: str = None, max_entries: int = 10000, flush_every: int = 100):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self._counts = Counter()
+        self._texts = {}
+        self._pending = Counter()
+        self._unflushed = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_log (
+                    key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    last_seen REAL NOT NULL
+                )
+                """
+            )
+            self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """Crea el registro a partir de las variables RAG_QUERY_LOG_*"""
+        return cls(
+            path=os.getenv("RAG_QUERY_LOG_PATH"),
+            max_entries=int(os.getenv("RAG_QUERY_LOG_SIZE", 10000)),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def record(self, query: str):
+        """Cuenta una aparición de la consulta"""
+        if not self.enabled:
+            return
+        key = normalize_text(query)
+        if not key:
+            return
+        with self._lock:
+            self._counts[key] += 1
+            self._texts[key] = query
+            if self._conn is not None:
+                self._pending[key] += 1
+                self._unflushed += 1
+            if len(self._counts) > 2 * self.max_entries:
+                # Se olvidan las consultas poco frecuentes
+                self._counts = Counter(dict(self._counts.most_common(self.max_entries)))
+                self._texts = {key: self._texts[key] for key in self._counts}
+            flush = self._unflushed >= self.flush_every
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Escribe en SQLite las cuentas acumuladas desde la última vez"""
+        if self._conn is None:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._unflushed = 0
+            rows = [(key, self._texts.get(key, key), count, time.time()) for key, count in pending.items()]
+            if rows:
+                self._conn.executemany(
+                    """
+                    INSERT INTO query_log (key, query, count, last_seen) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        query = excluded.query,
+                        count = count + excluded.count,
+                        last_seen = excluded.last_seen
+                    """,
+                    rows
+                )
+                self._conn.commit()
+
+    def top(self, n: int):
+        """Las n consultas más frecuentes (texto original más reciente), de más a menos"""
+        if self._conn is None:
+            with self._lock:
+                return [self._texts[key] for key, _ in self._counts.most_common(n)]
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT query FROM query_log ORDER BY count DESC, last_seen DESC LIMIT ?", (n,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "tracked": len(self._counts),
+                "persistent": self._conn is not None,
+            }
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+
+class Warmup:
+    """Precalentamiento de las cachés con las consultas más frecuentes de QueryLog"""
+
+    def __init__(self, query_log: QueryLog, top_n: int = 100, interval_seconds: float = 0,
+                 concurrency: int = 4, top_k: int = 3):
+        self.query_log = query_log
+        self.top_n = top_n
+        self.interval_seconds = interval_seconds
+        self.concurrency = concurrency
+        self.top_k = top_k
+        self.state = "idle"
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.runs = 0
+        self.started_at = None
+        self.duration_ms = None
+        self.error = None
+
+    @classmethod
+    def from_env(cls, query_log: QueryLog):
+        """Crea el precalentamiento a partir de las variables RAG_WARMUP_*"""
+        return cls(
+            query_log,
+            top_n=int(os.getenv("RAG_WARMUP_TOP_N", 100)),
+            interval_seconds=float(os.getenv("RAG_WARMUP_INTERVAL", 0)),
+            concurrency=int(os.getenv("RAG_WARMUP_CONCURRENCY", 4)),
+        )
+
+    async def run(self, service):
+        """Calcula embeddings y resultados de búsqueda de las consultas frecuentes"""
+        queries = self.query_log.top(self.top_n) if self.top_n > 0 else []
+        self.state = "running"
+        self.total, self.completed, self.failed = len(queries), 0, 0
+        self.started_at = time.time()
+        self.error = None
+        start = time.perf_counter()
+        try:
+            if queries:
+                # Todos los embeddings en una llamada; después las búsquedas en paralelo
+                try:
+                    vectors = await service.get_embeddings(queries)
+                except Exception as e:
+                    print(f"Warm-up embedding failed, searching without vectors: {e}")
+                    vectors = [None] * len(queries)
+
+                semaphore = asyncio.Semaphore(self.concurrency)
+
+                async def warm(query, vector):
+                    async with semaphore:
+                        try:
+                            await service.search_documents(query, self.top_k, query_vector=vector, use_cache=False)
+                            self.completed += 1
+                        except Exception as e:
+                            self.failed += 1
+                            print(f"Warm-up search failed for {query!r}: {e}")
+
+                await asyncio.gather(*(warm(query, vector) for query, vector in zip(queries, vectors)))
+            self.state = "done"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"Warm-up failed: {e}")
+        finally:
+            self.runs += 1
+            self.duration_ms = round((time.perf_counter() - start) * 1000, 3)
+        if queries:
+            print(f"Warm-up finished: {self.completed}/{self.total} queries in {self.duration_ms} ms")
+
+    async def run_forever(self, service):
+        """Primer precalentamiento al arrancar y, con interval_seconds, uno periódico"""
+        while True:
+            await self.run(service)
+            if self.interval_seconds <= 0:
+                return
+            await asyncio.sleep(self.interval_seconds)
+
+    def progress(self):
+        return {
+            "state": self.state,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "runs": self.runs,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+        }
@@ -41,6 +41,9 @@ export class AppComponent implements OnInit {
   messages: ChatMessage[] = [];
   currentMessage = "";
   isLoading = false;
+  isStreaming = false;
+  // Sesión de conversación en el backend (el historial se guarda allí)
+  sessionId = "new";
 
   parameters: ChatParameters = {
     model: "gpt-4o-mini",
@@ -62,7 +65,7 @@ export class AppComponent implements OnInit {
   }
 
   sendMessage() {
-    if (!this.currentMessage.trim() || this.isLoading) {
+    if (!this.currentMessage.trim() || this.isLoading || this.isStreaming) {
       return;
     }
 
@@ -88,28 +91,43 @@ export class AppComponent implements OnInit {
       model: this.parameters.model,
       temperature: this.parameters.temperature,
       context: this.parameters.context,
+      sessionId: this.sessionId,
     };
 
     if (!request.context) {
       delete request.context;
     }
 
-    // Send to RAG service
-    this.ragService.queryRAG(request).subscribe({
-      next: (response) => {
-        // Calcular el tiempo de procesamiento
-        const endTime = Date.now();
-        const processingTime = endTime - startTime;
-
-        this.addMessage({
-          content: response.answer,
-          isUser: false,
-          timestamp: new Date(),
-          sources: response.sources,
-          model: response.selected_model,
-          processingTime: processingTime,
-        });
+    // Send to RAG service (la respuesta llega en streaming)
+    let assistantMessage: ChatMessage | null = null;
+    this.isStreaming = true;
+
+    this.ragService.queryRAGStream(request).subscribe({
+      next: (event) => {
+        if (event.type === "sources") {
+          assistantMessage = {
+            content: "",
+            isUser: false,
+            timestamp: new Date(),
+            sources: event.sources,
+            model: this.parameters.model,
+          };
+          this.addMessage(assistantMessage);
+          this.isLoading = false;
+        } else if (event.type === "delta" && assistantMessage) {
+          assistantMessage.content += event.content;
+        } else if (event.type === "done" && assistantMessage) {
+          assistantMessage.model = event.selected_model;
+          if (event.session_id) {
+            this.sessionId = event.session_id;
+          }
+          // Calcular el tiempo de procesamiento
+          assistantMessage.processingTime = Date.now() - startTime;
+        }
+      },
+      complete: () => {
         this.isLoading = false;
+        this.isStreaming = false;
       },
       error: (error) => {
         // Calcular el tiempo de procesamiento incluso en caso de error
@@ -124,6 +142,7 @@ export class AppComponent implements OnInit {
           processingTime: processingTime,
         });
         this.isLoading = false;
+        this.isStreaming = false;
       },
     });
   }
@@ -141,6 +160,7 @@ export class AppComponent implements OnInit {
 
   clearChat() {
     this.messages = [];
+    this.sessionId = "new"; // La siguiente pregunta abre una conversación nueva
     this.ngOnInit(); // Add welcome message again
   }
 
@@ -3,8 +3,15 @@ export interface QueryRequest {
   model: string;
   temperature: number;
   context?: string;
+  sessionId?: string;
+  filters?: SearchFilters;
 }
 
+export type FilterValue = string | number | boolean;
+
+// Campo de metadatos -> valor o lista de valores (AND entre campos, OR dentro de uno)
+export type SearchFilters = Record<string, FilterValue | FilterValue[]>;
+
 export interface Source {
   title: string;
   content: string;
@@ -17,8 +24,19 @@ export interface QueryResponse {
   temperature: number;
   context: string;
   sources: Source[];
+  session_id?: string;
 }
 
+export type QueryStreamEvent =
+  | { type: "sources"; sources: Source[] }
+  | { type: "delta"; content: string }
+  | {
+      type: "done";
+      selected_model: string;
+      temperature: number;
+      session_id?: string;
+    };
+
 export interface ChatMessage {
   content: string;
   isUser: boolean;
@@ -1,8 +1,12 @@
 import { Injectable } from "@angular/core";
 import { HttpClient, HttpErrorResponse } from "@angular/common/http";
-import { Observable, throwError } from "rxjs";
+import { Observable, Subscriber, throwError } from "rxjs";
 import { catchError } from "rxjs/operators";
-import { QueryRequest, QueryResponse } from "../models/chat.models";
+import {
+  QueryRequest,
+  QueryResponse,
+  QueryStreamEvent,
+} from "../models/chat.models";
 
 @Injectable({
   providedIn: "root",
@@ -18,6 +22,96 @@ export class RagService {
       .pipe(catchError(this.handleError));
   }
 
+  /**
+   * Consulta /query/stream y emite los eventos SSE según llegan: primero las
+   * fuentes, luego los fragmentos de la respuesta y por último "done".
+   * HttpClient no expone el cuerpo en streaming, por eso se usa fetch.
+   */
+  queryRAGStream(request: QueryRequest): Observable<QueryStreamEvent> {
+    return new Observable<QueryStreamEvent>((subscriber) => {
+      const controller = new AbortController();
+
+      const readStream = async () => {
+        const response = await fetch(`${this.API_BASE_URL}/query/stream`, {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            Accept: "text/event-stream",
+          },
+          body: JSON.stringify(request),
+          signal: controller.signal,
+        });
+
+        if (!response.ok || !response.body) {
+          let errorMessage = `Error Code: ${response.status}\nMessage: ${response.statusText}`;
+          const body = await response.json().catch(() => null);
+          if (body && body.detail) {
+            errorMessage += `\nDetails: ${body.detail}`;
+          }
+          throw new Error(errorMessage);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) {
+            break;
+          }
+          buffer += decoder.decode(value, { stream: true });
+
+          // Cada evento SSE termina con una línea en blanco
+          let boundary = buffer.indexOf("\n\n");
+          while (boundary >= 0) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            this.emitStreamEvent(rawEvent, subscriber);
+            boundary = buffer.indexOf("\n\n");
+          }
+        }
+        subscriber.complete();
+      };
+
+      readStream().catch((error) => {
+        if (!controller.signal.aborted) {
+          console.error("RAG Service Error:", error.message);
+          subscriber.error(error);
+        }
+      });
+
+      return () => controller.abort();
+    });
+  }
+
+  private emitStreamEvent(
+    rawEvent: string,
+    subscriber: Subscriber<QueryStreamEvent>
+  ) {
+    let eventName = "message";
+    let data = "";
+    for (const line of rawEvent.split("\n")) {
+      if (line.startsWith("event:")) {
+        eventName = line.slice(6).trim();
+      } else if (line.startsWith("data:")) {
+        data += line.slice(5).trim();
+      }
+    }
+
+    const payload = data ? JSON.parse(data) : {};
+    if (eventName === "error") {
+      throw new Error(`Details: ${payload.detail}`);
+    }
+    if (
+      eventName === "sources" ||
+      eventName === "delta" ||
+      eventName === "done"
+    ) {
+      subscriber.next({ type: eventName, ...payload } as QueryStreamEvent);
+    }
+  }
+
   private handleError(error: HttpErrorResponse): Observable<never> {
     let errorMessage = "An unknown error occurred!";
 